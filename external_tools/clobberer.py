@@ -2,6 +2,7 @@
 # vim:sts=2 sw=2
 import sys
 import shutil
+import tempfile
 import urllib2
 import urllib
 import os
@@ -104,12 +105,34 @@ def rmdirRecursive(dir):
     os.rmdir(dir)
 
 
-def do_clobber(dir, dryrun=False, skip=None):
+def move_to_trash(f, trash):
+    """Rename f into its own directory under trash, for something else to
+    delete later.  Returns False if it can't be, e.g. because trash is on
+    another filesystem."""
+    try:
+        if not os.path.isdir(trash):
+            os.makedirs(trash)
+        holder = tempfile.mkdtemp(dir=trash, prefix=f + '.')
+    except OSError:
+        return False
+    try:
+        os.rename(f, os.path.join(holder, f))
+        return True
+    except OSError:
+        os.rmdir(holder)
+        return False
+
+
+def do_clobber(dir, dryrun=False, skip=None, trash=None):
     try:
         for f in os.listdir(dir):
             if skip is not None and f in skip:
                 print "Skipping", f
                 continue
+            if trash and os.path.isdir(f) and not os.path.islink(f):
+                print "Moving %s/ to %s" % (f, trash)
+                if dryrun or move_to_trash(f, trash):
+                    continue
             clobber_path = f + clobber_suffix
             if os.path.isfile(f):
                 print "Removing", f
@@ -177,6 +200,9 @@ if __name__ == "__main__":
                       action='append', dest='skip', default=['last-clobber'])
     parser.add_option('-d', '--dir', help='clobber this directory',
                       dest='dir', default='.', type='string')
+    parser.add_option('--trash', help='move directories into this directory '
+                      '(on the same filesystem) to be deleted later, rather '
+                      'than deleting them', dest='trash', default=None)
     parser.add_option('-v', '--verbose', help='be more verbose',
                       dest='verbose', action='store_true', default=False)
 
@@ -270,7 +296,8 @@ if __name__ == "__main__":
         if clobber:
             # Finally, perform a clobber if we're supposed to
             print "%s:Clobbering..." % builddir
-            do_clobber(builder_dir, options.dryrun, options.skip)
+            do_clobber(builder_dir, options.dryrun, options.skip,
+                       options.trash)
             write_file(our_clobber_date, "last-clobber")
 
         # If this is the build dir for the current job, display the clobber type in TBPL.
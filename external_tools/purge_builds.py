@@ -29,6 +29,17 @@ DEFAULT_BASE_DIRS = [".."]
 
 clobber_suffix = '.deleteme'
 
+# Held by whatever is emptying a trash dir, e.g. mozharness.base.trash's
+# background deleter.
+trash_lock_name = '.lock'
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 if sys.platform == 'win32':
     # os.statvfs doesn't work on Windows
     from win32file import RemoveDirectory, DeleteFile, \
@@ -117,6 +128,78 @@ def rmdirRecursive(dir):
     os.rmdir(dir)
 
 
+def lock_trash(trash):
+    """Return an open file descriptor holding trash's lock, or None if
+    something else (most likely a background deleter) holds it."""
+    fd = os.open(os.path.join(trash, trash_lock_name), os.O_RDWR | os.O_CREAT, 0666)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except IOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def empty_trash(trash_dirs, dry_run=False):
+    """Delete whatever's waiting to be deleted in trash_dirs, e.g. by
+    clobberer.py --trash, unless something else is already deleting it.
+
+    Returns the trash dirs that something else is emptying."""
+    busy = []
+    for trash in trash_dirs:
+        if not os.path.isdir(trash):
+            continue
+        fd = None
+        if not dry_run:
+            fd = lock_trash(trash)
+            if fd is None:
+                print "%s is being emptied in the background" % trash
+                busy.append(trash)
+                continue
+        try:
+            for name in os.listdir(trash):
+                if name == trash_lock_name:
+                    continue
+                p = os.path.join(trash, name)
+                print "Deleting", p
+                if not dry_run:
+                    try:
+                        rmdirRecursive(p)
+                    except:
+                        print >>sys.stderr, "Couldn't delete %s properly. Skipping." % p
+        finally:
+            if fd is not None:
+                # Closing the file releases the lock.
+                os.close(fd)
+    return busy
+
+
+def pending_bytes(trash_dirs):
+    "Returns the number of bytes deleting everything in `trash_dirs` will free"
+    total = 0
+    for trash in trash_dirs:
+        for root, dirs, files in os.walk(trash):
+            for name in dirs + files:
+                if root == trash and name == trash_lock_name:
+                    continue
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:
+                    # Being deleted as we look.
+                    continue
+                total += getattr(st, 'st_blocks', st.st_size / 512) * 512
+    return total
+
+
+def available_space(p, trash_dirs=()):
+    """Returns the number of bytes free under directory `p`, counting what's
+    still to be deleted from `trash_dirs` as free"""
+    return freespace(p) + pending_bytes(trash_dirs)
+
+
 def str2seconds(s):
     """ Accepts time intervals resembling:
          30d  (30 days)
@@ -133,11 +216,15 @@ def str2seconds(s):
         raise ValueError("Unhandled time format '%s'" % s)
 
 
-def purge(base_dirs, gigs, ignore, max_age, dry_run=False):
+def purge(base_dirs, gigs, ignore, max_age, dry_run=False, trash_dirs=()):
     """Delete directories under `base_dirs` until `gigs` GB are free.
 
     Delete any directories older than max_age.
 
+    If there isn't enough space free, whatever's in `trash_dirs` is deleted
+    before any builds are, except for trash dirs something else is already
+    emptying: what's left in those is counted as free space.
+
     Will not delete directories listed in the ignore list except
     those tagged with an expiry threshold.  Example:
 
@@ -174,13 +261,17 @@ def purge(base_dirs, gigs, ignore, max_age, dry_run=False):
 
     dirs.sort()
 
+    busy_trash_dirs = []
+    if trash_dirs and freespace(base_dirs[0]) < gigs:
+        busy_trash_dirs = empty_trash(trash_dirs, dry_run)
+
     while dirs:
         mtime, d = dirs.pop(0)
 
         # If we're newer than max_age, and don't need any more free space,
         # we're all done here
         if (not max_age) or (mtime > max_age):
-            if freespace(base_dirs[0]) >= gigs:
+            if available_space(base_dirs[0], busy_trash_dirs) >= gigs:
                 break
 
         print "Deleting", d
@@ -256,6 +347,12 @@ deleted.  note that since no directories are deleted, if the amount of free
 disk space in base_dir(s) is less than the required size, then ALL directories
 will be listed in the order in which they would be deleted.''')
 
+    parser.add_option('', '--trash', action='append', dest='trash_dirs',
+                      default=[],
+                      help='''directory of things waiting to be deleted in the
+            background; emptied before deleting any builds if there isn't
+            enough space.  Can be repeated.''')
+
     parser.add_option('', '--max-age', dest='max_age', type='int',
                       help='''maximum age (in days) for directories.  If any directory
             has an mtime older than this, it will be deleted, regardless of how
@@ -277,7 +374,8 @@ will be listed in the order in which they would be deleted.''')
     else:
         cutoff_time = None
 
-    purge(base_dirs, options.size, options.skip, cutoff_time, options.dry_run)
+    purge(base_dirs, options.size, options.skip, cutoff_time, options.dry_run,
+          options.trash_dirs)
 
     # Try to cleanup shared hg repos. We run here even if we've freed enough
     # space so we can be sure and delete repositories older than max_age
@@ -285,14 +383,15 @@ will be listed in the order in which they would be deleted.''')
         purge_hg_shares(os.environ['HG_SHARE_BASE_DIR'],
                         options.share_size, cutoff_time, options.dry_run)
 
-    after = freespace(base_dirs[0]) / (1024 * 1024 * 1024.0)
+    after = available_space(base_dirs[0], options.trash_dirs) / (1024 * 1024 * 1024.0)
 
     # Try to cleanup the current dir if we still need space and it will
     # actually help.
     if after < options.size:
         # We skip the tools dir here because we've usually just cloned it.
-        purge(['.'], options.size, ['tools'], cutoff_time, options.dry_run)
-        after = freespace(base_dirs[0]) / (1024 * 1024 * 1024.0)
+        purge(['.'], options.size, ['tools'], cutoff_time, options.dry_run,
+              options.trash_dirs)
+        after = available_space(base_dirs[0], options.trash_dirs) / (1024 * 1024 * 1024.0)
 
     if after < options.size:
         print "Error: unable to free %1.2f GB of space. " % options.size + \
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Host-wide cache of downloaded files, no mixins here!
+
+Files are stored by the sha512 of their contents, so any number of URLs
+(or a tooltool manifest) can refer to the same copy.  Several processes
+can share a cache directory: lock() serializes work on a URL, and
+everything is written to a temporary file and renamed into place.
+
+    cache = DownloadCache('/builds/download_cache', max_size=20 * 1024 ** 3)
+    with cache.lock(url):
+        path = cache.lookup(url, revalidate=is_unchanged)
+        if path:
+            cache.fetch(path, file_name)
+        else:
+            download(url, file_name)
+            cache.store(url, file_name, validators=validators)
+
+Layout of the cache directory:
+
+    objects/<sha512>        file contents; the same layout as a tooltool
+                            cache, so tooltool can be pointed at it
+    urls/<sha1 of url>      json: url, sha512, the size and mtime the
+                            object had when stored, and the response's
+                            validators (ETag, Last-Modified)
+    locks/<sha1 of key>     lock files
+    tmp/                    files on their way into objects/ or urls/
+
+DigestCache is a much smaller cousin: a json file of the digests of local
+files, keyed by file_signature(), so the same file is only ever read once
+to hash it, even across processes:
+
+    digests = DigestCache('/builds/digests.json')
+    digests.query(path, ['sha512', 'sha1'])  # {'sha512': ..., 'sha1': ...}
+"""
+
+from contextlib import contextmanager
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from mozharness.base.digests import file_digests, file_signature
+
+DEFAULT_MAX_SIZE = 20 * 1024 ** 3
+DEFAULT_MAX_DIGESTS = 5000
+# Files changed this recently may be changed again within the same mtime
+# tick, without their signature changing, so aren't worth remembering.
+RACY_SECONDS = 2
+
+
+def _lock_fd(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            # Retries for 10 seconds before giving up.
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+        except IOError, e:
+            if e.errno != errno.EDEADLOCK:
+                raise
+
+
+def _unlock_fd(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _key_name(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return hashlib.sha1(key).hexdigest()
+
+
+# DownloadCache {{{1
+class DownloadCache(object):
+    """A directory of downloaded files, keyed by URL and sha512, evicting
+    the least recently used files once it's bigger than max_size bytes.
+
+    Attributes:
+        hits (int): lookups that found a file.
+        misses (int): lookups that didn't.
+        hit_bytes (int): size of the files found.
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.urls_dir = os.path.join(self.cache_dir, 'urls')
+        self.locks_dir = os.path.join(self.cache_dir, 'locks')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        for d in (self.objects_dir, self.urls_dir, self.locks_dir, self.tmp_dir):
+            if not os.path.isdir(d):
+                try:
+                    os.makedirs(d)
+                except OSError, e:
+                    # Another process may have beaten us to it.
+                    if e.errno != errno.EEXIST:
+                        raise
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+
+    @contextmanager
+    def lock(self, key):
+        """Hold an exclusive lock on key (e.g. a URL) for the duration of the
+        with block, across processes.  Locks are released when their
+        process dies, so a killed job can't wedge the cache.
+        """
+        path = os.path.join(self.locks_dir, _key_name(key))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            _lock_fd(fd)
+            try:
+                yield
+            finally:
+                _unlock_fd(fd)
+        finally:
+            os.close(fd)
+
+    def _object_path(self, sha512):
+        return os.path.join(self.objects_dir, sha512)
+
+    def _url_path(self, url):
+        return os.path.join(self.urls_dir, _key_name(url))
+
+    def _read_url_entry(self, url):
+        try:
+            fh = open(self._url_path(url))
+            try:
+                entry = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def _rename_into_place(self, tmp_path, path):
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows won't rename over an existing file.
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+
+    def _mkstemp(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        return tmp_path
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def lookup(self, url, sha512=None, revalidate=None):
+        """Return the path of the cached copy of url, or None.
+
+        If sha512 is given, any cached file with those contents will do.
+        Otherwise, if revalidate is given, the copy cached for url is only
+        used if revalidate(validators), given query_validators(url), says
+        the server still has the same file.  Files changed since they were
+        stored (e.g. written to through a hardlink made by fetch()) are
+        thrown away.
+        """
+        path = self._find(url, sha512)
+        if path and not sha512 and revalidate and \
+                not revalidate(self.query_validators(url)):
+            path = None
+        if path is None:
+            self.misses += 1
+            return None
+        st = os.stat(path)
+        # Keep the mtime, which we check above; the atime is what we evict by.
+        os.utime(path, (time.time(), st.st_mtime))
+        self.hits += 1
+        self.hit_bytes += st.st_size
+        return path
+
+    def _find(self, url, sha512):
+        entry = None
+        if url is not None:
+            entry = self._read_url_entry(url)
+        if sha512 and entry and entry['sha512'] != sha512:
+            entry = None
+        if not entry and not sha512:
+            return None
+        path = self._object_path(sha512 or entry['sha512'])
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry:
+            # lookup() sets the mtime back with os.utime(), which may round
+            # it a little.
+            if st.st_size == entry['size'] and \
+                    abs(st.st_mtime - entry['mtime']) < 0.001:
+                return path
+        elif file_digests(path)['sha512'] == sha512:
+            return path
+        self._remove(path)
+        return None
+
+    def query_validators(self, url):
+        """Return the validators stored with url (see store()), or {}."""
+        entry = self._read_url_entry(url)
+        if not entry:
+            return {}
+        return entry.get('validators') or {}
+
+    def store(self, url, file_name, sha512=None, verified=False,
+              validators=None):
+        """Add file_name, downloaded from url, to the cache.
+
+        Returns the sha512 of the file, or None if it doesn't match sha512.
+        Set verified if sha512 is already known to be right, to save reading
+        the file.  validators, e.g. the response's ETag and Last-Modified
+        headers, are kept for query_validators().
+        """
+        if sha512 and verified:
+            digest = sha512
+        else:
+            digest = file_digests(file_name)['sha512']
+        if sha512 and digest != sha512:
+            return None
+        path = self._object_path(digest)
+        with self.lock(digest):
+            if not self._find(None, digest):
+                tmp_path = self._mkstemp()
+                try:
+                    shutil.copyfile(file_name, tmp_path)
+                    self._rename_into_place(tmp_path, path)
+                except:
+                    self._remove(tmp_path)
+                    raise
+            st = os.stat(path)
+            entry = {'url': url, 'sha512': digest,
+                     'size': st.st_size, 'mtime': st.st_mtime}
+            if validators:
+                entry['validators'] = validators
+            tmp_path = self._mkstemp()
+            fh = open(tmp_path, 'w')
+            try:
+                json.dump(entry, fh)
+            finally:
+                fh.close()
+            self._rename_into_place(tmp_path, self._url_path(url))
+        self.evict()
+        return digest
+
+    def fetch(self, path, dest):
+        """Put the cached file path at dest, by hardlink if possible.
+
+        Returns 'hardlink' or 'copy'.
+        """
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(path, dest)
+            return 'hardlink'
+        except (AttributeError, OSError):
+            # No os.link() on Windows; or another filesystem.
+            shutil.copyfile(path, dest)
+            return 'copy'
+
+    def evict(self):
+        """Remove the least recently used files until the cache is no bigger
+        than max_size.
+        """
+        with self.lock('evict'):
+            files = []
+            total = 0
+            for name in os.listdir(self.objects_dir):
+                path = os.path.join(self.objects_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+            files.sort()
+            while files and total > self.max_size:
+                atime, size, path = files.pop(0)
+                self._remove(path)
+                total -= size
+
+
+# DigestCache {{{1
+class DigestCache(object):
+    """Digests of local files, stored in the json file path and keyed by
+    their (dev, inode, size, mtime in ns), keeping the max_entries most
+    recently stored.
+
+    Attributes:
+        hits (int): digests found in the cache.
+        misses (int): digests that had to be computed.
+    """
+    def __init__(self, path, max_entries=DEFAULT_MAX_DIGESTS):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    @staticmethod
+    def _key(signature):
+        return ':'.join([str(i) for i in signature])
+
+    def _read(self):
+        try:
+            fh = open(self.path)
+            try:
+                entries = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def lookup(self, path, algorithms=('sha512', )):
+        """Return a dict of the digests of path in algorithms that are
+        cached, which may be missing some or all of them.
+        """
+        if self._entries is None:
+            self._entries = self._read()
+        try:
+            key = self._key(file_signature(path))
+        except OSError:
+            return {}
+        entry = self._entries.get(key)
+        if not entry:
+            return {}
+        return dict([(a, entry['digests'][a]) for a in algorithms
+                     if a in entry['digests']])
+
+    def store(self, path, digests, signature=None):
+        """Add digests (algorithm name -> hex digest) of path, computed
+        while its signature was `signature` (default: as it is now).
+
+        Returns whether they were stored; they aren't if path has changed
+        since, or too recently to tell whether it's changed again.
+        """
+        try:
+            current = file_signature(path)
+        except OSError:
+            return False
+        if signature is None:
+            signature = current
+        if signature != current or \
+                signature[3] > (time.time() - RACY_SECONDS) * 1e9:
+            return False
+        key = self._key(signature)
+        lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            _lock_fd(lock_fd)
+            try:
+                # Merge with whatever other processes have stored meanwhile.
+                entries = self._read()
+                entry = entries.get(key) or {'digests': {}}
+                entry['digests'].update(digests)
+                entry['path'] = os.path.abspath(path)
+                entry['stored'] = time.time()
+                entries[key] = entry
+                if len(entries) > self.max_entries:
+                    keep = sorted(entries.items(),
+                                  key=lambda i: i[1].get('stored', 0))
+                    entries = dict(keep[-self.max_entries:])
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self.path),
+                    prefix=os.path.basename(self.path) + '.')
+                fh = os.fdopen(fd, 'w')
+                try:
+                    json.dump(entries, fh)
+                finally:
+                    fh.close()
+                try:
+                    os.rename(tmp_path, self.path)
+                except OSError:
+                    # Windows won't rename over an existing file.
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                    os.rename(tmp_path, self.path)
+                self._entries = entries
+            finally:
+                _unlock_fd(lock_fd)
+        finally:
+            os.close(lock_fd)
+        return True
+
+    def query(self, path, algorithms=('sha512', )):
+        """Return a dict of algorithm name -> hex digest of path, reading
+        it (once, for all the missing algorithms) only if they aren't
+        cached.
+        """
+        digests = self.lookup(path, algorithms)
+        self.hits += len(digests)
+        missing = [a for a in algorithms if a not in digests]
+        if missing:
+            self.misses += len(missing)
+            signature = file_signature(path)
+            computed = file_digests(path, missing)
+            try:
+                self.store(path, computed, signature)
+            except (IOError, OSError):
+                # Not being able to remember them is no reason to fail.
+                pass
+            digests.update(computed)
+        return digests
@@ -25,6 +25,7 @@ TODO:
 """
 
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser, Option, OptionGroup
 import os
 import sys
@@ -36,6 +37,9 @@ try:
 except ImportError:
     import json
 
+from mozharness.base.cache import DownloadCache
+from mozharness.base.configcache import CONFIG_CACHE_ENV, ConfigCache, \
+    query_cache_dir as query_config_cache_dir
 from mozharness.base.log import DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL
 
 
@@ -84,18 +88,71 @@ class LockedTuple(tuple):
 
 # ReadOnlyDict {{{1
 class ReadOnlyDict(dict):
+    """A dict that can be locked against changes.
+
+    Locking is cheap: lock() only copies the lists and dicts directly in
+    the dict, so neither changes to the dict it was made from nor writes
+    through dict(d)[key] reach it.  Anything nested deeper isn't rebuilt up
+    front, but made immutable (as LockedTuple/ReadOnlyDict) the first time
+    it's read, and the immutable copy kept in its place.  Until then, it's
+    shared with the dict it was made from, so e.g. changes to
+    original['env']['PATH'] still show in d['env']['PATH'] if nothing has
+    read it yet.
+    """
     def __init__(self, dictionary):
         self._lock = False
-        self.update(dictionary.copy())
+        dict.update(self, dictionary)
 
     def _check_lock(self):
         assert not self._lock, "ReadOnlyDict is locked!"
 
     def lock(self):
-        for (k, v) in self.items():
-            self[k] = make_immutable(v)
+        for key, value in dict.items(self):
+            if isinstance(value, (list, tuple)) and \
+                    not isinstance(value, LockedTuple):
+                dict.__setitem__(self, key, LockedTuple(value))
+            elif isinstance(value, dict) and \
+                    not (isinstance(value, ReadOnlyDict) and value._lock):
+                # Locked without locking what's in it, which stays lazy.
+                value = ReadOnlyDict(value)
+                value._lock = True
+                dict.__setitem__(self, key, value)
         self._lock = True
 
+    def _frozen(self, key, value):
+        if not self._lock or isinstance(value, LockedTuple) or \
+                (isinstance(value, ReadOnlyDict) and value._lock):
+            return value
+        if isinstance(value, (list, tuple, dict)):
+            value = make_immutable(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._frozen(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def iteritems(self):
+        for key in dict.keys(self):
+            yield key, self[key]
+
+    def itervalues(self):
+        for key in dict.keys(self):
+            yield self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def copy(self):
+        return dict(self.iteritems())
+
     def __setitem__(self, *args):
         self._check_lock()
         return dict.__setitem__(self, *args)
@@ -131,14 +188,30 @@ class ReadOnlyDict(dict):
         for k, v in self.__dict__.items():
             setattr(result, k, deepcopy(v, memo))
         result._lock = False
-        for k, v in self.items():
-            result[k] = deepcopy(v, memo)
+        # Straight from storage; nothing needs freezing to be copied.
+        for k, v in dict.iteritems(self):
+            dict.__setitem__(result, k, deepcopy(v, memo))
         return result
 
 # parse_config_file {{{1
+# The ConfigCache in $MOZHARNESS_CONFIG_CACHE, made on first use.
+_config_cache = None
+
+
+def _query_config_cache():
+    global _config_cache
+    cache_dir = query_config_cache_dir()
+    if _config_cache is None or _config_cache.cache_dir != os.path.abspath(cache_dir):
+        _config_cache = ConfigCache(cache_dir)
+    return _config_cache
+
+
 def parse_config_file(file_name, quiet=False, search_path=None,
                       config_dict_name="config"):
     """Read a config file and return a dictionary.
+
+    If $MOZHARNESS_CONFIG_CACHE is set, python config files are evaluated
+    through the ConfigCache there; see mozharness.base.configcache.
     """
     file_path = None
     if os.path.exists(file_name):
@@ -153,7 +226,9 @@ def parse_config_file(file_name, quiet=False, search_path=None,
                 break
         else:
             raise IOError("Can't find %s in %s!" % (file_name, search_path))
-    if file_name.endswith('.py'):
+    if file_name.endswith('.py') and query_config_cache_dir():
+        config = _query_config_cache().load(file_path, config_dict_name)
+    elif file_name.endswith('.py'):
         global_dict = {}
         local_dict = {}
         execfile(file_path, global_dict, local_dict)
@@ -170,49 +245,117 @@ def parse_config_file(file_name, quiet=False, search_path=None,
     return config
 
 
-def download_config_file(url, file_name):
+# How many config files download_config_files() fetches at a time.
+MAX_CONFIG_DOWNLOADS = 8
+# Response headers kept with cached remote config files, and the request
+# headers that revalidate them.
+VALIDATORS = {
+    'ETag': 'If-None-Match',
+    'Last-Modified': 'If-Modified-Since',
+}
+
+
+def download_config_file(url, file_name, cache=None, attempts=5,
+                         sleeptime=60, max_sleeptime=5 * 60):
+    """Download url to file_name, trying up to `attempts` times, sleeping
+    sleeptime seconds after the first failure and twice as long after each
+    one after that, up to max_sleeptime.
+
+    If cache (a DownloadCache) is given, a cached copy of url is only
+    downloaded again if the server says it has changed, and is used
+    instead, with a warning, if the server can't be reached.
+    """
+    if cache is None:
+        return _download_config_file(url, file_name, None, attempts,
+                                     sleeptime, max_sleeptime)
+    with cache.lock(url):
+        return _download_config_file(url, file_name, cache, attempts,
+                                     sleeptime, max_sleeptime)
+
+
+def _download_config_file(url, file_name, cache, attempts, sleeptime,
+                          max_sleeptime):
+    headers = {}
+    cached = None
+    if cache:
+        cached = cache.lookup(url)
+    if cached:
+        for name, value in cache.query_validators(url).items():
+            if name in VALIDATORS:
+                headers[VALIDATORS[name]] = value
     n = 0
-    attempts = 5
-    sleeptime = 60
-    max_sleeptime = 5 * 60
     while True:
-        if n >= attempts:
-            print "Failed to download from url %s after %d attempts, quiting..." % (url, attempts)
-            raise SystemError(-1)
+        unreachable = True
         try:
-            contents = urllib2.urlopen(url, timeout=30).read()
+            response = urllib2.urlopen(urllib2.Request(url, headers=headers),
+                                       timeout=30)
+            contents = response.read()
             break
+        except urllib2.HTTPError, e:
+            if e.code == 304 and cached:
+                cache.fetch(cached, file_name)
+                return
+            print "Error downloading from url %s: %s" % (url, str(e))
+            unreachable = e.code >= 500
         except urllib2.URLError, e:
             print "Error downloading from url %s: %s" % (url, str(e))
         except socket.timeout, e:
             print "Time out accessing %s: %s" % (url, str(e))
         except socket.error, e:
             print "Socket error when accessing %s: %s" % (url, str(e))
+        n += 1
+        if cached and unreachable:
+            print "WARNING: using the cached copy of %s" % url
+            cache.fetch(cached, file_name)
+            return
+        if n >= attempts:
+            print "Failed to download from url %s after %d attempts, quiting..." % (url, attempts)
+            raise SystemError(-1)
         print "Sleeping %d seconds before retrying" % sleeptime
         time.sleep(sleeptime)
         sleeptime = sleeptime * 2
         if sleeptime > max_sleeptime:
             sleeptime = max_sleeptime
-        n += 1
 
     try:
+        if os.path.exists(file_name):
+            # It may be a hardlink to a cached copy.
+            os.remove(file_name)
         f = open(file_name, 'w')
         f.write(contents)
         f.close()
-    except IOError, e:
+    except (IOError, OSError), e:
         print "Error writing downloaded contents to file %s: %s" % (file_name, str(e))
         raise SystemError(-1)
+    if cache:
+        validators = {}
+        for name in VALIDATORS:
+            if response.info().getheader(name):
+                validators[name] = response.info().getheader(name)
+        cache.store(url, file_name, validators=validators)
 
 
 # BaseConfig {{{1
+# Origins of config keys that weren't set by a config file.
+SCRIPT_CONFIG = '<script>'
+COMMAND_LINE = '<command line>'
+
+
 class BaseConfig(object):
     """Basic config setting/getting.
+
+    The config is layered together from the script's config, each config
+    file in turn and the command line options; config_origins records the
+    layer (config file name, SCRIPT_CONFIG or COMMAND_LINE) that each key's
+    value came from.
     """
     def __init__(self, config=None, initial_config_file=None, config_options=None,
                  all_actions=None, default_actions=None,
                  volatile_config=None, option_args=None,
-                 require_config_file=False, usage="usage: %prog [options]"):
+                 require_config_file=False, action_dependencies=None,
+                 usage="usage: %prog [options]"):
         self._config = {}
+        self.config_origins = {}
         self.all_cfg_files_and_dicts = []
         self.actions = []
         self.config_lock = False
@@ -226,6 +369,11 @@ class BaseConfig(object):
             self.default_actions = default_actions[:]
         else:
             self.default_actions = self.all_actions[:]
+        self.action_dependencies = {}
+        if action_dependencies:
+            self.action_dependencies = self.verify_action_dependencies(
+                action_dependencies
+            )
         if volatile_config is None:
             self.volatile_config = {
                 'actions': None,
@@ -242,7 +390,7 @@ class BaseConfig(object):
             self.all_cfg_files_and_dicts.append(
                 (initial_config_file, initial_config)
             )
-            self.set_config(initial_config)
+            self.set_config(initial_config, origin=initial_config_file)
             # Since initial_config_file is only set when running unit tests,
             # if no option_args have been specified, then the parser will
             # parse sys.argv which in this case would be the command line
@@ -275,6 +423,19 @@ class BaseConfig(object):
             type="string", default=os.getcwd(),
             help="Specify the absolute path of the parent of the working directory"
         )
+        self.config_parser.add_option(
+            "--parallel-actions", action="store", dest="parallel_actions",
+            type="int",
+            help="Run independent actions concurrently on up to this many "
+                 "threads; only takes effect for scripts that declare "
+                 "action dependencies"
+        )
+        self.config_parser.add_option(
+            "--deferred-delete", action="store_true", dest="deferred_delete",
+            default=False,
+            help="Clobber by moving directories into the trash and deleting "
+                 "them in the background"
+        )
         self.config_parser.add_option(
             "-c", "--config-file", "--cfg", action="extend", dest="config_files",
             type="string", help="Specify a config file; can be repeated"
@@ -285,6 +446,29 @@ class BaseConfig(object):
             help="Specify an optional config file, like --config-file but with no "
                  "error if the file is missing; can be repeated"
         )
+        self.config_parser.add_option(
+            "--remote-config-cache-dir", action="store",
+            dest="remote_config_cache_dir", type="string",
+            help="Cache config files given by url here, only downloading "
+                 "them again when they change (default: remote/ in "
+                 "$%s, if set)" % CONFIG_CACHE_ENV
+        )
+        self.config_parser.add_option(
+            "--remote-config-retries", action="store",
+            dest="remote_config_retries", type="int", default=5,
+            help="How many times to try downloading a config file"
+        )
+        self.config_parser.add_option(
+            "--remote-config-retry-sleep", action="store",
+            dest="remote_config_retry_sleep", type="float", default=60,
+            help="Seconds to sleep after a failed config file download, "
+                 "doubling after each further failure"
+        )
+        self.config_parser.add_option(
+            "--remote-config-max-retry-sleep", action="store",
+            dest="remote_config_max_retry_sleep", type="float", default=5 * 60,
+            help="The longest to sleep between config file downloads"
+        )
         self.config_parser.add_option(
             "--dump-config", action="store_true",
             dest="dump_config",
@@ -299,6 +483,18 @@ class BaseConfig(object):
                  "keys/values that were not overwritten by another cfg -- "
                  "held the highest hierarchy."
         )
+        self.config_parser.add_option(
+            "--trace", action="store_true", dest="trace", default=False,
+            help="Write a timeline of actions, commands, downloads and "
+                 "retries to trace.json in the log dir, for chrome://tracing"
+        )
+        self.config_parser.add_option(
+            "--profile-actions", action="extend", dest="profile_actions",
+            metavar="ACTIONS",
+            help="Profile these actions ('all' for every action, or 'run' "
+                 "for the whole run), writing pstats files and flamegraph "
+                 "input to the upload dir; can be repeated"
+        )
 
         # Logging
         log_option_group = OptionGroup(self.config_parser, "Logging")
@@ -317,6 +513,11 @@ class BaseConfig(object):
             dest="append_to_log", default=False,
             help="Append to the log"
         )
+        log_option_group.add_option(
+            "--async-log", action="store_true",
+            dest="async_log", default=False,
+            help="Write the log files from a background thread, in batches"
+        )
         log_option_group.add_option(
             "--multi-log", action="store_const", const="multi",
             dest="log_type", help="Log using MultiFileLogger"
@@ -371,12 +572,15 @@ class BaseConfig(object):
             for option in config_options:
                 self.config_parser.add_option(*option[0], **option[1])
 
-    def set_config(self, config, overwrite=False):
+    def set_config(self, config, overwrite=False, origin=SCRIPT_CONFIG):
         """This is probably doable some other way."""
         if self._config and not overwrite:
             self._config.update(config)
         else:
             self._config = config
+            self.config_origins = {}
+        if origin:
+            self.config_origins.update(dict.fromkeys(config, origin))
         return self._config
 
     def get_actions(self):
@@ -404,6 +608,22 @@ class BaseConfig(object):
             print("Invalid action found: " + str(e))
             raise SystemExit(-1)
 
+    def verify_action_dependencies(self, action_dependencies):
+        """Make sure every action in `action_dependencies` and every action
+        it depends on is in self.all_actions, and that actions only depend
+        on actions that come before them in self.all_actions.  The latter
+        also guarantees the dependency graph has no cycles.
+        """
+        for action, dependencies in action_dependencies.items():
+            self.verify_actions([action] + list(dependencies))
+            index = self.all_actions.index(action)
+            for dependency in dependencies:
+                if self.all_actions.index(dependency) >= index:
+                    print("Action %s can't depend on %s, which comes after "
+                          "it in %s" % (action, dependency, self.all_actions))
+                    raise SystemExit(-1)
+        return dict((k, list(v)) for k, v in action_dependencies.items())
+
     def list_actions(self):
         print "Actions available:"
         for a in self.all_actions:
@@ -429,12 +649,15 @@ class BaseConfig(object):
         `mozharness.mozilla.building.buildbase.BuildingConfig` for an example.
         """
         all_cfg_files_and_dicts = []
+        downloads = self.download_config_files(
+            [cf for cf in all_config_files if '://' in cf], options
+        )
         for cf in all_config_files:
             try:
                 if '://' in cf:  # config file is an url
-                    file_name = os.path.basename(cf)
-                    file_path = os.path.join(os.getcwd(), file_name)
-                    download_config_file(cf, file_path)
+                    file_path, error = downloads[cf]
+                    if error:
+                        raise error
                     all_cfg_files_and_dicts.append(
                         (file_path, parse_config_file(file_path))
                     )
@@ -449,6 +672,57 @@ class BaseConfig(object):
                     raise
         return all_cfg_files_and_dicts
 
+    def download_config_files(self, urls, options):
+        """Download the config files at urls into the current directory,
+        all at once.  Each is named after its url's basename, prefixed with
+        its index in urls if an earlier url has the same basename.
+
+        Returns a dict of url: (file_path, error), where error is the
+        exception downloading url raised, if any.
+        """
+        cache = None
+        cache_dir = getattr(options, 'remote_config_cache_dir', None)
+        if not cache_dir and query_config_cache_dir():
+            cache_dir = os.path.join(query_config_cache_dir(), 'remote')
+        if cache_dir and urls:
+            cache = DownloadCache(cache_dir)
+
+        file_paths = {}
+        for i, url in enumerate(urls):
+            if url in file_paths:
+                continue
+            file_name = os.path.basename(url)
+            file_path = os.path.join(os.getcwd(), file_name)
+            if file_path in file_paths.values():
+                file_path = os.path.join(os.getcwd(),
+                                         '%d-%s' % (i, file_name))
+            file_paths[url] = file_path
+
+        def download(url):
+            file_path = file_paths[url]
+            try:
+                download_config_file(
+                    url, file_path, cache=cache,
+                    attempts=getattr(options, 'remote_config_retries', 5),
+                    sleeptime=getattr(options, 'remote_config_retry_sleep', 60),
+                    max_sleeptime=getattr(options,
+                                          'remote_config_max_retry_sleep',
+                                          5 * 60),
+                )
+            except Exception, e:
+                return url, (file_path, e)
+            return url, (file_path, None)
+
+        urls = sorted(file_paths, key=urls.index)
+        if len(urls) < 2:
+            return dict(map(download, urls))
+        pool = ThreadPool(min(len(urls), MAX_CONFIG_DOWNLOADS))
+        try:
+            return dict(pool.map(download, urls))
+        finally:
+            pool.close()
+            pool.join()
+
     def parse_args(self, args=None):
         """Parse command line arguments in a generic way.
         Return the parser object after adding the basic options, so
@@ -477,14 +751,17 @@ class BaseConfig(object):
                 options.config_files + options.opt_config_files, options=options
             ))
             config = {}
+            origins = {}
             for i, (c_file, c_dict) in enumerate(self.all_cfg_files_and_dicts):
                 config.update(c_dict)
+                origins.update(dict.fromkeys(c_dict, c_file))
             # assign or update self._config depending on if it exists or not
             #    NOTE self._config will be passed to ReadOnlyConfig's init -- a
             #    dict subclass with immutable locking capabilities -- and serve
             #    as the keys/values that make up that instance. Ultimately,
             #    this becomes self.config during BaseScript's init
-            self.set_config(config)
+            self.set_config(config, origin=None)
+            self.config_origins.update(origins)
         for key in defaults.keys():
             value = getattr(options, key)
             if value is None:
@@ -493,6 +770,7 @@ class BaseConfig(object):
             if key in defaults and value == defaults[key] and key in self._config:
                 continue
             self._config[key] = value
+            self.config_origins[key] = COMMAND_LINE
 
         # The idea behind the volatile_config is we don't want to save this
         # info over multiple runs.  This defaults to the action-specific
@@ -501,6 +779,7 @@ class BaseConfig(object):
             if self._config.get(key) is not None:
                 self.volatile_config[key] = self._config[key]
                 del(self._config[key])
+                self.config_origins.pop(key, None)
 
         """Actions.
 
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""A cache of evaluated python config files, no mixins here!
+
+Set MOZHARNESS_CONFIG_CACHE to a directory to have parse_config_file()
+keep the config dicts it gets from .py files there, marshalled, and load
+them from there rather than running the files again.
+
+An entry is used only if nothing it was made from has changed:
+
+* the config file, and any file it read or imported from outside the
+  standard library, have the same size and mtime, or failing that (e.g.
+  after a fresh checkout) the same contents;
+* whatever it, or anything it execfile()d or imported, used of its
+  surroundings is the same: the current directory if it calls os.getcwd()
+  or os.path.abspath(), the hostname if it calls socket.gethostname(),
+  and so on (see CONTEXT_NAMES);
+* it's the same python.
+
+There's one entry per config file, so evaluating it somewhere else (e.g.
+in another directory, for a config that uses os.getcwd()) replaces it.
+
+Config files that use things that can't be checked cheaply, like
+os.environ or os.path.exists(), or that execfile() or import files that
+do, aren't cached at all (see UNCACHEABLE_NAMES); neither are config
+dicts that can't be marshalled.
+
+    python -m mozharness.base.configcache warm [-C DIR] CONFIG|DIR ...
+    python -m mozharness.base.configcache clear
+
+warm the cache with (all the configs under) the given paths, evaluated
+in DIR; or empty it.  --cache-dir overrides MOZHARNESS_CONFIG_CACHE.
+"""
+
+import errno
+import hashlib
+import marshal
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+import __builtin__
+
+CONFIG_CACHE_ENV = 'MOZHARNESS_CONFIG_CACHE'
+# Bump when the entry format changes.
+CACHE_VERSION = 1
+# Files changed this recently may change again within the same mtime tick,
+# so their contents are checked instead.
+RACY_SECONDS = 2
+STDLIB_DIR = os.path.dirname(os.path.abspath(os.__file__))
+
+
+def _expanduser_context():
+    return (os.environ.get('HOME'), os.environ.get('USERPROFILE'))
+
+
+# Names that, if a config's code uses them, make the result depend on
+# something besides its files; and how to get each of those somethings.
+CONTEXT_NAMES = {
+    'getcwd': 'cwd',
+    'abspath': 'cwd',
+    'realpath': 'cwd',
+    'relpath': 'cwd',
+    'gethostname': 'hostname',
+    'getfqdn': 'fqdn',
+    'expanduser': 'home',
+    'platform': 'uname',
+    'system': 'uname',
+    'uname': 'uname',
+    'machine': 'uname',
+    'architecture': 'architecture',
+    'executable': 'executable',
+}
+CONTEXT = {
+    'python': lambda: (sys.version, sys.maxsize, sys.platform),
+    'cwd': lambda: os.getcwd(),
+    'hostname': lambda: socket.gethostname(),
+    'fqdn': lambda: socket.getfqdn(),
+    'home': _expanduser_context,
+    'uname': lambda: platform.uname(),
+    'architecture': lambda: platform.architecture(),
+    'executable': lambda: sys.executable,
+}
+
+# Names that make a config's result depend on something we can't check.
+UNCACHEABLE_NAMES = frozenset([
+    'environ', 'getenv', 'expandvars', 'argv',
+    'exists', 'lexists', 'isfile', 'isdir', 'islink', 'listdir', 'walk',
+    'glob', 'iglob', 'stat', 'lstat', 'getmtime', 'getsize',
+    'time', 'datetime', 'date', 'random', 'uuid', 'urandom', 'getpid',
+    'getuser', 'getlogin', 'Popen', 'check_output', 'check_call', 'call',
+    'urlopen', 'mac_ver', 'win32_ver', 'linux_distribution', 'dist',
+    'cpu_count',
+])
+
+
+class UncacheableConfig(Exception):
+    pass
+
+
+def query_cache_dir():
+    """Return the cache directory from the environment, or None."""
+    return os.environ.get(CONFIG_CACHE_ENV) or None
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names.update(_code_names(const))
+    return names
+
+
+def _context(keys):
+    """Return a dict of the CONTEXT keys -> their current values."""
+    return dict([(key, CONTEXT[key]()) for key in keys])
+
+
+def _sha1_file(path):
+    fh = open(path, 'rb')
+    try:
+        return hashlib.sha1(fh.read()).hexdigest()
+    finally:
+        fh.close()
+
+
+def _file_state(path, now):
+    """Return (path, size, mtime in ns, sha1) for path, the mtime None if
+    it's too recent to go by."""
+    st = os.stat(path)
+    mtime_ns = int(round(st.st_mtime * 1e9))
+    if st.st_mtime > now - RACY_SECONDS:
+        mtime_ns = None
+    return (path, st.st_size, mtime_ns, _sha1_file(path))
+
+
+def _module_source(module):
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    if not path.endswith('.py') or not os.path.isfile(path):
+        return None
+    if path.startswith(STDLIB_DIR + os.sep) and \
+            'site-packages' not in path[len(STDLIB_DIR):]:
+        return None
+    return path
+
+
+# run_config_file {{{1
+def run_config_file(file_path, config_dict_name='config'):
+    """Run the python config file file_path, returning its
+    config_dict_name dict, the list of files it read: itself, files it
+    opened or execfile()d, and the non-standard-library modules it
+    imported; and the list of those that are code: all but the opened
+    files.
+    """
+    file_path = os.path.abspath(file_path)
+    read = [file_path]
+    code = [file_path]
+
+    def record(path, is_code=False):
+        path = os.path.abspath(path)
+        if path not in read:
+            read.append(path)
+        if is_code and path not in code:
+            code.append(path)
+
+    def tracking_open(name, mode='r', *args):
+        if not any(c in mode for c in 'wa+'):
+            record(name)
+        return __builtin__.open(name, mode, *args)
+
+    def tracking_execfile(name, globals=None, locals=None):
+        record(name, is_code=True)
+        if globals is None:
+            # Into the caller's namespace, as execfile() does.
+            frame = sys._getframe(1)
+            globals, locals = frame.f_globals, frame.f_locals
+        return __builtin__.execfile(name, globals,
+                                    globals if locals is None else locals)
+
+    def tracking_import(name, globals=None, locals=None, fromlist=None,
+                        level=-1):
+        module = __builtin__.__import__(name, globals, locals, fromlist, level)
+        # The module itself, its parents, and any submodules in fromlist.
+        parts = name.split('.')
+        names = ['.'.join(parts[:i + 1]) for i in range(len(parts))]
+        names.extend(['%s.%s' % (name, f) for f in fromlist or ()])
+        for n in names:
+            path = _module_source(sys.modules.get(n))
+            if path:
+                record(path, is_code=True)
+        return module
+
+    builtins = dict(vars(__builtin__))
+    builtins.update({'open': tracking_open, 'file': tracking_open,
+                     'execfile': tracking_execfile,
+                     '__import__': tracking_import})
+    global_dict = {'__builtins__': builtins}
+    local_dict = {}
+    execfile(file_path, global_dict, local_dict)
+    return local_dict[config_dict_name], read, code
+
+
+# ConfigCache {{{1
+class ConfigCache(object):
+    """Evaluated python config files, stored in cache_dir.
+
+    Attributes:
+        hits (int): configs loaded from the cache.
+        misses (int): configs that had to be run.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, file_path, config_dict_name):
+        key = repr((CACHE_VERSION, file_path, config_dict_name))
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key).hexdigest() + '.marshal')
+
+    def _inspect(self, file_path):
+        """Return the CONTEXT keys file_path's result depends on, or raise
+        UncacheableConfig."""
+        fh = open(file_path, 'rU')
+        try:
+            code = compile(fh.read(), file_path, 'exec')
+        finally:
+            fh.close()
+        names = _code_names(code)
+        uncacheable = names & UNCACHEABLE_NAMES
+        if uncacheable:
+            raise UncacheableConfig("%s uses %s" %
+                                    (file_path, ', '.join(sorted(uncacheable))))
+        return set(['python'] + [CONTEXT_NAMES[n] for n in names
+                                 if n in CONTEXT_NAMES])
+
+    def _read_entry(self, path):
+        try:
+            fh = open(path, 'rb')
+            try:
+                return marshal.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def _write_entry(self, path, entry):
+        try:
+            data = marshal.dumps(entry)
+        except ValueError:
+            raise UncacheableConfig("Can't marshal the config")
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        fh = os.fdopen(fd, 'wb')
+        try:
+            fh.write(data)
+        finally:
+            fh.close()
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows won't rename over an existing file.
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+
+    def _check_files(self, files):
+        """Return whether files (as _file_state() gives them) are
+        unchanged, and whether that took reading any of them."""
+        read_any = False
+        for path, size, mtime_ns, sha1 in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False, read_any
+            if st.st_size != size:
+                return False, read_any
+            if mtime_ns is not None and \
+                    int(round(st.st_mtime * 1e9)) == mtime_ns:
+                continue
+            read_any = True
+            if _sha1_file(path) != sha1:
+                return False, read_any
+        return True, read_any
+
+    def load(self, file_path, config_dict_name='config'):
+        """Return the config_dict_name dict from the python config file
+        file_path, from the cache if we can, running it (and caching the
+        result) if we can't.
+        """
+        file_path = os.path.abspath(file_path)
+        entry_path = self._entry_path(file_path, config_dict_name)
+        entry = self._read_entry(entry_path)
+        if isinstance(entry, dict):
+            unchanged, read_any = self._check_files(entry['files'])
+            if unchanged and entry.get('uncacheable'):
+                # Don't bother looking at it again.
+                self.misses += 1
+                return run_config_file(file_path, config_dict_name)[0]
+            context = entry.get('context', {})
+            if unchanged and _context(context.keys()) == context:
+                self.hits += 1
+                if read_any:
+                    # Only mtimes changed; save checking contents next time.
+                    self._store(entry_path, entry['config'], context,
+                                [f[0] for f in entry['files']])
+                return entry['config']
+        self.misses += 1
+        start = time.time()
+        try:
+            keys = self._inspect(file_path)
+        except UncacheableConfig:
+            self._store(entry_path, None, None, [file_path], start)
+            return run_config_file(file_path, config_dict_name)[0]
+        context = _context(keys)
+        config, files, code = run_config_file(file_path, config_dict_name)
+        # What it execfile()d or imported counts as much as the file itself.
+        try:
+            for path in code[1:]:
+                context.update(_context(self._inspect(path) - set(context)))
+        except UncacheableConfig:
+            self._store(entry_path, None, None, files, start)
+            return config
+        self._store(entry_path, config, context, files, start)
+        return config
+
+    def _store(self, entry_path, config, context, files, now=None):
+        """Write an entry; with a context of None, one saying the config in
+        files[0] isn't cacheable."""
+        if now is None:
+            now = time.time()
+        try:
+            entry = {'files': [_file_state(f, now) for f in files]}
+            if context is None:
+                entry['uncacheable'] = True
+            else:
+                entry.update({'context': context, 'config': config})
+            self._write_entry(entry_path, entry)
+        except UncacheableConfig:
+            if context is not None:
+                self._store(entry_path, None, None, files[:1], now)
+        except (IOError, OSError):
+            # Caching is only ever an optimization.
+            pass
+
+    def warm(self, file_path, config_dict_name='config'):
+        """Cache file_path, returning whether it's cacheable."""
+        self.load(file_path, config_dict_name)
+        entry = self._read_entry(self._entry_path(os.path.abspath(file_path),
+                                                  config_dict_name))
+        return bool(entry and 'config' in entry)
+
+    def clear(self):
+        """Remove every entry, returning how many there were."""
+        count = 0
+        if not os.path.isdir(self.cache_dir):
+            return count
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.marshal'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    count += 1
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return count
+
+
+# __main__ {{{1
+def main(args=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] warm CONFIG|DIR ...\n"
+                                "       %prog [options] clear")
+    parser.add_option('--cache-dir', dest='cache_dir',
+                      default=query_cache_dir(),
+                      help="cache directory (default $%s)" % CONFIG_CACHE_ENV)
+    parser.add_option('-C', '--directory', dest='directory',
+                      help="evaluate configs in this directory, as the jobs "
+                           "using them will")
+    options, args = parser.parse_args(args)
+    if not options.cache_dir:
+        parser.error("No cache directory; set $%s or use --cache-dir" %
+                     CONFIG_CACHE_ENV)
+    cache = ConfigCache(options.cache_dir)
+    if args[:1] == ['clear'] and len(args) == 1:
+        print "Removed %d cached configs" % cache.clear()
+        return 0
+    if args[:1] != ['warm'] or len(args) < 2:
+        parser.error("Expected warm CONFIG|DIR ... or clear")
+    paths = []
+    for path in args[1:]:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                paths.extend([os.path.join(root, f) for f in sorted(files)
+                              if f.endswith('.py')])
+        else:
+            paths.append(path)
+    paths = [os.path.abspath(p) for p in paths]
+    cwd = os.getcwd()
+    if options.directory:
+        os.chdir(options.directory)
+    cached = 0
+    try:
+        for path in paths:
+            try:
+                if cache.warm(path):
+                    cached += 1
+                else:
+                    print "Not cacheable: %s" % path
+            except Exception, e:
+                print "Can't evaluate %s: %s" % (path, str(e))
+    finally:
+        os.chdir(cwd)
+    print "Cached %d of %d configs" % (cached, len(paths))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Computing file digests, ideally while the bytes go by anyway.
+No mixins here!
+
+    hashers = new_hashers(['sha512', 'sha1'])
+    out = DigestingWriter(open(dest, 'wb'), hashers)
+    ... out.write(block) ...
+    out.close()
+    hexdigests(hashers)  # {'sha512': ..., 'sha1': ...}
+"""
+
+import hashlib
+import mmap
+import os
+
+BLOCK_SIZE = 1024 ** 2
+
+
+class DigestMismatchError(Exception):
+    pass
+
+
+def new_hashers(algorithms):
+    """Return a dict of algorithm name -> new hashlib object."""
+    return dict([(algorithm, hashlib.new(algorithm))
+                 for algorithm in algorithms])
+
+
+def update_hashers(hashers, data):
+    for hasher in hashers.values():
+        hasher.update(data)
+
+
+def hexdigests(hashers):
+    """Return a dict of algorithm name -> hex digest."""
+    return dict([(algorithm, hasher.hexdigest())
+                 for algorithm, hasher in hashers.items()])
+
+
+def _hash_mmap(fh, hashers, size, block_size):
+    """Feed the first size bytes of fh to hashers through a memory map,
+    saving copying them into strings.  Returns False if fh can't be mapped
+    (e.g. it's a pipe), having hashed nothing.
+    """
+    try:
+        mapped = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return False
+    try:
+        for offset in xrange(0, size, block_size):
+            update_hashers(hashers, buffer(mapped, offset, block_size))
+    finally:
+        mapped.close()
+    return True
+
+
+def hash_file(path, hashers, length=None, block_size=BLOCK_SIZE):
+    """Feed the contents of path, or its first `length` bytes, to hashers."""
+    fh = open(path, 'rb')
+    try:
+        size = os.fstat(fh.fileno()).st_size
+        if length is not None:
+            size = min(size, length)
+        if size and _hash_mmap(fh, hashers, size, block_size):
+            return hashers
+        while length is None or length > 0:
+            size = block_size
+            if length is not None:
+                size = min(size, length)
+                length -= size
+            block = fh.read(size)
+            if not block:
+                break
+            update_hashers(hashers, block)
+    finally:
+        fh.close()
+    return hashers
+
+
+def file_digests(path, algorithms=('sha512', )):
+    """Return a dict of algorithm name -> hex digest of the contents of path,
+    reading it once.
+    """
+    return hexdigests(hash_file(path, new_hashers(algorithms)))
+
+
+def file_signature(path):
+    """Return (dev, inode, size, mtime in ns) of path, which changes
+    whenever it's written to, for telling whether a digest we computed
+    earlier still applies.
+    """
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, int(round(st.st_mtime * 1e9)))
+
+
+class DigestingWriter(object):
+    """Wrap a file object opened for writing, hashing everything written
+    to it.  Can be given to gzip.GzipFile(fileobj=...) to hash the
+    compressed output.
+    """
+    def __init__(self, fileobj, hashers):
+        self.fileobj = fileobj
+        self.hashers = hashers
+
+    def write(self, data):
+        update_hashers(self.hashers, data)
+        self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
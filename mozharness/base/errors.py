@@ -12,7 +12,8 @@ Each line of output is matched against each substring or regular expression
 in the error list.  On a match, we determine the 'level' of that line,
 whether IGNORE, DEBUG, INFO, WARNING, ERROR, CRITICAL, or FATAL.
 
-TODO: Context lines (requires work on the OutputParser side)
+Entries may also set 'context_lines' ('pre:post') to log the lines around
+a match at its level too; see OutputParser.
 
 TODO: We could also create classes that generate these, but with the
 appropriate level (please don't die on any errors; please die on any
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Extracting zip and tar archives in-process, no mixins here!
+
+Zip members are spread over a pool of processes, since inflating is CPU
+bound; tars can only be read from start to end, so they're extracted as
+they stream through one process.
+
+    stats = extract_archive('tests.zip', 'tests', ['bin/*', 'mochitest/*'])
+    # {'files': 1234, 'bytes': 56789012, 'seconds': 3.4}
+
+Patterns are unzip-style wildcards, where * matches / too, as used for
+target_unzip_dirs.
+
+Tars can also be extracted as they're downloaded, with the download running
+on a thread ahead of the decompression:
+
+    stream = ReadAheadStream(urllib2.urlopen(url), copy=open(path, 'wb'))
+    stats = extract_archive(url, dest, fileobj=stream)
+    stream.close()
+"""
+
+import errno
+import os
+import Queue
+import stat
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+from mozharness.base.remotezip import match_members
+
+# Zips with less than this much to inflate aren't worth starting a pool for.
+PARALLEL_MIN_SIZE = 8 * 1024 ** 2
+# Members are handed to the pool in batches of roughly this much data.
+BATCH_SIZE = 4 * 1024 ** 2
+BLOCK_SIZE = 1024 ** 2
+
+ARCHIVE_SUFFIXES = (
+    ('.zip', 'zip'),
+    ('.jar', 'zip'),
+    ('.apk', 'zip'),
+    ('.tar.gz', 'tar'),
+    ('.tgz', 'tar'),
+    ('.tar.bz2', 'tar'),
+    ('.tar', 'tar'),
+)
+
+
+class ExtractError(Exception):
+    pass
+
+
+# ReadAheadStream {{{1
+class ReadAheadStream(object):
+    """Read fileobj (e.g. a urllib2 response) on a thread, up to max_blocks
+    blocks ahead of whoever's reading from us, so downloading can overlap
+    with decompressing.  Everything read is written to copy too, if given.
+
+    Attributes:
+        bytes_read (int): bytes read from fileobj so far.
+    """
+    def __init__(self, fileobj, copy=None, block_size=BLOCK_SIZE // 4,
+                 max_blocks=16):
+        self.fileobj = fileobj
+        self.copy = copy
+        self.block_size = block_size
+        self.bytes_read = 0
+        self._queue = Queue.Queue(max_blocks)
+        self._buffer = ''
+        self._eof = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stopped:
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except Queue.Full:
+                pass
+
+    def _run(self):
+        try:
+            while not self._stopped:
+                block = self.fileobj.read(self.block_size)
+                self.bytes_read += len(block)
+                if block and self.copy:
+                    self.copy.write(block)
+                self._put((block, None))
+                if not block:
+                    return
+        except Exception:
+            self._put((None, sys.exc_info()))
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            block, exc_info = self._queue.get()
+            if exc_info:
+                self._eof = True
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if not block:
+                self._eof = True
+            self._buffer += block
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def drain(self):
+        """Read (and copy) the rest of fileobj."""
+        while self.read(self.block_size):
+            pass
+
+    def close(self):
+        """Stop reading; doesn't close fileobj or copy."""
+        self._stopped = True
+        self._thread.join()
+
+
+def archive_type(path, sniff=True):
+    """Return 'zip' or 'tar' for path, going by its name, then (if sniff is
+    set) its contents; or None.
+    """
+    for suffix, kind in ARCHIVE_SUFFIXES:
+        if path.endswith(suffix):
+            return kind
+    if not sniff:
+        return None
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    if tarfile.is_tarfile(path):
+        return 'tar'
+    return None
+
+
+def is_safe_name(name):
+    """Whether extracting the member name stays inside the destination."""
+    name = name.replace('\\', '/')
+    return not (name.startswith('/') or '..' in name.split('/') or
+                (len(name) > 1 and name[1] == ':'))
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _remove_existing(path):
+    """Get read-only files or stale symlinks out of the way, as unzip -o
+    and tar do."""
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+
+
+# zip {{{1
+def _extract_zip_member(zf, info, dest):
+    path = os.path.join(dest, *info.filename.split('/'))
+    if info.filename.endswith('/'):
+        _makedirs(path)
+        return 0
+    mode = (info.external_attr >> 16) & 0xFFFF
+    _remove_existing(path)
+    if stat.S_ISLNK(mode) and hasattr(os, 'symlink'):
+        os.symlink(zf.read(info), path)
+        return 0
+    source = zf.open(info)
+    target = open(path, 'wb')
+    try:
+        while True:
+            block = source.read(1024 ** 2)
+            if not block:
+                break
+            target.write(block)
+    finally:
+        target.close()
+        source.close()
+    if stat.S_IMODE(mode):
+        os.chmod(path, stat.S_IMODE(mode))
+    return info.file_size
+
+
+# The ZipFile each pool process reads from.
+_pool_zip = None
+
+
+def _init_zip_worker(path):
+    global _pool_zip
+    _pool_zip = zipfile.ZipFile(path)
+
+
+def _extract_zip_batch(args):
+    dest, names = args
+    size = 0
+    for name in names:
+        size += _extract_zip_member(_pool_zip, _pool_zip.getinfo(name), dest)
+    return size
+
+
+def _batches(members, batch_size):
+    batch, size = [], 0
+    for info in members:
+        batch.append(info.filename)
+        size += info.compress_size
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def extract_zip(path, dest, patterns=None, processes=None,
+                parallel_min_size=PARALLEL_MIN_SIZE, batch_size=BATCH_SIZE):
+    """Extract the members of the zip path matching patterns into dest,
+    keeping their permissions.
+
+    processes defaults to the number of CPUs; 1 extracts everything in
+    this process.
+
+    Returns the list of zipfile.ZipInfo objects extracted.
+    """
+    zf = zipfile.ZipFile(path)
+    try:
+        wanted = set(match_members(zf.namelist(), patterns))
+        members = [i for i in zf.infolist()
+                   if i.filename in wanted and is_safe_name(i.filename)]
+        # Read the zip from start to end, as far as we can.
+        members.sort(key=lambda i: i.header_offset)
+        # Create every directory up front, so workers don't race to.
+        dirs = set([os.path.dirname(os.path.join(dest, *i.filename.split('/')))
+                    for i in members])
+        for d in sorted(dirs):
+            _makedirs(d)
+        if processes is None and multiprocessing:
+            try:
+                processes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                processes = 1
+        total = sum([i.compress_size for i in members])
+        if not multiprocessing or processes <= 1 or len(members) < 2 or \
+                total < parallel_min_size:
+            for info in members:
+                _extract_zip_member(zf, info, dest)
+            return members
+    finally:
+        zf.close()
+    pool = multiprocessing.Pool(processes, _init_zip_worker, (path, ))
+    try:
+        # Enough batches to keep every process busy.
+        batch_size = min(batch_size, total / processes + 1)
+        work = [(dest, batch) for batch in _batches(members, batch_size)]
+        for size in pool.imap_unordered(_extract_zip_batch, work):
+            pass
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return members
+
+
+# tar {{{1
+def extract_tar(path, dest, patterns=None, fileobj=None):
+    """Extract the members of the (possibly gzipped or bzip2ed) tar path,
+    or fileobj if given, matching patterns into dest, as they're
+    decompressed.
+
+    Returns the list of tarfile.TarInfo objects extracted.
+    """
+    members = []
+    directories = []
+    # 'r|*' reads the tar as a stream, never seeking back.
+    tar = tarfile.open(path, 'r|*', fileobj=fileobj)
+    try:
+        for info in tar:
+            if not is_safe_name(info.name) or \
+                    not match_members([info.name], patterns):
+                continue
+            target = os.path.join(dest, info.name)
+            if info.isdir():
+                # Set their permissions last, like tarfile.extractall(), in
+                # case they're read-only.
+                _makedirs(target)
+                directories.append((target, info))
+            else:
+                _remove_existing(target)
+                tar.extract(info, dest)
+            members.append(info)
+    finally:
+        tar.close()
+    for target, info in reversed(directories):
+        os.chmod(target, info.mode)
+    return members
+
+
+# extract_archive {{{1
+def extract_archive(path, dest, patterns=None, processes=None, fileobj=None):
+    """Extract the zip or tar path into dest, keeping only the members
+    matching patterns if given.
+
+    If fileobj is given, path is only used for its name, and the archive
+    (which has to be a tar) is read from fileobj.
+
+    Returns a dict with the number of 'files' and 'bytes' extracted and
+    the 'seconds' it took.
+    """
+    kind = archive_type(path, sniff=not fileobj)
+    if fileobj and kind != 'tar':
+        raise ExtractError("Can only extract tars as they're read, not %s" % path)
+    if kind is None:
+        raise ExtractError("Don't know how to extract %s" % path)
+    _makedirs(dest)
+    start = time.time()
+    if kind == 'zip':
+        try:
+            members = extract_zip(path, dest, patterns, processes=processes)
+        except zipfile.BadZipfile, e:
+            raise ExtractError("Can't extract %s: %s" % (path, str(e)))
+        size = sum([i.file_size for i in members])
+    else:
+        try:
+            members = extract_tar(path, dest, patterns, fileobj=fileobj)
+        except tarfile.TarError, e:
+            raise ExtractError("Can't extract %s: %s" % (path, str(e)))
+        size = sum([i.size for i in members])
+    return {'files': len(members), 'bytes': size,
+            'seconds': time.time() - start}
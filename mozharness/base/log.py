@@ -24,10 +24,16 @@ TODO:
 - log rotation config
 """
 
+import atexit
+import collections
 from datetime import datetime
 import logging
 import os
+import re
+import sre_constants
+import sre_parse
 import sys
+import threading
 import traceback
 
 # Define our own FATAL_LEVEL
@@ -242,26 +248,190 @@ class LogMixin(object):
         pass
 
 
+# ErrorListMatcher {{{1
+MAX_CACHED_MATCHERS = 64
+
+
+def _required_literal(regex):
+    """Return the longest run of literal characters that every match of
+    the compiled regex must contain, or None if we can't tell.
+    """
+    if regex.flags & ~(re.UNICODE | re.LOCALE):
+        # e.g. re.I
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (re.error, AssertionError, TypeError):
+        return None
+    if parsed.pattern.flags & ~(re.UNICODE | re.LOCALE):
+        # inline flags, e.g. (?i)
+        return None
+    to_char = chr
+    if isinstance(regex.pattern, unicode):
+        to_char = unichr
+    best = run = ''
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            run += to_char(av)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ''
+    return best or None
+
+
+class ErrorListMatcher(object):
+    """An error_list compiled for matching many lines.
+
+    Every 'substr' entry, and most 'regex' entries, can only match lines
+    containing some literal string; all of those strings are combined into
+    a single prefilter regex.  Lines the prefilter doesn't match (usually
+    most of them) are only checked against the few entries we couldn't
+    find a literal for; the rest are checked against every entry, in
+    error_list order, so the first matching entry still wins.
+
+    Entries that appear more than once in the error_list, as happens when
+    the lists in mozharness.base.errors are concatenated, are only checked
+    the first time: a later copy can never be the first match.
+    """
+
+    def __init__(self, error_list):
+        """Compile error_list.
+
+        Args:
+            error_list (list): list of dicts with either a 'substr' or a
+                               compiled 'regex' key, as used by OutputParser.
+        """
+        self.error_list = error_list
+        self.size = len(error_list)
+        # (error_check, kind) for every entry we need to check
+        self.entries = []
+        # the entries that can match without the prefilter matching
+        self.unfiltered = []
+        literals = []
+        seen = set()
+        for error_check in error_list:
+            if 'substr' in error_check:
+                kind = 'substr'
+                literal = error_check['substr']
+            elif 'regex' in error_check:
+                kind = 'regex'
+                literal = _required_literal(error_check['regex'])
+            else:
+                # Not a valid entry; it gets a warning every time it's checked.
+                kind = literal = None
+            if kind:
+                if id(error_check) in seen:
+                    continue
+                seen.add(id(error_check))
+            self.entries.append((error_check, kind))
+            if literal and isinstance(literal, basestring):
+                if literal not in literals:
+                    literals.append(literal)
+            else:
+                self.unfiltered.append((error_check, kind))
+        self.prefilter = None
+        if literals:
+            pattern = '|'.join([re.escape(l) for l in literals])
+            try:
+                self.prefilter = re.compile(pattern)
+            except (re.error, AssertionError, UnicodeError):
+                self.unfiltered = self.entries
+
+    def match(self, line, warn=None):
+        """Return the first entry of the error_list matching line, or None.
+
+        Args:
+            line (str): output line to match.
+            warn (function, optional): called with each entry that has neither
+                                       a 'substr' nor a 'regex' key that's
+                                       checked before a match is found.
+        """
+        entries = self.entries
+        if self.prefilter is None or not self.prefilter.search(line):
+            entries = self.unfiltered
+        for error_check, kind in entries:
+            if kind == 'substr':
+                if error_check['substr'] in line:
+                    return error_check
+            elif kind == 'regex':
+                if error_check['regex'].search(line):
+                    return error_check
+            elif warn:
+                warn(error_check)
+
+
+def parse_context_lines(context_lines):
+    """Parse an error_list entry's 'context_lines'.
+
+    Args:
+        context_lines (str | tuple): 'pre:post', where either may be left out
+                                     (e.g. '5:5', '20:', ':3'), or a
+                                     (pre, post) tuple.
+
+    Returns:
+        tuple: the number of (pre, post) context lines.
+    """
+    if isinstance(context_lines, basestring):
+        pre, _, post = context_lines.partition(':')
+        context_lines = (pre.strip() or 0, post.strip() or 0)
+    pre, post = context_lines
+    return int(pre), int(post)
+
+
+# error_list entries' ids -> (error_list, ErrorListMatcher)
+_error_list_matchers = {}
+
+
+def get_error_list_matcher(error_list):
+    """Return an ErrorListMatcher for error_list, reusing a cached one if
+    we've already compiled a list with the same entries.
+
+    Since error lists are usually built by concatenating the module-level
+    lists in mozharness.base.errors, the cache is keyed on the identity of
+    the entries rather than of the list itself.
+
+    Args:
+        error_list (list): error_list to compile.
+
+    Returns:
+        ErrorListMatcher: the compiled error_list.
+    """
+    key = tuple([id(error_check) for error_check in error_list])
+    cached = _error_list_matchers.get(key)
+    if cached is not None:
+        return cached[1]
+    matcher = ErrorListMatcher(error_list)
+    if len(_error_list_matchers) >= MAX_CACHED_MATCHERS:
+        _error_list_matchers.clear()
+    # Keep a copy of the list around so the entries' ids can't be reused.
+    _error_list_matchers[key] = (list(error_list), matcher)
+    return matcher
+
+
 # OutputParser {{{1
 class OutputParser(LogMixin):
     """ Helper object to parse command output.
 
-    This will buffer output if needed, so we can go back and mark
-    [(linenum - 10) : linenum+10] as errors if need be, without having to
-    get all the output first.
-
-    linenum+10 will be easy; we can set self.num_post_context_lines to 10,
-    and self.num_post_context_lines-- as we mark each line to at least error
-    level X.
-
-    linenum-10 will be trickier. We'll not only need to save the line
-    itself, but also the level that we've set for that line previously,
-    whether by matching on that line, or by a previous line's context.
-    We should only log that line if all output has ended (self.finish() ?);
-    otherwise store a list of dictionaries in self.context_buffer that is
-    buffered up to self.num_pre_context_lines (set to the largest
-    pre-context-line setting in error_list.)
+    error_list entries may set 'context_lines' to 'pre:post' (e.g. '5:5',
+    '20:', ':3') or a (pre, post) tuple, to also log that many lines before
+    and after a matching line at (at least) its level, e.g. so they end up
+    in the error log.
+
+    Post-context is easy: we set self.num_post_context_lines and count it
+    down as we log each following line.  For pre-context, we hold back up to
+    self.num_pre_context_lines lines (the largest pre-context in error_list)
+    in self.context_buffer, a deque of {'message', 'level', 'summary'} dicts,
+    and only log each one once it falls off the end of the buffer or
+    finish() is called, so memory use doesn't grow with the output.  Until
+    finish() is called the last lines parsed may not have been logged yet.
+
+    Attributes:
+        log_prefix (str): prepended to every line this parser logs, e.g. to
+                          tell apart the output of commands run concurrently
+                          by ScriptMixin.run_commands. Defaults to ''.
     """
+    log_prefix = ''
 
     def __init__(self, config=None, log_obj=None, error_list=None, log_output=True):
         """Initialization method for the OutputParser class
@@ -283,12 +453,30 @@ class OutputParser(LogMixin):
         self.log_output = log_output
         self.num_errors = 0
         self.num_warnings = 0
-        # TODO context_lines.
-        # Not in use yet, but will be based off error_list.
-        self.context_buffer = []
+        self.context_buffer = collections.deque(maxlen=0)
         self.num_pre_context_lines = 0
         self.num_post_context_lines = 0
+        self.post_context_level = INFO
         self.worst_log_level = INFO
+        self._error_list_matcher = None
+        # (error_list, len(error_list)) _error_list_matcher was resolved for
+        self._matched_error_list = None
+
+    def log(self, message, level=INFO, exit_code=-1):
+        """ prepend `log_prefix` to each line of the message, then log it using
+        LogMixin.log
+
+        Args:
+            message (str): message to be logged
+            level (str, optional): logging level of the message. Defaults to INFO
+            exit_code (int, optional): exit code to log before the scripts calls
+                                       SystemExit.
+        """
+        if self.log_prefix:
+            message = '\n'.join(['%s%s' % (self.log_prefix, line)
+                                 for line in message.splitlines()])
+        return super(OutputParser, self).log(message, level=level,
+                                             exit_code=exit_code)
 
     def parse_single_line(self, line):
         """ parse a console output line and check if it matches one in `error_list`,
@@ -297,38 +485,98 @@ class OutputParser(LogMixin):
         Args:
             line (str): command line output to parse.
         """
+        matched = self._matched_error_list
+        if matched is None or matched[0] is not self.error_list or \
+                matched[1] != len(self.error_list):
+            self._error_list_matcher = get_error_list_matcher(self.error_list)
+            self._matched_error_list = (self.error_list,
+                                        len(self.error_list))
+            self._resize_context_buffer()
+        matcher = self._error_list_matcher
+        error_check = matcher.match(line, warn=self._warn_bad_error_check)
+        if error_check is not None:
+            log_level = error_check.get('level', INFO)
+            if self.log_output:
+                message = ' %s' % line
+                if error_check.get('explanation'):
+                    message += '\n %s' % error_check['explanation']
+                self._add_context_line(message, log_level,
+                                       summary=bool(error_check.get('summary')),
+                                       context_lines=error_check.get('context_lines'))
+            if log_level in (ERROR, CRITICAL, FATAL):
+                self.num_errors += 1
+            if log_level == WARNING:
+                self.num_warnings += 1
+            self.worst_log_level = self.worst_level(log_level,
+                                                    self.worst_log_level)
+        else:
+            if self.log_output:
+                self._add_context_line(' %s' % line, INFO)
+
+    def _resize_context_buffer(self):
+        """ size context_buffer for the largest pre-context in error_list.
+        """
+        pre_lines = [0]
         for error_check in self.error_list:
-            # TODO buffer for context_lines.
-            match = False
-            if 'substr' in error_check:
-                if error_check['substr'] in line:
-                    match = True
-            elif 'regex' in error_check:
-                if error_check['regex'].search(line):
-                    match = True
+            if error_check.get('context_lines'):
+                pre_lines.append(parse_context_lines(error_check['context_lines'])[0])
+        self.num_pre_context_lines = max(pre_lines)
+        if self.num_pre_context_lines == self.context_buffer.maxlen:
+            return
+        while len(self.context_buffer) > self.num_pre_context_lines:
+            self._log_context_line(self.context_buffer.popleft())
+        self.context_buffer = collections.deque(self.context_buffer,
+                                                maxlen=self.num_pre_context_lines)
+
+    def _add_context_line(self, message, level, summary=False, context_lines=None):
+        """ queue a message for logging, raising the level of the lines around
+        it if this is a match with context_lines.
+        """
+        if not (self.context_buffer.maxlen or self.num_post_context_lines or
+                context_lines):
+            if summary:
+                self.add_summary(message, level=level)
             else:
-                self.warning("error_list: 'substr' and 'regex' not in %s" %
-                             error_check)
-            if match:
-                log_level = error_check.get('level', INFO)
-                if self.log_output:
-                    message = ' %s' % line
-                    if error_check.get('explanation'):
-                        message += '\n %s' % error_check['explanation']
-                    if error_check.get('summary'):
-                        self.add_summary(message, level=log_level)
-                    else:
-                        self.log(message, level=log_level)
-                if log_level in (ERROR, CRITICAL, FATAL):
-                    self.num_errors += 1
-                if log_level == WARNING:
-                    self.num_warnings += 1
-                self.worst_log_level = self.worst_level(log_level,
-                                                        self.worst_log_level)
-                break
+                self.log(message, level=level)
+            return
+        entry = {'message': message, 'level': level, 'summary': summary}
+        if self.num_post_context_lines > 0:
+            self.num_post_context_lines -= 1
+            entry['level'] = self.worst_level(self.post_context_level, level)
+        if context_lines:
+            pre, post = parse_context_lines(context_lines)
+            if pre:
+                for previous in list(self.context_buffer)[-pre:]:
+                    previous['level'] = self.worst_level(level, previous['level'])
+            if post:
+                if self.num_post_context_lines > 0:
+                    level = self.worst_level(level, self.post_context_level)
+                self.post_context_level = level
+                self.num_post_context_lines = max(post, self.num_post_context_lines)
+        if not self.context_buffer.maxlen:
+            self._log_context_line(entry)
+            return
+        if len(self.context_buffer) == self.context_buffer.maxlen:
+            self._log_context_line(self.context_buffer.popleft())
+        self.context_buffer.append(entry)
+
+    def _log_context_line(self, entry):
+        if entry['summary']:
+            self.add_summary(entry['message'], level=entry['level'])
         else:
-            if self.log_output:
-                self.info(' %s' % line)
+            self.log(entry['message'], level=entry['level'])
+
+    def finish(self):
+        """ log any lines still held back for pre-context.
+
+        Call this once all the output has been parsed.
+        """
+        while self.context_buffer:
+            self._log_context_line(self.context_buffer.popleft())
+
+    def _warn_bad_error_check(self, error_check):
+        self.warning("error_list: 'substr' and 'regex' not in %s" %
+                     error_check)
 
     def add_lines(self, output):
         """ process a string or list of strings, decode them to utf-8,strip
@@ -349,6 +597,136 @@ class OutputParser(LogMixin):
             self.parse_single_line(line)
 
 
+# LogWriter {{{1
+class LogWriter(object):
+    """ Write log files from a background thread.
+
+    BatchedFileHandlers only append formatted records to a list; every
+    `interval` seconds, or sooner once a handler has `batch_size` records
+    pending, the writer thread writes each handler's pending records to its
+    file at once and flushes it, instead of once per record per file.
+    flush() writes everything pending from the calling thread, and close()
+    does so once more and stops the thread; that happens at exit anyway, so
+    it isn't left running while the interpreter shuts down.
+    """
+
+    def __init__(self, interval=1, batch_size=1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.handlers = []
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.thread = threading.Thread(target=self._run, name='LogWriter')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    def wakeup(self):
+        """ ask the writer thread to write pending records now.
+        """
+        self._wakeup.set()
+
+    def flush(self):
+        """ write every handler's pending records.
+        """
+        for handler in list(self.handlers):
+            handler.write_pending()
+
+    def close(self):
+        """ stop the writer thread, and write what's still pending.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except (IOError, OSError, ValueError):
+                # e.g. a full disk, or a file closed under us; there's
+                # nobody to report it to from this thread.
+                pass
+
+
+class BatchedFileHandler(logging.FileHandler):
+    """ `logging.FileHandler` whose writes are batched by a LogWriter.
+
+    Records are formatted in the logging thread, exactly as FileHandler
+    would, so the files' contents don't change.  Handlers sharing a format
+    (like MultiFileLogger's per-level files) only format each record once.
+    """
+
+    def __init__(self, filename, log_writer, mode='a'):
+        logging.FileHandler.__init__(self, filename, mode=mode)
+        self.log_writer = log_writer
+        self.pending = []
+        # Held while writing, so batches are written in order.
+        self.write_lock = threading.Lock()
+        log_writer.add_handler(self)
+
+    def format(self, record):
+        formatter = self.formatter or logging._defaultFormatter
+        key = (getattr(formatter, '_fmt', None), getattr(formatter, 'datefmt', None))
+        cache = record.__dict__.setdefault('_mozharness_formatted', {})
+        if key not in cache:
+            cache[key] = logging.FileHandler.format(self, record)
+        return cache[key]
+
+    def emit(self, record):
+        try:
+            data = '%s\n' % self.format(record)
+            if isinstance(data, unicode):
+                # What file.write() would do with it.
+                try:
+                    data = data.encode(sys.getdefaultencoding())
+                except UnicodeError:
+                    data = data.encode('UTF-8')
+            if self.stream is None:
+                self.stream = self._open()
+            self.pending.append(data)
+            if len(self.pending) == self.log_writer.batch_size:
+                self.log_writer.wakeup()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def write_pending(self):
+        """ write and flush the records emitted since the last call.
+        """
+        with self.write_lock:
+            self.acquire()
+            try:
+                pending, self.pending = self.pending, []
+                stream = self.stream
+            finally:
+                self.release()
+            if pending and stream is not None:
+                stream.write(''.join(pending))
+                stream.flush()
+
+    def flush(self):
+        self.write_pending()
+
+    def close(self):
+        self.write_pending()
+        self.log_writer.remove_handler(self)
+        logging.FileHandler.close(self)
+
+
 # BaseLogger {{{1
 class BaseLogger(object):
     """ Base class in charge of logging handling logic such as creating logging
@@ -374,6 +752,7 @@ class BaseLogger(object):
         log_to_raw=False,
         logger_name='',
         append_to_log=False,
+        async_log=False,
     ):
         """ BaseLogger constructor
 
@@ -398,6 +777,9 @@ class BaseLogger(object):
                                          objects that don't trample each other.
             append_to_log (bool, optional): set to True if the logging content should
                                             be appended to old logging files. Defaults to False
+            async_log (bool, optional): set to True to write the log files from a
+                                        background thread, in batches; see
+                                        `LogWriter`. Defaults to False
         """
 
         self.log_format = log_format
@@ -408,6 +790,9 @@ class BaseLogger(object):
         self.log_name = log_name
         self.log_dir = log_dir
         self.append_to_log = append_to_log
+        self.log_writer = None
+        if async_log:
+            self.log_writer = LogWriter()
 
         # Not sure what I'm going to use this for; useless unless we
         # can have multiple logging objects that don't trample each other
@@ -551,13 +936,22 @@ class BaseLogger(object):
 
         if not self.append_to_log and os.path.exists(log_path):
             os.remove(log_path)
-        file_handler = logging.FileHandler(log_path)
+        if self.log_writer:
+            file_handler = BatchedFileHandler(log_path, self.log_writer)
+        else:
+            file_handler = logging.FileHandler(log_path)
         file_handler.setLevel(self.get_logger_level(log_level))
         file_handler.setFormatter(self.get_log_formatter(log_format=log_format,
                                                          date_format=date_format))
         self.logger.addHandler(file_handler)
         self.all_handlers.append(file_handler)
 
+    def flush(self):
+        """ wait for any log lines queued for writing to reach the log files.
+        """
+        if self.log_writer:
+            self.log_writer.flush()
+
     def log_message(self, message, level=INFO, exit_code=-1, post_fatal_callback=None):
         """ Generic log method.
         There should be more options here -- do or don't split by line,
@@ -584,6 +978,7 @@ class BaseLogger(object):
                 self.logger.log(FATAL_LEVEL, "Running post_fatal callback...")
                 post_fatal_callback(message=message, exit_code=exit_code)
             self.logger.log(FATAL_LEVEL, 'Exiting %d' % exit_code)
+            self.flush()
             raise SystemExit(exit_code)
 
 
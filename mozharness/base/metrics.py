@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Sending stats without waiting on the network, no mixins here!
+
+MetricsEmitter.record() appends InfluxDB series to a spool file and
+returns straight away; a background thread sends what's in the spool to a
+sink in batches, backing off while the sink is failing.  Whatever isn't
+sent by close() stays in the spool, and goes out when the next job using
+the same spool file starts:
+
+    emitter = MetricsEmitter('/builds/influx-spool.json',
+                             HTTPSink(influxdb_url))
+    emitter.start()
+    emitter.record([{'name': 'mozharness', 'columns': [...],
+                     'points': [[...]]}])
+    emitter.close()
+
+A sink is anything with a send(series_list) method that raises
+MetricsSinkError (or anything else) on failure; FileSink writes to a local
+file, for tests.
+"""
+
+import os
+import threading
+import time
+import urllib2
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Most series to send at once.
+BATCH_SIZE = 100
+# Seconds between sending what's been recorded.
+FLUSH_INTERVAL = 5
+# Seconds to wait after the first failure to send, doubling after each
+# failure up to MAX_BACKOFF.
+BACKOFF = 5
+MAX_BACKOFF = 5 * 60
+# Seconds close() waits for the last of the spool to be sent.
+CLOSE_TIMEOUT = 10
+
+
+class MetricsSinkError(Exception):
+    pass
+
+
+# Sinks {{{1
+class HTTPSink(object):
+    """POST series, as json, to url (e.g. an InfluxDB 0.8 series url).
+
+    post is requests.post, or anything like it; without it urllib2 is used.
+    """
+    def __init__(self, url, post=None, timeout=5):
+        self.url = url
+        self.post = post
+        self.timeout = timeout
+
+    def send(self, series):
+        data = json.dumps(series)
+        if self.post is not None:
+            r = self.post(self.url, data=data, timeout=self.timeout)
+            status = r.status_code
+        else:
+            try:
+                status = urllib2.urlopen(self.url, data,
+                                         timeout=self.timeout).getcode()
+            except urllib2.HTTPError, e:
+                status = e.code
+        if status != 200:
+            raise MetricsSinkError("%s returned %s" % (self.url, status))
+
+
+class FileSink(object):
+    """Append series to the file path, one json list per send()."""
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, series):
+        fh = open(self.path, 'a')
+        try:
+            fh.write(json.dumps(series) + '\n')
+        finally:
+            fh.close()
+
+
+# MetricsSpool {{{1
+class MetricsSpool(object):
+    """A file of series waiting to be sent, one json object per line.
+
+    Anyone can append(), but only whoever holds the sending lock (see
+    lock_sending()) may read() what to send and then drop() it, so two
+    senders never send the same series, and appending never waits on a
+    send.  That holds between threads, and between processes where there's
+    fcntl.
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._sending_lock = threading.Lock()
+        self._sending_fh = None
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+
+    def lock_sending(self):
+        """Take the sending lock, without waiting; returns False if another
+        thread or process has it."""
+        if not self._sending_lock.acquire(False):
+            return False
+        fh = open(self.path + '.lock', 'a')
+        if fcntl:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                fh.close()
+                self._sending_lock.release()
+                return False
+        self._sending_fh = fh
+        return True
+
+    def unlock_sending(self):
+        # Closing the file releases the flock.
+        self._sending_fh.close()
+        self._sending_fh = None
+        self._sending_lock.release()
+
+    def _locked(self, func, *args):
+        with self._lock:
+            fh = open(self.path, 'a+')
+            try:
+                if fcntl:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                return func(fh, *args)
+            finally:
+                fh.close()
+
+    def append(self, series):
+        lines = ''.join([json.dumps(s) + '\n' for s in series])
+
+        def append(fh):
+            fh.seek(0, os.SEEK_END)
+            fh.write(lines)
+        self._locked(append)
+
+    def read(self, count):
+        """Return up to count of the oldest series, and how many bytes of
+        the spool they take up, to pass to drop() once they're sent."""
+        def read(fh):
+            fh.seek(0)
+            series = []
+            size = 0
+            while len(series) < count:
+                line = fh.readline()
+                if not line.endswith('\n'):
+                    # Nothing more, or a line still being written.
+                    break
+                size += len(line)
+                try:
+                    series.append(json.loads(line))
+                except ValueError:
+                    # Throw away anything mangled, rather than choke on it
+                    # forever.
+                    pass
+            return series, size
+        return self._locked(read)
+
+    def drop(self, size):
+        """Remove the first size bytes of the spool."""
+        def drop(fh):
+            fh.seek(size)
+            rest = fh.read()
+            fh.seek(0)
+            fh.truncate()
+            fh.write(rest)
+        self._locked(drop)
+
+    def __len__(self):
+        def count(fh):
+            fh.seek(0)
+            return sum(1 for line in fh)
+        return self._locked(count)
+
+
+# MetricsEmitter {{{1
+class MetricsEmitter(object):
+    """Spool series to spool_path, and send them to sink from a background
+    thread.
+
+    Attributes:
+        sent (int): series sent.
+        failures (int): failed attempts to send.
+        last_error (Exception): why the last attempt failed.
+    """
+    def __init__(self, spool_path, sink, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF):
+        self.spool = MetricsSpool(spool_path)
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.failures = 0
+        self.last_error = None
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._thread = None
+
+    def record(self, series):
+        """Spool a list of series to be sent."""
+        self.spool.append(series)
+
+    def flush(self, deadline=None):
+        """Send everything in the spool, batch_size series at a time,
+        stopping between batches once time.time() is past deadline.
+
+        Returns True if the spool is now empty; False if the sink failed,
+        it ran out of time, or another thread or process is sending.
+        """
+        return self._flush(lambda: deadline is not None and
+                           time.time() > deadline)
+
+    def _flush(self, should_stop):
+        if not self.spool.lock_sending():
+            return False
+        try:
+            while True:
+                series, size = self.spool.read(self.batch_size)
+                if not size:
+                    return True
+                if should_stop():
+                    return False
+                try:
+                    if series:
+                        self.sink.send(series)
+                except Exception, e:
+                    self.failures += 1
+                    self.last_error = e
+                    return False
+                self.spool.drop(size)
+                self.sent += len(series)
+        finally:
+            self.spool.unlock_sending()
+
+    def start(self):
+        """Start sending, beginning with anything left in the spool from
+        before."""
+        self._thread = threading.Thread(target=self._flush_loop,
+                                        name='MetricsEmitter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _flush_loop(self):
+        backoff = 0
+        while not self._closing:
+            failures = self.failures
+            self._flush(lambda: self._closing)
+            if self.failures > failures:
+                backoff = min(max(backoff * 2, self.backoff),
+                              self.max_backoff)
+                wait = backoff
+            else:
+                backoff = 0
+                wait = self.flush_interval
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Stop the background thread and try once more to send what's
+        left, taking no more than timeout seconds altogether.  Returns True
+        if the spool is empty."""
+        deadline = time.time() + timeout
+        self._closing = True
+        self._wakeup.set()
+        if self._thread:
+            # It stops between batches, so this only waits for a send
+            # that's under way.
+            self._thread.join(timeout)
+            self._thread = None
+        done = []
+        last = threading.Thread(target=lambda: done.append(self.flush(deadline)),
+                                name='MetricsEmitter')
+        last.daemon = True
+        last.start()
+        last.join(max(deadline - time.time(), 0))
+        return bool(done and done[0])
@@ -7,6 +7,10 @@
 """Generic ways to parallelize jobs.
 """
 
+import heapq
+import sys
+import threading
+
 
 # ChunkingMixin {{{1
 class ChunkingMixin(object):
@@ -34,3 +38,99 @@ class ChunkingMixin(object):
             if c == this_chunk:
                 return possible_list[0:n]
             del possible_list[0:n]
+
+
+# run_with_dependencies {{{1
+def run_with_dependencies(items, dependencies, func, max_workers=4):
+    """Call func(item) for each of `items` on up to `max_workers` threads.
+
+    `dependencies` maps an item to the items that have to finish before it
+    can start.  Items that are ready are started in the order they appear
+    in `items`.
+
+    The worker threads take the next ready item themselves, and each item
+    that finishes makes ready whichever of its dependents were only
+    waiting on it, so this is cheap enough for thousands of items.
+
+    If func raises (including SystemExit), no new items are started; once
+    the running items finish, the first exception is re-raised in the
+    calling thread.
+    """
+    items = list(items)
+    index = dict((item, i) for i, item in enumerate(items))
+    # How many unfinished items each item is waiting on, and which items
+    # wait on each; an item depending on something not in `items` is
+    # never ready.
+    waiting_on = []
+    dependents = [[] for item in items]
+    for i, item in enumerate(items):
+        needed = set(dependencies.get(item, ()))
+        waiting_on.append(len(needed))
+        for dependency in needed:
+            if dependency in index:
+                dependents[index[dependency]].append(i)
+    ready = [i for i, count in enumerate(waiting_on) if not count]
+    heapq.heapify(ready)
+    state = {'running': 0, 'done': 0, 'workers': 0}
+    exc_infos = []
+    condition = threading.Condition()
+
+    def _next():
+        """The index of the next item to run, or None once there won't be
+        one; called with condition held."""
+        while True:
+            if exc_infos:
+                return None
+            if ready:
+                state['running'] += 1
+                return heapq.heappop(ready)
+            if not state['running']:
+                return None
+            condition.wait()
+
+    def _worker():
+        with condition:
+            try:
+                i = _next()
+                while i is not None:
+                    condition.release()
+                    try:
+                        func(items[i])
+                    except BaseException:
+                        exc_info = sys.exc_info()
+                    else:
+                        exc_info = None
+                    finally:
+                        condition.acquire()
+                    state['running'] -= 1
+                    state['done'] += 1
+                    if exc_info:
+                        exc_infos.append(exc_info)
+                    else:
+                        for dependent in dependents[i]:
+                            waiting_on[dependent] -= 1
+                            if not waiting_on[dependent]:
+                                heapq.heappush(ready, dependent)
+                    condition.notify_all()
+                    i = _next()
+            finally:
+                state['workers'] -= 1
+                condition.notify_all()
+
+    with condition:
+        for n in range(min(max(max_workers, 1), len(items))):
+            state['workers'] += 1
+            thread = threading.Thread(target=_worker,
+                                      name='run_with_dependencies-%d' % n)
+            thread.daemon = True
+            thread.start()
+        while state['workers']:
+            # The workers wake us once they're all done; waiting with a
+            # timeout keeps us interruptible.
+            condition.wait(1)
+    if exc_infos:
+        exc_type, exc_value, exc_tb = exc_infos[0]
+        raise exc_type, exc_value, exc_tb
+    if state['done'] < len(items):
+        pending = [item for i, item in enumerate(items) if waiting_on[i]]
+        raise ValueError("Unable to satisfy dependencies for %s!" % pending)
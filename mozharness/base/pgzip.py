@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Gzipping on several threads at once, like pigz, no mixins here!
+
+The input is cut into blocks, each deflated on its own on a pool of
+threads (zlib lets go of the GIL while it works), and the results are
+written out in order.  Every block but the last ends with a sync flush,
+which byte-aligns it without ending the stream, so together they make one
+ordinary gzip member that anything can read:
+
+    out = ParallelGzipWriter(open('log.txt.gz', 'wb'), threads=4)
+    shutil.copyfileobj(open('log.txt', 'rb'), out)
+    out.close()
+
+Blocks don't share history, so output is a fraction of a percent bigger
+than gzip's.
+"""
+
+import collections
+import os
+import struct
+import time
+import zlib
+
+try:
+    from multiprocessing.pool import ThreadPool
+    import multiprocessing
+except ImportError:
+    ThreadPool = None
+
+BLOCK_SIZE = 1024 ** 2
+# gzip.GzipFile's default.
+DEFAULT_LEVEL = 9
+
+FNAME = 0x08
+
+
+def query_cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except (NameError, NotImplementedError):
+        return 1
+
+
+def _deflate_block(args):
+    """Deflate one block, without a header, byte-aligned so the next
+    block's output can follow."""
+    data, level = args
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# ParallelGzipWriter {{{1
+class ParallelGzipWriter(object):
+    """Write a gzip stream to fileobj, compressing block_size blocks of
+    what's written on up to `threads` threads (default: one per CPU).
+
+    fileobj isn't closed by close().  filename, if given, is stored in the
+    header, as gzip.GzipFile does.
+    """
+    def __init__(self, fileobj, level=DEFAULT_LEVEL, threads=None,
+                 block_size=BLOCK_SIZE, filename=None, mtime=None):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        if threads is None:
+            threads = query_cpu_count()
+        self.threads = threads
+        self._pool = None
+        if threads > 1 and ThreadPool:
+            self._pool = ThreadPool(threads)
+        # Deflated blocks on their way, in order.
+        self._pending = collections.deque()
+        self._buffer = []
+        self._buffered = 0
+        self._crc = zlib.crc32('') & 0xffffffff
+        self._size = 0
+        self.closed = False
+        self._write_header(filename, mtime)
+
+    def _write_header(self, filename, mtime):
+        flags = 0
+        if filename:
+            flags |= FNAME
+        if mtime is None:
+            mtime = time.time()
+        # Compression flags: 2 is slowest, 4 fastest.
+        xfl = {9: 2, 1: 4}.get(self.level, 0)
+        self.fileobj.write('\x1f\x8b\x08' + chr(flags) +
+                           struct.pack('<L', long(mtime) & 0xffffffffL) +
+                           chr(xfl) + '\xff')
+        if filename:
+            if isinstance(filename, unicode):
+                filename = filename.encode('latin-1', 'replace')
+            self.fileobj.write(filename + '\0')
+
+    def _submit(self, data):
+        self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+        self._size += len(data)
+        if self._pool is None:
+            self.fileobj.write(_deflate_block((data, self.level)))
+            return
+        self._pending.append(self._pool.apply_async(_deflate_block,
+                                                    ((data, self.level), )))
+        # Keep the pool busy without holding the whole input in memory.
+        while len(self._pending) > self.threads * 2:
+            self.fileobj.write(self._pending.popleft().get())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write() on closed ParallelGzipWriter")
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            data = ''.join(self._buffer)
+            for start in xrange(0, len(data) - self.block_size + 1,
+                                self.block_size):
+                self._submit(data[start:start + self.block_size])
+            rest = data[start + self.block_size:]
+            self._buffer = [rest]
+            self._buffered = len(rest)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffered:
+                self._submit(''.join(self._buffer))
+            self._buffer = []
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().get())
+            # An empty final block ends the deflate stream.
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                          -zlib.MAX_WBITS)
+            self.fileobj.write(compressor.compress('') + compressor.flush())
+            self.fileobj.write(struct.pack('<LL', self._crc,
+                                           self._size & 0xffffffffL))
+        finally:
+            self.closed = True
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+
+
+def gzip_file(src, dest, level=DEFAULT_LEVEL, threads=None, fileobj=None):
+    """Gzip the file src to dest (or the file object fileobj, if given),
+    naming src in the header as gzip does.
+    """
+    infile = open(src, 'rb')
+    outfile = fileobj or open(dest, 'wb')
+    try:
+        name = os.path.basename(dest)
+        if name.endswith('.gz'):
+            name = name[:-3]
+        out = ParallelGzipWriter(outfile, level=level, threads=threads,
+                                 filename=name)
+        while True:
+            block = infile.read(BLOCK_SIZE)
+            if not block:
+                break
+            out.write(block)
+        out.close()
+    finally:
+        if not fileobj:
+            outfile.close()
+        infile.close()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Subprocess output handling, no mixins here!
+
+OutputPump reads the output pipes of one or more subprocess.Popen objects
+from a single thread using poll() (or select() where poll() isn't
+available), in large chunks, and hands complete lines to callbacks in
+batches.  It also enforces output and overall timeouts, so we don't need a
+reader thread per child.
+
+    pump = OutputPump()
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            preexec_fn=new_process_group)
+    job = pump.add_process(proc, [(proc.stdout, parser.add_lines)],
+                           output_timeout=300)
+    pump.run()
+    if job.timed_out: ...
+
+poll() and select() don't work on Windows pipes; check OutputPump.supported()
+before using it.
+"""
+
+import errno
+import os
+import select
+import signal
+import sys
+import time
+
+CHUNK_SIZE = 64 * 1024
+# How long to wait for the pipes to close after killing a timed out process.
+KILL_GRACE_PERIOD = 5
+
+OUTPUT_TIMEOUT = 'output_timeout'
+TIMEOUT = 'timeout'
+
+
+def new_process_group():
+    """preexec_fn for subprocess.Popen that puts the child in its own process
+    group, so OutputPump can kill the child and all of its children on
+    timeout.
+    """
+    os.setpgid(0, 0)
+
+
+def wait_with_rusage(proc):
+    """Wait for the subprocess.Popen object `proc` to exit.
+
+    Returns a (returncode, rusage) tuple; rusage is the child's
+    resource.struct_rusage, or None where os.wait4() isn't available.
+    """
+    if not hasattr(os, 'wait4') or proc.returncode is not None:
+        return proc.wait(), None
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                # Somebody else reaped it.
+                return proc.wait(), None
+            raise
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, rusage
+
+
+# CommandUsage {{{1
+class CommandUsage(object):
+    """What running a command cost: wall_time, user_time and system_time
+    in seconds, max_rss (the largest resident set of the command or any of
+    its waited-for children) in bytes, and in_blocks/out_blocks, the block
+    IOs it did.  Everything but wall_time is None without an rusage.
+    """
+    def __init__(self, command, wall_time, rusage=None):
+        self.command = command
+        self.wall_time = wall_time
+        self.user_time = self.system_time = self.max_rss = None
+        self.in_blocks = self.out_blocks = None
+        if rusage is not None:
+            self.user_time = rusage.ru_utime
+            self.system_time = rusage.ru_stime
+            # Bytes on Mac, kilobytes elsewhere.
+            self.max_rss = rusage.ru_maxrss
+            if sys.platform != 'darwin':
+                self.max_rss *= 1024
+            self.in_blocks = rusage.ru_inblock
+            self.out_blocks = rusage.ru_oublock
+
+    @classmethod
+    def from_job(cls, command, job):
+        """Return the CommandUsage of the finished PumpedProcess job."""
+        return cls(command, job.wall_time(), job.rusage)
+
+    def cpu_time(self):
+        if self.user_time is None:
+            return None
+        return self.user_time + self.system_time
+
+    def __str__(self):
+        if self.user_time is None:
+            return "wall %.1fs" % self.wall_time
+        return ("wall %.1fs, user %.1fs, sys %.1fs, max RSS %.1fMB, "
+                "blocks in %d, out %d" % (
+                    self.wall_time, self.user_time, self.system_time,
+                    self.max_rss / 1024.0 ** 2, self.in_blocks,
+                    self.out_blocks))
+
+
+# PumpedProcess {{{1
+class PumpedProcess(object):
+    """The state OutputPump keeps for each process."""
+    def __init__(self, proc, handlers, output_timeout=None, timeout=None,
+                 on_exit=None, kill_process_group=False, split_lines=True):
+        self.proc = proc
+        self.split_lines = split_lines
+        self.output_timeout = output_timeout
+        self.timeout = timeout
+        self.on_exit = on_exit
+        self.kill_process_group = kill_process_group
+        self.start_time = time.time()
+        self.end_time = None
+        self.last_output_time = self.start_time
+        self.timed_out = None
+        self.kill_time = None
+        self.returncode = None
+        # resource.struct_rusage of the child, where os.wait4() exists.
+        self.rusage = None
+        # fd -> [pipe, callback, partial line]
+        self.streams = {}
+        for fh, callback in handlers:
+            self.streams[fh.fileno()] = [fh, callback, '']
+
+    def deadline(self):
+        """Return the time at which this process will time out (or, once
+        it has been killed, when we stop waiting for its pipes to close),
+        or None.
+        """
+        if self.kill_time:
+            return self.kill_time + KILL_GRACE_PERIOD
+        deadlines = []
+        if self.output_timeout:
+            deadlines.append(self.last_output_time + self.output_timeout)
+        if self.timeout:
+            deadlines.append(self.start_time + self.timeout)
+        if deadlines:
+            return min(deadlines)
+
+    def cpu_time(self):
+        """Return the user + system CPU seconds the process used, or None."""
+        if self.rusage is None:
+            return None
+        return self.rusage.ru_utime + self.rusage.ru_stime
+
+    def wall_time(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def kill(self):
+        self.kill_time = time.time()
+        try:
+            if self.kill_process_group:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except OSError, e:
+            # The process may already be gone.
+            if e.errno != errno.ESRCH:
+                raise
+
+
+# OutputPump {{{1
+class OutputPump(object):
+    """Read the output of any number of processes from the calling thread.
+
+    Each callback is called with a list of complete lines, without their
+    line endings, for every chunk read from its pipe.  A trailing partial
+    line is held back until it's completed or the pipe is closed.  Processes
+    added with split_lines=False get the chunks as read instead.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.jobs = []
+        # fd -> PumpedProcess
+        self._fds = {}
+        self._poller = None
+        if hasattr(select, 'poll'):
+            self._poller = select.poll()
+
+    @staticmethod
+    def supported():
+        return os.name != 'nt'
+
+    def add_process(self, proc, handlers, output_timeout=None, timeout=None,
+                    on_exit=None, kill_process_group=False, split_lines=True):
+        """Start watching `proc`.
+
+        `handlers` is a list of (pipe, callback) tuples.  `on_exit`, if
+        given, is called with the PumpedProcess once the process has exited
+        and all its output has been handled; it may add more processes.
+
+        Set `kill_process_group` if proc was started with
+        preexec_fn=new_process_group, to kill the whole group on timeout.
+        """
+        job = PumpedProcess(proc, handlers, output_timeout=output_timeout,
+                            timeout=timeout, on_exit=on_exit,
+                            kill_process_group=kill_process_group,
+                            split_lines=split_lines)
+        self.jobs.append(job)
+        for fd in job.streams:
+            self._fds[fd] = job
+            if self._poller:
+                self._poller.register(fd, select.POLLIN | select.POLLPRI)
+        if not job.streams:
+            self._finish(job)
+        return job
+
+    def _wait(self, timeout):
+        """Return the fds that are readable (or closed)."""
+        if self._poller:
+            if timeout is not None:
+                timeout = int(timeout * 1000)
+            while True:
+                try:
+                    return [fd for fd, event in self._poller.poll(timeout)]
+                except select.error, e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+        while True:
+            try:
+                return select.select(self._fds.keys(), [], [], timeout)[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def _read(self, fd):
+        job = self._fds[fd]
+        stream = job.streams[fd]
+        try:
+            data = os.read(fd, self.chunk_size)
+        except OSError, e:
+            if e.errno in (errno.EINTR, errno.EAGAIN):
+                return
+            data = ''
+        if data and not job.split_lines:
+            job.last_output_time = time.time()
+            stream[1](data)
+        elif data:
+            job.last_output_time = time.time()
+            lines = (stream[2] + data).split('\n')
+            stream[2] = lines.pop()
+            if lines:
+                stream[1](lines)
+        else:
+            self._close(fd)
+
+    def _close(self, fd):
+        job = self._fds.pop(fd)
+        fh, callback, partial = job.streams.pop(fd)
+        if partial:
+            callback([partial])
+        if self._poller:
+            self._poller.unregister(fd)
+        fh.close()
+        if not job.streams:
+            self._finish(job)
+
+    def _finish(self, job):
+        job.returncode, job.rusage = wait_with_rusage(job.proc)
+        job.end_time = time.time()
+        if job.on_exit:
+            job.on_exit(job)
+
+    def _check_timeouts(self):
+        now = time.time()
+        for job in set(self._fds.values()):
+            deadline = job.deadline()
+            if deadline is None or deadline > now:
+                continue
+            if job.kill_time:
+                # Something outside the process group is holding the pipes
+                # open; stop waiting for it.
+                for fd in job.streams.keys():
+                    self._close(fd)
+                continue
+            if job.timeout and job.start_time + job.timeout <= now:
+                job.timed_out = TIMEOUT
+            else:
+                job.timed_out = OUTPUT_TIMEOUT
+            job.kill()
+
+    def _next_timeout(self):
+        deadlines = [job.deadline() for job in set(self._fds.values())]
+        deadlines = [d for d in deadlines if d is not None]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.time())
+
+    def run(self):
+        """Pump output until every watched process has exited."""
+        while self.step():
+            pass
+
+    def step(self):
+        """Wait for output or a timeout once, and handle it.
+
+        Returns True while there are processes left to watch.
+        """
+        if self._fds:
+            watched = dict(self._fds)
+            for fd in self._wait(self._next_timeout()):
+                # Skip fds closed (and possibly reused by a process added
+                # from an on_exit callback) earlier in this round.
+                if fd in watched and self._fds.get(fd) is watched[fd]:
+                    self._read(fd)
+            self._check_timeouts()
+        return bool(self._fds)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""System resource usage from /proc, with nothing to install; no mixins
+here!
+
+ProcResourceSampler reads /proc/stat, /proc/meminfo, /proc/diskstats and
+/proc/net/dev on a thread of its own, keeping the samples in a RingBuffer.
+It answers the same questions as mozsystemmonitor's SystemResourceMonitor,
+so the two are interchangeable for ResourceMonitoringMixin:
+
+    sampler = ProcResourceSampler(interval=1.0)
+    sampler.start()
+    sampler.begin_phase('build')
+    ...
+    sampler.finish_phase('build')
+    sampler.stop()
+    sampler.aggregate_cpu_percent(phase='build')
+    sampler.aggregate_io(phase='build').write_bytes
+    sampler.write_csv('resource-usage.csv')
+
+Phases are measured between samples taken as they begin and finish, so
+they're exact however short they are, and however many samples the ring
+buffer has dropped since.
+"""
+
+from array import array
+import collections
+import csv
+import os
+import threading
+import time
+
+# Sampled values, in the order a RingBuffer row holds them.  CPU times are
+# in seconds and amounts of data in bytes; disk read/write counts and times
+# (in milliseconds) are as in /proc/diskstats.  All but the memory figures
+# only ever go up.
+FIELDS = (
+    'time',
+    'cpu_user', 'cpu_nice', 'cpu_system', 'cpu_idle', 'cpu_iowait',
+    'cpu_other',
+    'mem_total', 'mem_available',
+    'read_count', 'write_count', 'read_bytes', 'write_bytes',
+    'read_time', 'write_time',
+    'net_rx_bytes', 'net_tx_bytes',
+)
+_INDEX = dict((name, i) for i, name in enumerate(FIELDS))
+
+DEFAULT_INTERVAL = 1.0
+# Six hours of samples a second is about 3MB.
+DEFAULT_CAPACITY = 6 * 60 * 60
+SECTOR_SIZE = 512
+
+CPUTimes = collections.namedtuple(
+    'CPUTimes', ['user', 'nice', 'system', 'idle', 'iowait', 'other'])
+IOUsage = collections.namedtuple(
+    'IOUsage', ['read_count', 'write_count', 'read_bytes', 'write_bytes',
+                'read_time', 'write_time'])
+NetUsage = collections.namedtuple('NetUsage', ['rx_bytes', 'tx_bytes'])
+
+
+# RingBuffer {{{1
+class RingBuffer(object):
+    """The last `capacity` rows of `width` floats, in a single array."""
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self._data = array('d', [0.0]) * (width * capacity)
+        # How many rows were ever appended.
+        self.appended = 0
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def append(self, row):
+        start = (self.appended % self.capacity) * self.width
+        self._data[start:start + self.width] = array('d', row)
+        self.appended += 1
+
+    def __iter__(self):
+        """Rows, as tuples, oldest first."""
+        first = self.appended - len(self)
+        for n in xrange(first, self.appended):
+            start = (n % self.capacity) * self.width
+            yield tuple(self._data[start:start + self.width])
+
+
+# Reading /proc {{{1
+def _read_lines(path):
+    try:
+        fh = open(path)
+        try:
+            return fh.readlines()
+        finally:
+            fh.close()
+    except (IOError, OSError):
+        return []
+
+
+def query_disks(sys_block='/sys/block'):
+    """Return the names of whole disks, to count IO once rather than for
+    the disk and each partition; or None to count every device."""
+    try:
+        names = os.listdir(sys_block)
+    except OSError:
+        return None
+    return set([n for n in names if not n.startswith(('loop', 'ram'))])
+
+
+def read_cpu(proc_dir, ticks):
+    for line in _read_lines(os.path.join(proc_dir, 'stat')):
+        if line.startswith('cpu '):
+            values = [float(v) / ticks for v in line.split()[1:]]
+            values.extend([0.0] * (8 - len(values)))
+            # irq, softirq and steal; guest time is already in user.
+            return values[:5] + [sum(values[5:8])]
+    return [0.0] * 6
+
+
+def read_memory(proc_dir):
+    info = {}
+    for line in _read_lines(os.path.join(proc_dir, 'meminfo')):
+        parts = line.split()
+        if len(parts) >= 2:
+            info[parts[0].rstrip(':')] = float(parts[1]) * 1024
+    available = info.get('MemAvailable')
+    if available is None:
+        # Kernels before 3.14.
+        available = sum([info.get(k, 0.0) for k in
+                         ('MemFree', 'Buffers', 'Cached')])
+    return [info.get('MemTotal', 0.0), available]
+
+
+def read_disks(proc_dir, disks=None):
+    totals = [0.0] * 6
+    for line in _read_lines(os.path.join(proc_dir, 'diskstats')):
+        parts = line.split()
+        if len(parts) < 11:
+            continue
+        if disks is not None and parts[2] not in disks:
+            continue
+        if disks is None and parts[2].startswith(('loop', 'ram')):
+            continue
+        totals[0] += float(parts[3])
+        totals[1] += float(parts[7])
+        totals[2] += float(parts[5]) * SECTOR_SIZE
+        totals[3] += float(parts[9]) * SECTOR_SIZE
+        totals[4] += float(parts[6])
+        totals[5] += float(parts[10])
+    return totals
+
+
+def read_network(proc_dir):
+    rx = tx = 0.0
+    for line in _read_lines(os.path.join(proc_dir, 'net', 'dev')):
+        if ':' not in line:
+            continue
+        name, values = line.split(':', 1)
+        values = values.split()
+        if name.strip() == 'lo' or len(values) < 9:
+            continue
+        rx += float(values[0])
+        tx += float(values[8])
+    return [rx, tx]
+
+
+# ProcResourceSampler {{{1
+class ProcResourceSampler(object):
+    """Sample system resource usage every interval seconds, keeping the
+    last `capacity` samples.
+
+    Attributes:
+        start_time, end_time (float): when start() and stop() were called.
+        phases (dict): phase name: (start time, end time).
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL, capacity=DEFAULT_CAPACITY,
+                 proc_dir='/proc', sys_block='/sys/block'):
+        self.interval = interval
+        self.proc_dir = proc_dir
+        self.samples = RingBuffer(len(FIELDS), capacity)
+        self.start_time = None
+        self.end_time = None
+        self.phases = {}
+        self._disks = query_disks(sys_block)
+        try:
+            self._ticks = float(os.sysconf('SC_CLK_TCK'))
+        except (AttributeError, ValueError, OSError):
+            self._ticks = 100.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._first = self._last = None
+        self._phase_rows = {}
+        self._open_phases = {}
+
+    @staticmethod
+    def available(proc_dir='/proc'):
+        return os.path.exists(os.path.join(proc_dir, 'stat'))
+
+    def sample(self):
+        """Take a sample now, and return it."""
+        row = ([time.time()] +
+               read_cpu(self.proc_dir, self._ticks) +
+               read_memory(self.proc_dir) +
+               read_disks(self.proc_dir, self._disks) +
+               read_network(self.proc_dir))
+        with self._lock:
+            self.samples.append(row)
+        return row
+
+    def start(self):
+        self._first = self.sample()
+        self.start_time = self._first[0]
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        name='ProcResourceSampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._last = self.sample()
+        self.end_time = self._last[0]
+
+    def _sample_loop(self):
+        while True:
+            self._stopping.wait(self.interval)
+            if self._stopping.is_set():
+                return
+            self.sample()
+
+    def begin_phase(self, name):
+        self._open_phases[name] = self.sample()
+
+    def finish_phase(self, name):
+        start = self._open_phases.pop(name, None)
+        if start is None:
+            return
+        end = self.sample()
+        self._phase_rows[name] = (start, end)
+        self.phases[name] = (start[0], end[0])
+
+    def _rows(self, phase):
+        if phase is None:
+            return self._first, self._last or self.sample()
+        return self._phase_rows[phase]
+
+    def _deltas(self, phase, names):
+        start, end = self._rows(phase)
+        return [end[_INDEX[n]] - start[_INDEX[n]] for n in names]
+
+    def aggregate_cpu_times(self, phase=None, per_cpu=False):
+        """CPU seconds spent in each state, summed over all CPUs; /proc/stat's
+        totals are all that's read, so per_cpu is ignored."""
+        return CPUTimes(*self._deltas(
+            phase, ['cpu_' + f for f in CPUTimes._fields]))
+
+    def aggregate_cpu_percent(self, phase=None, per_cpu=False):
+        """How busy the CPUs were, 0-100, or None if no time passed."""
+        times = self.aggregate_cpu_times(phase)
+        total = sum(times)
+        if total <= 0:
+            return None
+        return 100.0 * (total - times.idle - times.iowait) / total
+
+    def aggregate_io(self, phase=None):
+        return IOUsage(*[int(v) for v in self._deltas(phase, IOUsage._fields)])
+
+    def aggregate_network(self, phase=None):
+        return NetUsage(*[int(v) for v in self._deltas(
+            phase, ['net_rx_bytes', 'net_tx_bytes'])])
+
+    def peak_memory_used(self, phase=None):
+        """The most memory in use (not available) in any sample taken
+        during phase, in bytes."""
+        start, end = self._rows(phase)
+        peak = 0.0
+        total, available = _INDEX['mem_total'], _INDEX['mem_available']
+        with self._lock:
+            rows = list(self.samples)
+        for row in [start, end] + rows:
+            if start[0] <= row[0] <= end[0]:
+                peak = max(peak, row[total] - row[available])
+        return int(peak)
+
+    def write_csv(self, path):
+        """Write every sample kept, one row per sample, to path."""
+        with self._lock:
+            rows = list(self.samples)
+        fh = open(path, 'wb')
+        try:
+            writer = csv.writer(fh)
+            writer.writerow(FIELDS)
+            for row in rows:
+                # Seconds for the time and CPU times, whole numbers after.
+                writer.writerow(['%.3f' % row[0]] +
+                                ['%.2f' % v for v in row[1:7]] +
+                                ['%d' % v for v in row[7:]])
+        finally:
+            fh.close()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Profiling mozharness itself, no mixins here!
+
+Profile runs cProfile on the thread that starts it, for pstats, along with
+a StackSampler, which looks at that thread's stack every few milliseconds
+for flamegraph input:
+
+    profile = Profile()
+    profile.start()
+    ...
+    profile.stop()
+    profile.dump('upload/profile-build')  # .pstats and .folded files
+    for line in profile.top_functions(10):
+        print line
+
+The .folded file has one "outer;inner;innermost count" line per distinct
+stack, the collapsed format flamegraph.pl and speedscope read.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import thread
+import threading
+import time
+
+# How often StackSampler looks at the stack, in seconds.
+SAMPLE_INTERVAL = 0.01
+# How many functions Profile.top_functions() lists by default.
+TOP_FUNCTIONS = 10
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+# StackSampler {{{1
+class StackSampler(object):
+    """Count the stacks of thread thread_id (default: the one calling
+    start()) every interval seconds, on a thread of its own.
+    """
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = thread.get_ident()
+        self._running = True
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        name='StackSampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _sample_loop(self):
+        while self._running:
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        if not names:
+            return
+        names.reverse()
+        stack = ';'.join(names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def write_collapsed(self, path):
+        fh = open(path, 'w')
+        try:
+            for stack, count in sorted(self.stacks.items()):
+                fh.write("%s %d\n" % (stack, count))
+        finally:
+            fh.close()
+
+
+# Profile {{{1
+class Profile(object):
+    """cProfile and a StackSampler on the thread calling start(), which
+    must also be the one calling stop().
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(interval=interval)
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        self.sampler.start()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.sampler.stop()
+        self.end_time = time.time()
+
+    def query_stats(self):
+        return pstats.Stats(self.profiler)
+
+    def dump(self, prefix):
+        """Write prefix.pstats and prefix.folded, returning their paths."""
+        pstats_path = prefix + '.pstats'
+        folded_path = prefix + '.folded'
+        self.query_stats().dump_stats(pstats_path)
+        self.sampler.write_collapsed(folded_path)
+        return [pstats_path, folded_path]
+
+    def top_functions(self, count=TOP_FUNCTIONS):
+        """Return lines describing the count functions that took the most
+        time of their own, hottest first.
+        """
+        stats = self.query_stats()
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2],
+                      reverse=True)
+        lines = []
+        for func, (cc, calls, own_time, cumulative_time, callers) in rows[:count]:
+            lines.append("%8.3fs own %8.3fs total %8d calls  %s" % (
+                own_time, cumulative_time, calls, pstats.func_std_string(func)
+            ))
+        return lines
@@ -22,6 +22,8 @@ from mozharness.base.script import (
 )
 from mozharness.base.errors import VirtualenvErrorList
 from mozharness.base.log import WARNING, FATAL
+from mozharness.base.metrics import FileSink, HTTPSink, MetricsEmitter
+from mozharness.base.procstats import ProcResourceSampler
 from mozharness.mozilla.proxxy import Proxxy
 
 # Virtualenv {{{1
@@ -427,26 +429,38 @@ class ResourceMonitoringMixin(object):
     When this class is in the inheritance chain, resource usage stats of the
     executing script will be recorded.
 
-    This class requires the VirtualenvMixin in order to install a package used
-    for recording resource usage.
+    Where there's a /proc (Linux), resource usage is read from there by a
+    ProcResourceSampler, from the start of the run, and the raw samples
+    are written to resource-usage.csv in the log dir.
 
-    While we would like to record resource usage for the entirety of a script,
-    since we require an external package, we can only record resource usage
-    after that package is installed (as part of creating the virtualenv).
-    That's just the way things have to be.
+    Elsewhere this class requires the VirtualenvMixin in order to install a
+    package used for recording resource usage, so resource usage can only
+    be recorded after that package is installed (as part of creating the
+    virtualenv).
     """
     def __init__(self, *args, **kwargs):
         super(ResourceMonitoringMixin, self).__init__(*args, **kwargs)
 
-        self.register_virtualenv_module('psutil==0.7.1', method='pip',
-                                        optional=True)
-        self.register_virtualenv_module('mozsystemmonitor==0.0.0',
-                                        method='pip', optional=True)
+        if not ProcResourceSampler.available():
+            self.register_virtualenv_module('psutil==0.7.1', method='pip',
+                                            optional=True)
+            self.register_virtualenv_module('mozsystemmonitor==0.0.0',
+                                            method='pip', optional=True)
         self._resource_monitor = None
 
+    @PreScriptRun
+    def _start_proc_resource_monitoring(self):
+        if not ProcResourceSampler.available():
+            return
+        self.info("Starting resource monitoring.")
+        self._resource_monitor = ProcResourceSampler(interval=1.0)
+        self._resource_monitor.start()
+
     @PostScriptAction('create-virtualenv')
     def _start_resource_monitoring(self, action, success=None):
         self.activate_virtualenv()
+        if self._resource_monitor:
+            return
 
         # Resource Monitor requires Python 2.7, however it's currently optional.
         # Remove when all machines have had their Python version updated (bug 711299).
@@ -466,7 +480,8 @@ class ResourceMonitoringMixin(object):
 
     @PreScriptAction
     def _resource_record_pre_action(self, action):
-        # Resource monitor isn't available until after create-virtualenv.
+        # Without /proc, resource monitor isn't available until after
+        # create-virtualenv.
         if not self._resource_monitor:
             return
 
@@ -474,7 +489,8 @@ class ResourceMonitoringMixin(object):
 
     @PostScriptAction
     def _resource_record_post_action(self, action, success=None):
-        # Resource monitor isn't available until after create-virtualenv.
+        # Without /proc, resource monitor isn't available until after
+        # create-virtualenv.
         if not self._resource_monitor:
             return
 
@@ -490,6 +506,10 @@ class ResourceMonitoringMixin(object):
         try:
             self._resource_monitor.stop()
             self._log_resource_usage()
+            if isinstance(self._resource_monitor, ProcResourceSampler):
+                path = os.path.join(self.query_abs_dirs()['abs_log_dir'],
+                                    'resource-usage.csv')
+                self._resource_monitor.write_csv(path)
         except Exception:
             self.warning("Exception when reporting resource usage: %s" %
                          traceback.format_exc())
@@ -531,15 +551,27 @@ class ResourceMonitoringMixin(object):
                 self.warning("Exception when formatting: %s" %
                              traceback.format_exc())
 
+        def log_proc_usage(prefix, phase):
+            # Only ProcResourceSampler measures these.
+            if not isinstance(rm, ProcResourceSampler):
+                return
+            net = rm.aggregate_network(phase=phase)
+            self.info('%s - Network received bytes: %d; sent bytes: %d; '
+                      'Peak memory used: %d bytes' %
+                      (prefix, net.rx_bytes, net.tx_bytes,
+                       rm.peak_memory_used(phase=phase)))
+
         cpu_percent, cpu_times, io = resources(None)
         duration = rm.end_time - rm.start_time
 
         log_usage('Total resource usage', duration, cpu_percent, cpu_times, io)
+        log_proc_usage('Total resource usage', None)
 
         for phase in rm.phases.keys():
             start_time, end_time = rm.phases[phase]
             cpu_percent, cpu_times, io = resources(phase)
             log_usage(phase, end_time - start_time, cpu_percent, cpu_times, io)
+            log_proc_usage(phase, phase)
 
 
 class InfluxRecordingMixin(object):
@@ -555,6 +587,12 @@ class InfluxRecordingMixin(object):
     Where DBNAME, DBUSERNAME, and DBPASSWORD correspond to the database name,
     and user/pw credentials for recording to the database. The stats from
     mozharness are recorded in the 'mozharness' table.
+
+    Stats are spooled to influx_spool_file (by default influx-spool.json in
+    the base work dir, which outlives the job) and sent in the background, so
+    a slow or unreachable server never holds up the job; whatever can't be
+    sent goes out with the next job's stats.  With influx_metrics_file set,
+    stats are written to that file instead of the server.
     """
 
     @PreScriptRun
@@ -562,23 +600,37 @@ class InfluxRecordingMixin(object):
         self.recording = False
         self.post = None
         self.posturl = None
+        self.metrics_emitter = None
         self.res_props = os.path.join(
             self.query_abs_dirs()['abs_obj_dir'], '.mozbuild', 'build_resources.json'
         )
         self.rmtree(self.res_props)
 
         try:
-            site_packages_path = self.query_python_site_packages_path()
-            if site_packages_path not in sys.path:
-                sys.path.append(site_packages_path)
-
-            import requests
-            self.post = requests.post
-
-            auth = os.path.join(os.getcwd(), self.config['influx_credentials_file'])
-            credentials = {}
-            execfile(auth, credentials)
-            self.posturl = credentials['influxdb_credentials']
+            if self.config.get('influx_metrics_file'):
+                sink = FileSink(self.config['influx_metrics_file'])
+            else:
+                site_packages_path = self.query_python_site_packages_path()
+                if site_packages_path not in sys.path:
+                    sys.path.append(site_packages_path)
+
+                import requests
+                self.post = requests.post
+
+                auth = os.path.join(os.getcwd(), self.config['influx_credentials_file'])
+                credentials = {}
+                execfile(auth, credentials)
+                self.posturl = credentials['influxdb_credentials']
+                sink = HTTPSink(self.posturl, post=self.post)
+
+            spool_file = self.config.get(
+                'influx_spool_file',
+                os.path.join(self.query_abs_dirs()['base_work_dir'],
+                             'influx-spool.json')
+            )
+            self.metrics_emitter = MetricsEmitter(spool_file, sink)
+            # This sends anything earlier jobs couldn't, first.
+            self.metrics_emitter.start()
 
             self.recording = True
         except Exception:
@@ -721,16 +773,21 @@ class InfluxRecordingMixin(object):
 
     def record_influx_stat(self, json_data):
         try:
-            r = self.post(self.posturl, data=json.dumps(json_data), timeout=5)
-            if r.status_code != 200:
-                self.warning("Failed to log stats. Return code = %i, stats = %s" % (r.status_code, json_data))
-
-                # Disable recording for the rest of this job. Even if it's just
-                # intermittent, we don't want to keep the build from progressing.
-                self.recording = False
+            self.metrics_emitter.record(json_data)
         except Exception, e:
-            self.warning('Failed to log stats. Exception = %s' % str(e))
-            self.recording = False
+            self.warning('Failed to spool stats. Exception = %s' % str(e))
+
+    @PostScriptRun
+    def influxdb_recording_finish(self):
+        emitter = getattr(self, 'metrics_emitter', None)
+        if not emitter:
+            return
+        self.metrics_emitter = None
+        if emitter.close():
+            self.info("Sent %d stats to influxdb." % emitter.sent)
+        else:
+            self.warning("Failed to log %d stats, spooled for the next job in %s. Last error: %s" %
+                         (len(emitter.spool), emitter.spool.path, emitter.last_error))
 
 
 # __main__ {{{1
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Extract some of the members of a remote zip without downloading all of
+it, no mixins here!
+
+HTTPRangeFile makes a URL look like a seekable file, using HTTP Range
+requests, so zipfile can read the central directory from the end of the
+zip and then just the members we want:
+
+    f = HTTPRangeFile(url)  # raises RangeNotSupported
+    zf = zipfile.ZipFile(f)
+    extract_zip_members(zf, dest, ['bin/*', 'mochitest/*'])
+    f.close()
+
+Members are read in the order they're stored, and small gaps between them
+are read through rather than starting a new request, so a run of
+matching members costs one request.
+"""
+
+import fnmatch
+import os
+import re
+import urllib2
+
+# The end of central directory record is in the last 64k + 22 bytes;
+# fetch a bit more, so small central directories come with it.
+TAIL_SIZE = 256 * 1024
+# Read through gaps this small rather than making a new request.
+SKIP_LIMIT = 1024 ** 2
+BLOCK_SIZE = 1024 ** 2
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+# HTTPRangeFile {{{1
+class HTTPRangeFile(object):
+    """A read-only file object for url, whose server must support Range
+    requests.
+
+    Attributes:
+        size (int): the length of the file.
+        requests (int): requests made so far.
+        bytes_received (int): bytes received so far, including gaps
+            read through.
+    """
+    def __init__(self, url, urlopen=urllib2.urlopen, timeout=30,
+                 tail_size=TAIL_SIZE, skip_limit=SKIP_LIMIT):
+        self.url = url
+        self.urlopen = urlopen
+        self.timeout = timeout
+        self.skip_limit = skip_limit
+        self.requests = 0
+        self.bytes_received = 0
+        self.validator = None
+        self.pos = 0
+        self._stream = None
+        self._stream_pos = None
+        f, start, self.size = self._open('bytes=-%d' % tail_size)
+        try:
+            self._tail_start = start
+            self._tail = self._read_stream(f, self.size - start)
+        finally:
+            f.close()
+        if len(self._tail) != self.size - start:
+            raise IOError("Short read of %s" % url)
+
+    def _open(self, byte_range):
+        """Request byte_range of url, returning (response, start, size)."""
+        headers = {'Range': byte_range}
+        if self.validator:
+            # Make sure we're reading the same file throughout.
+            headers['If-Range'] = self.validator
+        self.requests += 1
+        f = self.urlopen(urllib2.Request(self.url, headers=headers),
+                         timeout=self.timeout)
+        m = re.match(r'bytes\s+(\d+)-(\d+)/(\d+)',
+                     f.info().get('content-range', ''))
+        if getattr(f, 'code', None) != 206 or not m:
+            f.close()
+            if self.validator:
+                raise RangeNotSupported("%s changed while reading it" % self.url)
+            raise RangeNotSupported("%s doesn't support Range requests" % self.url)
+        if not self.validator:
+            self.validator = f.info().get('etag') or \
+                f.info().get('last-modified')
+        return f, int(m.group(1)), int(m.group(3))
+
+    def _read_stream(self, f, size):
+        chunks = []
+        while size > 0:
+            chunk = f.read(min(size, BLOCK_SIZE))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+            self.bytes_received += len(chunk)
+        return ''.join(chunks)
+
+    def _close_stream(self):
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+    def _seek_stream(self, pos):
+        """Make self._stream the rest of the file from pos on."""
+        if self._stream and self._stream_pos <= pos <= \
+                self._stream_pos + self.skip_limit:
+            skipped = self._read_stream(self._stream, pos - self._stream_pos)
+            self._stream_pos += len(skipped)
+            if self._stream_pos == pos:
+                return
+        self._close_stream()
+        # Stop where the tail we already have starts.
+        self._stream = self._open('bytes=%d-%d' % (pos, self._tail_start - 1))[0]
+        self._stream_pos = pos
+
+    def read(self, size=-1):
+        if size < 0 or self.pos + size > self.size:
+            size = max(self.size - self.pos, 0)
+        data = ''
+        if size and self.pos < self._tail_start:
+            length = min(size, self._tail_start - self.pos)
+            self._seek_stream(self.pos)
+            data = self._read_stream(self._stream, length)
+            self._stream_pos += len(data)
+            if len(data) != length:
+                self._close_stream()
+                raise IOError("Short read of %s" % self.url)
+            self.pos += length
+            size -= length
+        if size:
+            offset = self.pos - self._tail_start
+            data += self._tail[offset:offset + size]
+            self.pos += size
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise IOError("Invalid seek to %d in %s" % (offset, self.url))
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self._close_stream()
+
+
+# Extraction {{{1
+def match_members(names, patterns=None):
+    """Return the names matching any of the unzip-style wildcard patterns
+    (where * matches / too), or all of them if there are no patterns.
+    """
+    if not patterns:
+        return list(names)
+    return [name for name in names
+            if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+
+
+def extract_zip_members(zf, dest, patterns=None):
+    """Extract the members of the zipfile.ZipFile zf matching patterns into
+    dest, in the order they're stored, keeping their permissions as unzip
+    does.
+
+    Returns the list of zipfile.ZipInfo objects extracted.
+    """
+    wanted = set(match_members(zf.namelist(), patterns))
+    members = sorted([i for i in zf.infolist() if i.filename in wanted],
+                     key=lambda i: i.header_offset)
+    for info in members:
+        path = zf.extract(info, dest)
+        mode = (info.external_attr >> 16) & 07777
+        if mode and not info.filename.endswith('/'):
+            os.chmod(path, mode)
+    return members
@@ -11,9 +11,9 @@ mozharness.
 """
 
 import codecs
+import collections
 from contextlib import contextmanager
 import errno
-import gzip
 import inspect
 import os
 import platform
@@ -21,14 +21,16 @@ import pprint
 import re
 import shutil
 import socket
+import stat
 import subprocess
 import sys
+import tarfile
+import threading
 import time
 import traceback
 import urllib2
 import httplib
 import urlparse
-import hashlib
 if os.name == 'nt':
     try:
         import win32file
@@ -43,10 +45,36 @@ try:
 except ImportError:
     import json
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from mozprocess import ProcessHandler
-from mozharness.base.config import BaseConfig
+from mozharness.base.cache import DigestCache, DownloadCache, DEFAULT_MAX_SIZE
+from mozharness.base.config import BaseConfig, VALIDATORS
+from mozharness.base.digests import DigestMismatchError, DigestingWriter, \
+    file_digests, file_signature, hash_file, hexdigests, new_hashers, \
+    update_hashers
+from mozharness.base.extract import ExtractError, ReadAheadStream, \
+    archive_type, extract_archive
 from mozharness.base.log import SimpleFileLogger, MultiFileLogger, \
     LogMixin, OutputParser, DEBUG, INFO, ERROR, FATAL
+from mozharness.base.parallel import run_with_dependencies
+from mozharness.base.pgzip import gzip_file, DEFAULT_LEVEL as GZIP_LEVEL
+from mozharness.base.profiling import Profile, TOP_FUNCTIONS
+from mozharness.base.process import CommandUsage, OutputPump, \
+    new_process_group, wait_with_rusage, OUTPUT_TIMEOUT, TIMEOUT
+from mozharness.base.tracing import TRACE_FILE, Tracer, describe, traced
+from mozharness.base.trash import move_to_trash, query_trash_dir, \
+    start_background_delete
+
+# _download_file() won't split downloads into ranges smaller than this.
+DOWNLOAD_RANGE_MIN_SIZE = 16 * 1024 ** 2
+# The Linux ioctl that makes a copy-on-write clone of a file.
+FICLONE = 0x40049409
+# copytree() copies fewer files than this on the calling thread.
+COPYTREE_MIN_PARALLEL_FILES = 100
 
 
 # ScriptMixin {{{1
@@ -62,6 +90,13 @@ class ScriptMixin(object):
 
     env = None
     script_obj = None
+    download_cache = None
+    digest_cache = None
+    tracer = None
+    command_usages = None
+    _download_state = None
+    _download_validators = None
+    _file_digests = None
 
     # Simple filesystem commands {{{2
     def mkdir_p(self, path, error_level=ERROR):
@@ -79,13 +114,41 @@ class ScriptMixin(object):
         else:
             self.debug("mkdir_p: %s Already exists." % path)
 
+    def query_trash_dir(self, path):
+        """Where rmtree(defer=True) moves path: config['trash_dir'] if set,
+        otherwise see mozharness.base.trash.query_trash_dir(), going no
+        higher than config['base_work_dir'].
+        """
+        return self.config.get('trash_dir') or \
+            query_trash_dir(path, top=self.config.get('base_work_dir'))
+
     def rmtree(self, path, log_level=INFO, error_level=ERROR,
-               exit_code=-1):
+               exit_code=-1, defer=False):
         """
+        If defer is set, path is moved into the trash and deleted by a
+        background process, falling back to deleting it here if it can't
+        be moved (e.g. the trash is on another volume).
+
         Returns None for success, not None for failure
         """
         self.log("rmtree: %s" % path, level=log_level)
         error_message = "Unable to remove %s!" % path
+        if defer and os.path.lexists(path):
+            try:
+                trash_dir = self.query_trash_dir(path)
+                moved_to = move_to_trash(path, trash_dir)
+            except OSError, e:
+                self.info("Can't move %s to the trash (%s); removing it now." %
+                          (path, str(e)))
+            else:
+                self.info("Moved %s to %s; deleting it in the background." %
+                          (path, moved_to))
+                try:
+                    start_background_delete(trash_dir)
+                except OSError, e:
+                    self.warning("Can't start deleting %s: %s" %
+                                 (trash_dir, str(e)))
+                return
         if self._is_windows():
             # Call _rmtree_windows() directly, since even checking
             # os.path.exists(path) will hang if path is longer than MAX_PATH.
@@ -203,8 +266,124 @@ class ScriptMixin(object):
         """
         return urllib2.urlopen(url, **kwargs)
 
-    def _download_file(self, url, file_name):
+    def _open_url_range(self, url, start=None, end=None, validator=None):
+        """ Helper for _download_file(): open url, asking for bytes
+        start-end (inclusive; end=None means to the end of the file) if
+        start isn't None.
+
+        Returns a (file-like object, content_range) tuple; content_range is
+        the (start, end, total length or None) the server sent, or None if it
+        ignored the Range header and is sending the whole file.
+        """
+        request = url
+        if start is not None:
+            headers = {'Range': 'bytes=%d-%s' % (start, '' if end is None else end)}
+            if validator:
+                # Only send the range if the file hasn't changed.
+                headers['If-Range'] = validator
+            request = urllib2.Request(url, headers=headers)
+        f = self._urlopen(request, timeout=30)
+        if start is None or getattr(f, 'code', None) != 206:
+            return f, None
+        m = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)',
+                     f.info().get('content-range', ''))
+        if not m or int(m.group(1)) != start:
+            f.close()
+            raise urllib2.URLError("Unexpected Content-Range %s for %s" %
+                                   (f.info().get('content-range'), url))
+        total = None
+        if m.group(3) != '*':
+            total = int(m.group(3))
+        return f, (start, int(m.group(2)), total)
+
+    def _download_range(self, f, file_name, byte_range, hashers=None):
+        """ Helper for _download_file(): copy f into file_name at
+        byte_range[0], until byte_range[1] (inclusive) or the end of f if
+        that's None, advancing byte_range[0] as we go so an interrupted
+        download can be resumed.  Everything written is fed to hashers.
+        """
+        local_file = open(file_name, 'r+b')
+        try:
+            local_file.seek(byte_range[0])
+            while byte_range[1] is None or byte_range[0] <= byte_range[1]:
+                size = 1024 ** 2
+                if byte_range[1] is not None:
+                    size = min(size, byte_range[1] - byte_range[0] + 1)
+                block = f.read(size)
+                if not block:
+                    if byte_range[1] is not None:
+                        raise urllib2.URLError("Download incomplete; still missing bytes %d-%d" % tuple(byte_range))
+                    break
+                local_file.write(block)
+                if hashers:
+                    update_hashers(hashers, block)
+                byte_range[0] += len(block)
+            if byte_range[1] is None:
+                local_file.truncate()
+        finally:
+            local_file.close()
+            f.close()
+
+    def _start_download(self, url, file_name, connections, f=None):
+        """ Helper for _download_file(): start downloading url from scratch,
+        or from f if given, a response with the whole file in it.
+
+        Returns the new download state, and the open connection to read the
+        first range from.
+        """
+        if f is not None:
+            content_range = None
+        elif connections > 1:
+            f, content_range = self._open_url_range(url, start=0)
+        else:
+            f, content_range = self._urlopen(url, timeout=30), None
+        headers = f.info()
+        length = None
+        if content_range:
+            length = content_range[2]
+        elif headers.get('content-length') is not None:
+            length = int(headers['content-length'])
+        validator = headers.get('etag')
+        if not validator or validator.startswith('W/'):
+            validator = headers.get('last-modified')
+        state = {'url': url, 'validator': validator, 'length': length,
+                 'validators': dict([(name, headers.get(name))
+                                     for name in VALIDATORS
+                                     if headers.get(name)])}
+        num_ranges = 1
+        if content_range and length:
+            num_ranges = max(1, min(connections, length / DOWNLOAD_RANGE_MIN_SIZE))
+        if length is None:
+            state['ranges'] = [[0, None]]
+        else:
+            range_size = length / num_ranges
+            state['ranges'] = [[i * range_size, (i + 1) * range_size - 1]
+                               for i in range(num_ranges)]
+            state['ranges'][-1][1] = length - 1
+        if os.path.exists(file_name):
+            # It may be a hardlink into the download cache; don't write
+            # through it.
+            os.remove(file_name)
+        local_file = open(file_name, 'wb')
+        if num_ranges > 1:
+            # Preallocate, so each range can be written in place.
+            local_file.truncate(length)
+        local_file.close()
+        return state, f
+
+    def _download_file(self, url, file_name, connections=None, sha512=None,
+                       digests=None):
         """ Helper script for download_file()
+
+        If a previous attempt to download url to file_name was interrupted,
+        only the missing byte ranges are requested.  With connections > 1,
+        files of at least 2 * DOWNLOAD_RANGE_MIN_SIZE on servers supporting
+        Range requests are downloaded in up to that many ranges at once.
+
+        The sha512 of the file, and any other digests listed, are computed
+        as it's downloaded (or, if it was downloaded in several ranges,
+        afterwards) and recorded for query_file_digest().  If the sha512
+        isn't `sha512`, DigestMismatchError is raised.
         """
         # If our URLs look like files, prefix them with file:// so they can
         # be loaded like URLs.
@@ -212,28 +391,94 @@ class ScriptMixin(object):
             if not os.path.isfile(url):
                 self.fatal("The file %s does not exist" % url)
             url = 'file://%s' % os.path.abspath(url)
+        if connections is None:
+            connections = self.config.get('download_connections', 1)
+        if not url.startswith("http"):
+            connections = 1
+        if self._download_state is None:
+            # file_name -> state of its interrupted download
+            self._download_state = {}
 
         try:
-            f_length = None
-            f = self._urlopen(url, timeout=30)
-
-            if f.info().get('content-length') is not None:
-                f_length = int(f.info()['content-length'])
-                got_length = 0
-            local_file = open(file_name, 'wb')
-            while True:
-                block = f.read(1024 ** 2)
-                if not block:
-                    if f_length is not None and got_length != f_length:
-                        raise urllib2.URLError("Download incomplete; content-length was %d, but only received %d" % (f_length, got_length))
-                    break
-                local_file.write(block)
-                if f_length is not None:
-                    got_length += len(block)
-            local_file.close()
+            first = None
+            state = self._download_state.get(file_name)
+            if state and not self._can_resume_download(url, file_name, state):
+                state = None
+            if state:
+                self.info("Resuming download of %s" % url)
+            else:
+                state, first = self._start_download(url, file_name, connections)
+                self._download_state[file_name] = state
+            ranges = [r for r in state['ranges']
+                      if r[1] is None or r[0] <= r[1]]
+            algorithms = set(['sha512'] + list(digests or []))
+            # Single stream downloads can be hashed as they go.
+            hashers = None
+
+            def fetch(index):
+                byte_range = ranges[index]
+                f = None
+                if index == 0:
+                    f = first
+                if f is None:
+                    f, content_range = self._open_url_range(
+                        url, byte_range[0], byte_range[1],
+                        validator=state['validator'])
+                    if content_range is None:
+                        if len(state['ranges']) > 1:
+                            f.close()
+                            del self._download_state[file_name]
+                            raise urllib2.URLError("Server ignored our Range request for %s; starting over" % url)
+                        # Start over with this response; the file may have
+                        # changed, so go by its headers, not the old ones.
+                        self.info("Server ignored our Range request; starting over")
+                        new_state, f = self._start_download(url, file_name,
+                                                            1, f=f)
+                        state.clear()
+                        state.update(new_state)
+                        byte_range = state['ranges'][0]
+                    elif (state['length'] is not None and
+                          content_range[2] not in (None, state['length'])):
+                        f.close()
+                        del self._download_state[file_name]
+                        raise urllib2.URLError("%s changed size; starting over" % url)
+                range_hashers = None
+                if len(state['ranges']) == 1:
+                    range_hashers = new_hashers(algorithms)
+                    if byte_range[0]:
+                        # What we got before being interrupted.
+                        hash_file(file_name, range_hashers, length=byte_range[0])
+                self._download_range(f, file_name, byte_range, range_hashers)
+                return range_hashers
+
+            if len(ranges) > 1:
+                self.info("Downloading %d byte ranges at once" % len(ranges))
+                run_with_dependencies(range(len(ranges)), {}, fetch,
+                                      max_workers=len(ranges))
+            elif ranges:
+                hashers = fetch(0)
+            del self._download_state[file_name]
+            if self._download_validators is None:
+                self._download_validators = {}
+            self._download_validators[file_name] = state['validators']
+            if hashers:
+                file_digest = hexdigests(hashers)
+            elif sha512 or digests:
+                file_digest = file_digests(file_name, algorithms)
+            else:
+                # Left to query_file_digest(), if anyone asks.
+                return file_name
+            if sha512 and file_digest['sha512'] != sha512:
+                os.remove(file_name)
+                raise DigestMismatchError("%s has sha512 %s, expected %s" %
+                                          (url, file_digest['sha512'], sha512))
+            self.record_file_digests(file_name, file_digest)
             return file_name
         except urllib2.HTTPError, e:
             self.warning("Server returned status %s %s for %s" % (str(e.code), str(e), url))
+            if e.code == 416:
+                # Requested Range Not Satisfiable; start over next time.
+                self._download_state.pop(file_name, None)
             raise
         except urllib2.URLError, e:
             self.warning("URL Error: %s" % url)
@@ -261,17 +506,32 @@ class ScriptMixin(object):
             self.warning("Socket error when accessing %s: %s" % (url, str(e)))
             raise
 
-    def _retry_download_file(self, url, file_name, error_level, retry_config=None):
+    def _can_resume_download(self, url, file_name, state):
+        """ Helper for _download_file(): can we pick up the download
+        described by state where it left off?
+        """
+        if state['url'] != url or not os.path.isfile(file_name):
+            return False
+        size = os.path.getsize(file_name)
+        if len(state['ranges']) > 1:
+            return size == state['length']
+        return size >= state['ranges'][0][0]
+
+    def _retry_download_file(self, url, file_name, error_level, retry_config=None,
+                             **kwargs):
         """ Helper method to retry _download_file().
 
             Split out so we can alter the retry logic in
             mozharness.mozilla.testing.gaia_test.
+
+            kwargs are passed on to _download_file().
             """
         retry_args = dict(
             failure_status=None,
             retry_exceptions=(urllib2.HTTPError, urllib2.URLError,
                               httplib.BadStatusLine,
-                              socket.timeout, socket.error),
+                              socket.timeout, socket.error,
+                              DigestMismatchError),
             error_message="Can't download from %s to %s!" % (url, file_name),
             error_level=error_level,
         )
@@ -282,15 +542,34 @@ class ScriptMixin(object):
         return self.retry(
             self._download_file,
             args=(url, file_name),
+            kwargs=kwargs,
             **retry_args
         )
 
     # http://www.techniqal.com/blog/2008/07/31/python-file-read-write-with-urllib2/
     # TODO thinking about creating a transfer object.
+    @traced('download')
     def download_file(self, url, file_name=None, parent_dir=None,
                       create_parent_dir=True, error_level=ERROR,
-                      exit_code=3, retry_config=None):
+                      exit_code=3, retry_config=None, connections=None,
+                      sha512=None, digests=None):
         """ Python wget.
+
+        Retries resume where the last attempt stopped if the server supports
+        Range requests.  connections, defaulting to
+        self.config.get('download_connections', 1), is the number of byte
+        ranges of big files to download at once.
+
+        The file's sha512, and any other digests listed (e.g. ['sha1']),
+        are computed while downloading and recorded for query_file_digest().
+        If sha512 is given, downloads with another sha512 are retried.
+
+        If self.config['download_cache_dir'] is set (and
+        self.config['bypass_download_cache'] isn't), files are looked up in
+        and added to that DownloadCache; sha512, if known (e.g. from a
+        manifest), lets any cached file with the same contents be used.
+        Without it, the copy cached for url is only used if the server says
+        it's unchanged.
         """
         if not file_name:
             try:
@@ -304,11 +583,263 @@ class ScriptMixin(object):
             if create_parent_dir:
                 self.mkdir_p(parent_dir, error_level=error_level)
         self.info("Downloading %s to %s" % (url, file_name))
-        status = self._retry_download_file(url, file_name, error_level, retry_config=retry_config)
+        if self._download_state:
+            self._download_state.pop(file_name, None)
+        cache = None
+        if not self.config.get('bypass_download_cache'):
+            cache = self.query_download_cache()
+        if cache:
+            status = self._cached_download_file(cache, url, file_name,
+                                                error_level, sha512=sha512,
+                                                retry_config=retry_config,
+                                                connections=connections,
+                                                digests=digests)
+        else:
+            status = self._retry_download_file(url, file_name, error_level,
+                                               retry_config=retry_config,
+                                               connections=connections,
+                                               sha512=sha512, digests=digests)
+        if self._download_validators:
+            # Only wanted by _cached_download_file().
+            self._download_validators.pop(file_name, None)
         if status == file_name:
             self.info("Downloaded %d bytes." % os.path.getsize(file_name))
         return status
 
+    def query_download_cache(self):
+        """ Return the DownloadCache in self.config['download_cache_dir'],
+        or None if there isn't one.
+
+        The cache is bounded by self.config['download_cache_max_size'] bytes.
+        """
+        if self.download_cache is None and self.config.get('download_cache_dir'):
+            try:
+                self.download_cache = DownloadCache(
+                    self.config['download_cache_dir'],
+                    max_size=self.config.get('download_cache_max_size',
+                                             DEFAULT_MAX_SIZE))
+            except (IOError, OSError), e:
+                self.warning("Can't use download cache %s: %s" %
+                             (self.config['download_cache_dir'], str(e)))
+                # Don't try again.
+                self.download_cache = False
+        return self.download_cache
+
+    def query_digest_cache(self):
+        """ Return the DigestCache in self.config['digest_cache_file'] (by
+        default digests.json in self.config['download_cache_dir']), or None
+        if there isn't one.
+        """
+        if self.digest_cache is None:
+            path = self.config.get('digest_cache_file')
+            if not path and self.config.get('download_cache_dir'):
+                path = os.path.join(self.config['download_cache_dir'],
+                                    'digests.json')
+            if not path:
+                return None
+            try:
+                self.digest_cache = DigestCache(path)
+            except (IOError, OSError), e:
+                self.warning("Can't use digest cache %s: %s" % (path, str(e)))
+                # Don't try again.
+                self.digest_cache = False
+        return self.digest_cache
+
+    def record_file_digests(self, file_path, digests):
+        """ Remember the digests of file_path, e.g. computed while
+        downloading or copying it, until it changes.
+
+        They're also added to the digest cache, if there is one (see
+        query_digest_cache()), for other processes to use.
+
+        Args:
+            file_path (str): file the digests are of.
+            digests (dict): algorithm name -> hex digest.
+        """
+        signature, new = self._record_digests_in_memory(file_path, digests)
+        cache = self.query_digest_cache()
+        if cache and new:
+            try:
+                cache.store(file_path, new, signature)
+            except (IOError, OSError), e:
+                self.warning("Can't add to digest cache %s: %s" %
+                             (cache.path, str(e)))
+
+    def _record_digests_in_memory(self, file_path, digests):
+        """ Helper for record_file_digests(); returns file_path's signature
+        and those of digests we didn't already know.
+        """
+        if self._file_digests is None:
+            # absolute path -> (file_signature(), {algorithm: hex digest})
+            self._file_digests = {}
+        file_path = os.path.abspath(file_path)
+        signature = file_signature(file_path)
+        known = {}
+        if file_path in self._file_digests and \
+                self._file_digests[file_path][0] == signature:
+            known = self._file_digests[file_path][1]
+        new = dict([(a, d) for a, d in digests.items() if known.get(a) != d])
+        self._file_digests[file_path] = (signature, dict(known, **digests))
+        return signature, new
+
+    def query_recorded_digests(self, file_path):
+        """ Return a dict of the digests recorded for file_path that still
+        apply, which may be empty.
+        """
+        if not self._file_digests:
+            return {}
+        file_path = os.path.abspath(file_path)
+        if file_path not in self._file_digests:
+            return {}
+        signature, digests = self._file_digests[file_path]
+        try:
+            if file_signature(file_path) == signature:
+                return dict(digests)
+        except OSError:
+            pass
+        del self._file_digests[file_path]
+        return {}
+
+    def query_recorded_digest(self, file_path, algorithm='sha512'):
+        """ Return the recorded `algorithm` digest of file_path, or None.
+        """
+        return self.query_recorded_digests(file_path).get(algorithm)
+
+    def query_file_digests(self, file_path, algorithms=('sha512', )):
+        """ Return a dict of algorithm name -> hex digest of file_path,
+        only reading the file (once, for all of algorithms) if they haven't
+        been recorded or cached since the file last changed.
+        """
+        digests = self.query_recorded_digests(file_path)
+        missing = [a for a in algorithms if a not in digests]
+        if missing:
+            cache = self.query_digest_cache()
+            if cache:
+                # Which stores whatever it computes.
+                found = cache.query(file_path, missing)
+                self._record_digests_in_memory(file_path, found)
+            else:
+                found = file_digests(file_path, missing)
+                self.record_file_digests(file_path, found)
+            digests.update(found)
+        return dict([(a, digests[a]) for a in algorithms])
+
+    def query_file_digest(self, file_path, algorithm='sha512'):
+        """ Return the `algorithm` hex digest of file_path, only reading the
+        file if we haven't recorded or cached it since the file last changed.
+        """
+        return self.query_file_digests(file_path, [algorithm])[algorithm]
+
+    def query_tracer(self):
+        """ Return the Tracer recording spans for this script (see
+        mozharness.base.tracing), or None.
+
+        Helper objects with a script_obj, like VCS classes, share its tracer.
+        """
+        script_obj = self.script_obj
+        if self.tracer is None and script_obj is not None and \
+                script_obj is not self and hasattr(script_obj, 'query_tracer'):
+            return script_obj.query_tracer()
+        return self.tracer
+
+    @contextmanager
+    def trace_span(self, name, category, **args):
+        """Record the with block as a span, if there's a tracer."""
+        tracer = self.query_tracer()
+        if tracer is None:
+            yield args
+        else:
+            with tracer.span(name, category, **args) as span_args:
+                yield span_args
+
+    def query_current_action(self):
+        """Return the name of the action running on this thread, if known."""
+        return None
+
+    def record_command_usage(self, usage):
+        """Keep the CommandUsage of a finished command in
+        self.command_usages, as an (action, usage) tuple.
+
+        Helper objects with a script_obj, like VCS classes, record into it.
+        """
+        script_obj = self.script_obj
+        if script_obj is not None and script_obj is not self and \
+                hasattr(script_obj, 'record_command_usage'):
+            return script_obj.record_command_usage(usage)
+        if self.command_usages is None:
+            self.command_usages = []
+        self.command_usages.append((self.query_current_action(), usage))
+
+    def _cached_download_file(self, cache, url, file_name, error_level,
+                              sha512=None, retry_config=None, connections=None,
+                              digests=None):
+        """ Helper for download_file(): get url from cache, or download it
+        and add it to the cache.
+
+        Without sha512 to go by, a copy cached for url is only used if the
+        server says it hasn't changed since.
+        """
+        with cache.lock(url):
+            try:
+                path = cache.lookup(
+                    url, sha512=sha512,
+                    revalidate=lambda v: self._is_unchanged(url, v))
+                if path:
+                    how = cache.fetch(path, file_name)
+                    self.info("Using cached %s (%s)" % (url, how))
+                    # Cached files are named by their sha512.
+                    self.record_file_digests(file_name,
+                                             {'sha512': os.path.basename(path)})
+                    return file_name
+            except (IOError, OSError), e:
+                self.warning("Can't use cached %s: %s" % (url, str(e)))
+            status = self._retry_download_file(url, file_name, error_level,
+                                               retry_config=retry_config,
+                                               connections=connections,
+                                               sha512=sha512, digests=digests)
+            if status == file_name:
+                known_sha512 = self.query_recorded_digest(file_name)
+                validators = None
+                if self._download_validators:
+                    validators = self._download_validators.pop(file_name, None)
+                try:
+                    if known_sha512:
+                        cache.store(url, file_name, sha512=known_sha512,
+                                    verified=True, validators=validators)
+                    elif cache.store(url, file_name, sha512=sha512,
+                                     validators=validators) is None:
+                        self.warning("%s doesn't match sha512 %s; not caching it" %
+                                     (url, sha512))
+                except (IOError, OSError), e:
+                    self.warning("Can't add %s to the download cache: %s" %
+                                 (file_name, str(e)))
+            return status
+
+    def _is_unchanged(self, url, validators):
+        """ Helper for _cached_download_file(): does the server say url is
+        unchanged since it had validators (its ETag and Last-Modified)?
+        """
+        headers = dict([(VALIDATORS[name], value)
+                        for name, value in validators.items()
+                        if name in VALIDATORS])
+        if not headers or not url.startswith('http'):
+            return False
+        try:
+            f = self._urlopen(urllib2.Request(url, headers=headers), timeout=30)
+        except urllib2.HTTPError, e:
+            return e.code == 304
+        except (urllib2.URLError, httplib.HTTPException, socket.error), e:
+            self.warning("Can't revalidate cached %s: %s" % (url, str(e)))
+            return False
+        try:
+            # Not every server answers conditional requests.
+            name = 'ETag'
+            if name not in validators:
+                name = 'Last-Modified'
+            return f.info().get(name) == validators.get(name)
+        finally:
+            f.close()
+
     def move(self, src, dest, log_level=INFO, error_level=ERROR,
              exit_code=-1):
         self.log("Moving %s to %s" % (src, dest), level=log_level)
@@ -329,27 +860,59 @@ class ScriptMixin(object):
         self.info("Chmoding %s to %s" % (path, str(oct(mode))))
         os.chmod(path, mode)
 
-    def copyfile(self, src, dest, log_level=INFO, error_level=ERROR, copystat=False, compress=False):
+    def copyfile(self, src, dest, log_level=INFO, error_level=ERROR, copystat=False, compress=False,
+                 digests=None):
+        """ Copy (or gzip, if compress is set) src to dest.
+
+        digests is a list of digests of dest (e.g. ['sha512']) to compute
+        while copying and record for query_file_digest().  The digests
+        already recorded for src are recorded for an uncompressed dest for
+        free.
+
+        Compression runs on self.config['gzip_threads'] threads (default:
+        one per CPU) at self.config['gzip_level'] (default 9).
+        """
         if compress:
             self.log("Compressing %s to %s" % (src, dest), level=log_level)
             try:
-                infile = open(src, "rb")
-                outfile = gzip.open(dest, "wb")
-                outfile.writelines(infile)
-                outfile.close()
-                infile.close()
+                hashers = new_hashers(digests or [])
+                rawfile = open(dest, "wb")
+                try:
+                    gzip_file(src, dest,
+                              level=self.config.get('gzip_level', GZIP_LEVEL),
+                              threads=self.config.get('gzip_threads'),
+                              fileobj=DigestingWriter(rawfile, hashers))
+                finally:
+                    rawfile.close()
             except IOError, e:
                 self.log("Can't compress %s to %s: %s!" % (src, dest, str(e)),
                          level=error_level)
                 return -1
+            if hashers:
+                self.record_file_digests(dest, hexdigests(hashers))
         else:
             self.log("Copying %s to %s" % (src, dest), level=log_level)
+            known = self.query_recorded_digests(src)
+            missing = [d for d in digests or [] if d not in known]
             try:
-                shutil.copyfile(src, dest)
+                if missing:
+                    hashers = new_hashers(missing)
+                    infile = open(src, "rb")
+                    outfile = DigestingWriter(open(dest, "wb"), hashers)
+                    shutil.copyfileobj(infile, outfile, 1024 ** 2)
+                    outfile.close()
+                    infile.close()
+                    known.update(hexdigests(hashers))
+                else:
+                    shutil.copyfile(src, dest)
             except (IOError, shutil.Error), e:
                 self.log("Can't copy %s to %s: %s!" % (src, dest, str(e)),
                          level=error_level)
                 return -1
+            if missing:
+                self.record_file_digests(src, known)
+            if known:
+                self.record_file_digests(dest, known)
 
         if copystat:
             try:
@@ -360,7 +923,7 @@ class ScriptMixin(object):
                 return -1
 
     def copytree(self, src, dest, overwrite='no_overwrite', log_level=INFO,
-                 error_level=ERROR):
+                 error_level=ERROR, link='copy', symlinks=False, workers=None):
         """an implementation of shutil.copytree however it allows for
         dest to exist and implements different overwrite levels.
         overwrite uses:
@@ -368,49 +931,148 @@ class ScriptMixin(object):
         'overwrite_if_exists' will only overwrite destination paths that have
                    the same path names relative to the root of the src and
                    destination tree
-        'clobber' will replace the whole destination tree(clobber) if it exists"""
+        'clobber' will replace the whole destination tree(clobber) if it exists
+
+        link is how files get to dest:
+        'copy' copies them, with their permissions and times
+        'hardlink' hardlinks them where possible, so dest shares the src
+                   files: only for trees nobody will write to
+        'reflink' makes copy-on-write clones where the filesystem supports
+                  them (btrfs, xfs), which is as quick as hardlinking but
+                  safe to write to
+
+        Both fall back to copying.  symlinks are copied as symlinks if
+        symlinks is set, as with shutil.copytree.
+
+        Files are copied on the calling thread unless workers (default
+        self.config.get('copytree_workers', 1)) is more than 1 and there
+        are at least COPYTREE_MIN_PARALLEL_FILES of them; then that many
+        threads copy them.  Threads only pay off where each file takes a
+        while, e.g. on network filesystems: on a local disk they make
+        copying many small files slower (see test/benchmark_copytree.py).
+        """
 
         self.info('copying tree: %s to %s' % (src, dest))
+        if overwrite not in ('no_overwrite', 'overwrite_if_exists', 'clobber'):
+            self.fatal("%s is not a valid argument for param overwrite" % (overwrite))
+        if link not in ('copy', 'hardlink', 'reflink'):
+            self.fatal("%s is not a valid argument for param link" % (link))
+        if workers is None:
+            workers = self.config.get('copytree_workers', 1)
+        start = time.time()
         try:
             if overwrite == 'clobber' or not os.path.exists(dest):
                 self.rmtree(dest)
-                shutil.copytree(src, dest)
-            elif overwrite == 'no_overwrite' or overwrite == 'overwrite_if_exists':
-                files = os.listdir(src)
-                for f in files:
-                    abs_src_f = os.path.join(src, f)
-                    abs_dest_f = os.path.join(dest, f)
-                    if not os.path.exists(abs_dest_f):
-                        if os.path.isdir(abs_src_f):
-                            self.mkdir_p(abs_dest_f)
-                            self.copytree(abs_src_f, abs_dest_f,
-                                          overwrite='clobber')
-                        else:
-                            shutil.copy2(abs_src_f, abs_dest_f)
-                    elif overwrite == 'no_overwrite':  # destination path exists
-                        if os.path.isdir(abs_src_f) and os.path.isdir(abs_dest_f):
-                            self.copytree(abs_src_f, abs_dest_f,
-                                          overwrite='no_overwrite')
-                        else:
-                            self.debug('ignoring path: %s as destination: \
-                                    %s exists' % (abs_src_f, abs_dest_f))
-                    else:  # overwrite == 'overwrite_if_exists' and destination exists
-                        self.debug('overwriting: %s with: %s' %
-                                   (abs_dest_f, abs_src_f))
-                        self.rmtree(abs_dest_f)
-
-                        if os.path.isdir(abs_src_f):
-                            self.mkdir_p(abs_dest_f)
-                            self.copytree(abs_src_f, abs_dest_f,
-                                          overwrite='overwrite_if_exists')
-                        else:
-                            shutil.copy2(abs_src_f, abs_dest_f)
+                dirs, files = self._plan_copytree(src, dest, None, symlinks)
+            else:
+                dirs, files = self._plan_copytree(src, dest, overwrite, symlinks)
+            created = []
+            for src_dir, dest_dir in dirs:
+                if not os.path.isdir(dest_dir):
+                    os.makedirs(dest_dir)
+                    created.append((src_dir, dest_dir))
+            counts = {'copy': 0, 'hardlink': 0, 'reflink': 0, 'symlink': 0}
+            counts_lock = threading.Lock()
+
+            def copy_file(item):
+                how = self._copy_tree_file(item[0], item[1], link, symlinks)
+                with counts_lock:
+                    counts[how] += 1
+            if workers <= 1 or len(files) < COPYTREE_MIN_PARALLEL_FILES:
+                for item in files:
+                    copy_file(item)
             else:
-                self.fatal("%s is not a valid argument for param overwrite" % (overwrite))
-        except (IOError, shutil.Error):
+                run_with_dependencies(files, {}, copy_file,
+                                      max_workers=workers)
+            # Like shutil.copytree, once they're filled.
+            for src_dir, dest_dir in reversed(created):
+                shutil.copystat(src_dir, dest_dir)
+        except (IOError, OSError, shutil.Error):
             self.exception("There was an error while copying %s to %s!" % (src, dest),
                            level=error_level)
             return -1
+        self.log("Copied %d files (%d bytes) in %.2fs: %s" %
+                 (len(files), sum([f[2] for f in files]), time.time() - start,
+                  ', '.join(['%d %s' % (counts[k], k) for k in sorted(counts)
+                             if counts[k]]) or 'nothing to do'),
+                 level=log_level)
+
+    def _plan_copytree(self, src, dest, overwrite, symlinks):
+        """ Helper for copytree(): walk src once, returning a list of
+        (src, dest) directories to create, parents first, and one of (src,
+        dest, size) files to copy.
+
+        overwrite is as for copytree(), or None if dest doesn't exist, so
+        nothing under it needs checking.  Destinations that
+        'overwrite_if_exists' replaces are removed here.
+        """
+        dirs = []
+        files = []
+        # (src dir, dest dir, overwrite mode for its entries)
+        todo = [(src, dest, overwrite)]
+        dirs.append((src, dest))
+        while todo:
+            src_dir, dest_dir, mode = todo.pop()
+            for name in sorted(os.listdir(src_dir)):
+                abs_src = os.path.join(src_dir, name)
+                abs_dest = os.path.join(dest_dir, name)
+                if symlinks and os.path.islink(abs_src):
+                    is_dir, size = False, 0
+                else:
+                    st = os.stat(abs_src)
+                    is_dir, size = stat.S_ISDIR(st.st_mode), st.st_size
+                child_mode = None
+                if mode is not None and os.path.lexists(abs_dest):
+                    if mode == 'no_overwrite':
+                        if not (is_dir and os.path.isdir(abs_dest)):
+                            self.debug('ignoring path: %s as destination: %s exists' %
+                                       (abs_src, abs_dest))
+                            continue
+                        child_mode = mode
+                    else:
+                        self.debug('overwriting: %s with: %s' % (abs_dest, abs_src))
+                        self.rmtree(abs_dest)
+                if is_dir:
+                    dirs.append((abs_src, abs_dest))
+                    todo.append((abs_src, abs_dest, child_mode))
+                else:
+                    files.append((abs_src, abs_dest, size))
+        return dirs, files
+
+    def _copy_tree_file(self, src, dest, link, symlinks):
+        """ Helper for copytree(): get src to dest the `link` way if we can.
+
+        Returns how it was done: 'copy', 'hardlink', 'reflink' or 'symlink'.
+        """
+        if symlinks and os.path.islink(src):
+            os.symlink(os.readlink(src), dest)
+            return 'symlink'
+        if link == 'hardlink' and hasattr(os, 'link'):
+            try:
+                os.link(src, dest)
+                return 'hardlink'
+            except OSError:
+                # e.g. another filesystem
+                pass
+        elif link == 'reflink' and fcntl and sys.platform.startswith('linux'):
+            src_fh = open(src, 'rb')
+            try:
+                dest_fh = open(dest, 'wb')
+                try:
+                    fcntl.ioctl(dest_fh.fileno(), FICLONE, src_fh.fileno())
+                    cloned = True
+                except IOError:
+                    # Not supported here; copy it instead.
+                    cloned = False
+                finally:
+                    dest_fh.close()
+            finally:
+                src_fh.close()
+            if cloned:
+                shutil.copystat(src, dest)
+                return 'reflink'
+        shutil.copy2(src, dest)
+        return 'copy'
 
     def write_to_file(self, file_path, contents, verbose=True,
                       open_mode='w', create_parent_dir=False,
@@ -579,7 +1241,10 @@ class ScriptMixin(object):
                 if sleeptime > 0:
                     self.log("retry: Failed, sleeping %d seconds before retrying" %
                              sleeptime, level=log_level)
-                    time.sleep(sleeptime)
+                    with self.trace_span('sleep %ds' % sleeptime, 'retry',
+                                         action=getattr(action, '__name__',
+                                                        str(action))):
+                        time.sleep(sleeptime)
                     sleeptime = sleeptime * 2
                     if sleeptime > max_sleeptime:
                         sleeptime = max_sleeptime
@@ -663,28 +1328,29 @@ class ScriptMixin(object):
             self.log("Unknown return_type type %s requested in query_exe!" % return_type, level=error_level)
         return exe
 
+    @traced('command')
     def run_command(self, command, cwd=None, error_list=None,
                     halt_on_failure=False, success_codes=None,
                     env=None, partial_env=None, return_type='status',
                     throw_exception=False, output_parser=None,
                     output_timeout=None, fatal_exit_code=2,
-                    error_level=ERROR, **kwargs):
+                    error_level=ERROR, timeout=None, **kwargs):
         """Run a command, with logging and error parsing.
 
         output_timeout is the number of seconds without output before the process
         is killed.
 
-        TODO: context_lines
+        timeout is the total number of seconds the process may run before it
+        is killed.  It's ignored on Windows.
 
         output_parser lets you provide an instance of your own OutputParser
         subclass, or pass None to use OutputParser.
 
         error_list example:
         [{'regex': re.compile('^Error: LOL J/K'), level=IGNORE},
-         {'regex': re.compile('^Error:'), level=ERROR, contextLines='5:5'},
-         {'substr': 'THE WORLD IS ENDING', level=FATAL, contextLines='20:'}
+         {'regex': re.compile('^Error:'), level=ERROR, context_lines='5:5'},
+         {'substr': 'THE WORLD IS ENDING', level=FATAL, context_lines='20:'}
         ]
-        (context_lines isn't written yet)
         """
         if success_codes is None:
             success_codes = [0]
@@ -717,8 +1383,15 @@ class ScriptMixin(object):
         else:
             parser = output_parser
 
+        start_time = time.time()
+        usage = None
         try:
-            if output_timeout:
+            if OutputPump.supported():
+                returncode, usage = self._pump_command(
+                    command, parser, shell=shell, cwd=cwd, env=env,
+                    output_timeout=output_timeout, timeout=timeout,
+                    error_level=error_level)
+            elif output_timeout:
                 def processOutput(line):
                     parser.add_lines(line)
 
@@ -761,13 +1434,18 @@ class ScriptMixin(object):
             self.log('caught OS error %s: %s while running %s' % (e.errno,
                      e.strerror, command), level=level)
             return -1
+        parser.finish()
+        if usage is None:
+            usage = CommandUsage(command, time.time() - start_time)
+        self.record_command_usage(usage)
 
         return_level = INFO
         if returncode not in success_codes:
             return_level = error_level
             if throw_exception:
                 raise subprocess.CalledProcessError(returncode, command)
-        self.log("Return code: %d" % returncode, level=return_level)
+        self.log("Return code: %d (%s)" % (returncode, usage),
+                 level=return_level)
 
         if halt_on_failure:
             _fail = False
@@ -788,13 +1466,247 @@ class ScriptMixin(object):
             return parser.num_errors
         return returncode
 
+    def _pump_command(self, command, parser, shell=False, cwd=None, env=None,
+                      output_timeout=None, timeout=None, error_level=ERROR):
+        """Helper for run_command(): run command and feed its output to
+        parser through an OutputPump.  Returns the exit status and the
+        command's CommandUsage.
+        """
+        preexec_fn = None
+        if output_timeout or timeout:
+            self.info("Calling %s with output_timeout %s, timeout %s" %
+                      (command, output_timeout, timeout))
+            preexec_fn = new_process_group
+        p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
+                             cwd=cwd, stderr=subprocess.STDOUT, env=env,
+                             preexec_fn=preexec_fn)
+        pump = OutputPump()
+        job = pump.add_process(p, [(p.stdout, parser.add_lines)],
+                               output_timeout=output_timeout, timeout=timeout,
+                               kill_process_group=preexec_fn is not None)
+        pump.run()
+        if job.timed_out == OUTPUT_TIMEOUT:
+            self.info("Automation Error: timed out after %s seconds of no output running %s" %
+                      (str(output_timeout), str(command)))
+            self.log('timed out after %s seconds of no output' % output_timeout,
+                     level=error_level)
+        elif job.timed_out == TIMEOUT:
+            self.info("Automation Error: timed out after %s seconds running %s" %
+                      (str(timeout), str(command)))
+            self.log('timed out after %s seconds' % timeout, level=error_level)
+        return job.returncode, CommandUsage.from_job(command, job)
+
+    def run_commands(self, specs, max_workers=4, halt_on_failure=False,
+                     fatal_exit_code=2, error_level=ERROR):
+        """Run several commands concurrently, at most max_workers at a time.
+
+        Each spec is a dict with a 'command' key, and optionally 'name',
+        'cwd', 'env', 'partial_env', 'error_list', 'output_parser',
+        'success_codes', 'output_timeout' and 'timeout', which behave like
+        the run_command() arguments of the same names.  Every command gets
+        its own OutputParser, and its output is logged prefixed with
+        '[name] ' (name defaults to the spec's index).
+
+        Returns a list of result dicts, in the same order as specs:
+
+        {'name': ..., 'command': ..., 'returncode': 0, 'num_errors': 0,
+         'worst_log_level': INFO, 'timed_out': None,
+         'wall_time': 12.3, 'cpu_time': 40.2}
+
+        cpu_time is the user + system time of the command and its waited-for
+        children, or None where that isn't available.  returncode is -1 if
+        the command couldn't be started.
+
+        On Windows the commands are run one at a time through run_command().
+        """
+        results = [None] * len(specs)
+        pending = range(len(specs))
+        running = []
+        pump = OutputPump()
+
+        def succeeded(index):
+            success_codes = specs[index].get('success_codes') or [0]
+            return results[index]['returncode'] in success_codes
+
+        def prepare(index):
+            spec = specs[index]
+            name = spec.get('name', str(index))
+            result = {
+                'name': name,
+                'command': spec['command'],
+                'returncode': -1,
+                'num_errors': 0,
+                'worst_log_level': INFO,
+                'timed_out': None,
+                'wall_time': None,
+                'cpu_time': None,
+            }
+            results[index] = result
+            parser = spec.get('output_parser')
+            if parser is None:
+                parser = OutputParser(config=self.config, log_obj=self.log_obj,
+                                      error_list=spec.get('error_list'))
+            parser.log_prefix = '[%s] ' % name
+            env = spec.get('env')
+            if env is None and spec.get('partial_env'):
+                env = self.query_env(partial_env=spec['partial_env'])
+            cwd = spec.get('cwd')
+            if cwd is not None and not os.path.isdir(cwd):
+                parser.log("Can't run command %s in non-existent directory '%s'!" %
+                           (spec['command'], cwd), level=error_level)
+                result['worst_log_level'] = error_level
+                return None
+            parser.info("Running command: %s%s" % (
+                spec['command'], " in %s" % cwd if cwd else ""))
+            return result, parser, env, cwd
+
+        def finish(index, parser, usage=None):
+            parser.finish()
+            result = results[index]
+            result['num_errors'] = parser.num_errors
+            result['worst_log_level'] = parser.worst_log_level
+            level = INFO
+            if not succeeded(index):
+                level = error_level
+            if result['timed_out'] == OUTPUT_TIMEOUT:
+                parser.log('timed out after %s seconds of no output' %
+                           specs[index]['output_timeout'], level=error_level)
+            elif result['timed_out'] == TIMEOUT:
+                parser.log('timed out after %s seconds' %
+                           specs[index]['timeout'], level=error_level)
+            if usage is None:
+                parser.log("Return code: %d" % result['returncode'],
+                           level=level)
+            else:
+                self.record_command_usage(usage)
+                parser.log("Return code: %d (%s)" % (result['returncode'],
+                                                     usage), level=level)
+            result['worst_log_level'] = self.worst_level(
+                level, result['worst_log_level'])
+
+        def start_next():
+            while pending and len(running) < max_workers:
+                index = pending.pop(0)
+                prepared = prepare(index)
+                if not prepared:
+                    continue
+                result, parser, env, cwd = prepared
+                spec = specs[index]
+                command = spec['command']
+                timed = spec.get('output_timeout') or spec.get('timeout')
+                try:
+                    p = subprocess.Popen(
+                        command, shell=not isinstance(command, (list, tuple)),
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                        cwd=cwd, env=env,
+                        preexec_fn=new_process_group if timed else None)
+                except OSError, e:
+                    parser.log('caught OS error %s: %s while running %s' %
+                               (e.errno, e.strerror, command), level=error_level)
+                    finish(index, parser)
+                    continue
+
+                def on_exit(job, index=index, parser=parser):
+                    running.remove(job)
+                    result = results[index]
+                    result['returncode'] = job.returncode
+                    result['timed_out'] = job.timed_out
+                    result['wall_time'] = job.wall_time()
+                    result['cpu_time'] = job.cpu_time()
+                    finish(index, parser,
+                           CommandUsage.from_job(specs[index]['command'], job))
+                    start_next()
+                running.append(pump.add_process(
+                    p, [(p.stdout, parser.add_lines)],
+                    output_timeout=spec.get('output_timeout'),
+                    timeout=spec.get('timeout'), on_exit=on_exit,
+                    kill_process_group=bool(timed)))
+
+        if OutputPump.supported():
+            self.info("Running %d commands, up to %d at a time." %
+                      (len(specs), max_workers))
+            start_next()
+            pump.run()
+        else:
+            for index in pending:
+                prepared = prepare(index)
+                if not prepared:
+                    continue
+                result, parser, env, cwd = prepared
+                spec = specs[index]
+                start = time.time()
+                result['returncode'] = self.run_command(
+                    spec['command'], cwd=cwd, env=env, output_parser=parser,
+                    success_codes=spec.get('success_codes'),
+                    output_timeout=spec.get('output_timeout'),
+                    error_level=error_level)
+                result['wall_time'] = time.time() - start
+                finish(index, parser)
+
+        failed = [results[i]['name'] for i in range(len(specs))
+                  if not succeeded(i) or results[i]['num_errors']]
+        if failed and halt_on_failure:
+            self.return_code = fatal_exit_code
+            self.fatal("Halting on failure while running commands: %s" %
+                       ', '.join(failed), exit_code=fatal_exit_code)
+        return results
+
+    def _capture_output(self, command, shell=False, cwd=None, env=None,
+                        head_lines=None, tail_lines=None):
+        """Helper for get_output_from_command(): run command, reading its
+        stdout and stderr into memory through an OutputPump.
+
+        If head_lines or tail_lines is set, only the first head_lines and
+        last tail_lines lines of stdout are kept.
+
+        Returns a (returncode, stdout, stderr, CommandUsage) tuple.
+        """
+        stdout = []
+        stderr = []
+        bounded = head_lines is not None or tail_lines is not None
+        if bounded:
+            head = []
+            tail = collections.deque(maxlen=tail_lines or 0)
+            skipped = [0]
+
+            def add_stdout(lines):
+                for line in lines:
+                    if len(head) < (head_lines or 0):
+                        head.append(line)
+                        continue
+                    if len(tail) == tail.maxlen:
+                        skipped[0] += 1
+                    tail.append(line)
+
+            def add_stderr(lines):
+                stderr.append('\n'.join(lines) + '\n')
+        else:
+            add_stdout = stdout.append
+            add_stderr = stderr.append
+        p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
+                             cwd=cwd, stderr=subprocess.PIPE, env=env)
+        pump = OutputPump()
+        job = pump.add_process(p, [(p.stdout, add_stdout),
+                                   (p.stderr, add_stderr)],
+                               split_lines=bounded)
+        pump.run()
+        if bounded:
+            if skipped[0]:
+                self.log("Skipped %d lines of output." % skipped[0],
+                         level=DEBUG)
+            stdout = ['\n'.join(head + list(tail))]
+        return (job.returncode, ''.join(stdout), ''.join(stderr),
+                CommandUsage.from_job(command, job))
+
+    @traced('command')
     def get_output_from_command(self, command, cwd=None,
                                 halt_on_failure=False, env=None,
                                 silent=False, log_level=INFO,
                                 tmpfile_base_path='tmpfile',
                                 return_type='output', save_tmpfiles=False,
                                 throw_exception=False, fatal_exit_code=2,
-                                ignore_errors=False, success_codes=None):
+                                ignore_errors=False, success_codes=None,
+                                head_lines=None, tail_lines=None):
         """Similar to run_command, but where run_command is an
         os.system(command) analog, get_output_from_command is a `command`
         analog.
@@ -802,10 +1714,17 @@ class ScriptMixin(object):
         Less error checking by design, though if we figure out how to
         do it without borking the output, great.
 
+        stdout and stderr are read straight into memory, unless
+        return_type != 'output' or save_tmpfiles is set (or we're on
+        Windows), in which case they go through the tmpfile_base_path
+        temporary files.
+
+        head_lines and tail_lines, if set, limit the output we keep to the
+        first head_lines and the last tail_lines lines.
+
         TODO: binary mode? silent is kinda like that.
         TODO: since p.wait() can take a long time, optionally log something
         every N seconds?
-        TODO: optionally only keep the first or last (N) line(s) of output?
         TODO: optionally only return the tmp_stdout_filename?
 
         ignore_errors=True is for the case where a command might produce standard
@@ -832,42 +1751,62 @@ class ScriptMixin(object):
         tmp_stderr_filename = '%s_stderr' % tmpfile_base_path
         if success_codes is None:
             success_codes = [0]
-
-        # TODO probably some more elegant solution than 2 similar passes
-        try:
-            tmp_stdout = open(tmp_stdout_filename, 'w')
-        except IOError:
-            level = ERROR
-            if halt_on_failure:
-                level = FATAL
-            self.log("Can't open %s for writing!" % tmp_stdout_filename +
-                     self.exception(), level=level)
-            return None
-        try:
-            tmp_stderr = open(tmp_stderr_filename, 'w')
-        except IOError:
-            level = ERROR
-            if halt_on_failure:
-                level = FATAL
-            self.log("Can't open %s for writing!" % tmp_stderr_filename +
-                     self.exception(), level=level)
-            return None
         shell = True
         if isinstance(command, list):
             shell = False
-        p = subprocess.Popen(command, shell=shell, stdout=tmp_stdout,
-                             cwd=cwd, stderr=tmp_stderr, env=env)
-        # XXX: changed from self.debug to self.log due to this error:
-        #      TypeError: debug() takes exactly 1 argument (2 given)
-        self.log("Temporary files: %s and %s" % (tmp_stdout_filename, tmp_stderr_filename), level=DEBUG)
-        p.wait()
-        tmp_stdout.close()
-        tmp_stderr.close()
+        use_tmpfiles = return_type != 'output' or save_tmpfiles or \
+            not OutputPump.supported()
+
+        if not use_tmpfiles:
+            returncode, output, errors, usage = self._capture_output(
+                command, shell=shell, cwd=cwd, env=env,
+                head_lines=head_lines, tail_lines=tail_lines)
+        else:
+            # TODO probably some more elegant solution than 2 similar passes
+            try:
+                tmp_stdout = open(tmp_stdout_filename, 'w')
+            except IOError:
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't open %s for writing!" % tmp_stdout_filename +
+                         self.exception(), level=level)
+                return None
+            try:
+                tmp_stderr = open(tmp_stderr_filename, 'w')
+            except IOError:
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't open %s for writing!" % tmp_stderr_filename +
+                         self.exception(), level=level)
+                return None
+            start_time = time.time()
+            p = subprocess.Popen(command, shell=shell, stdout=tmp_stdout,
+                                 cwd=cwd, stderr=tmp_stderr, env=env)
+            # XXX: changed from self.debug to self.log due to this error:
+            #      TypeError: debug() takes exactly 1 argument (2 given)
+            self.log("Temporary files: %s and %s" % (tmp_stdout_filename, tmp_stderr_filename), level=DEBUG)
+            returncode, rusage = wait_with_rusage(p)
+            usage = CommandUsage(command, time.time() - start_time, rusage)
+            tmp_stdout.close()
+            tmp_stderr.close()
+            output = None
+            errors = None
+            if os.path.exists(tmp_stdout_filename) and os.path.getsize(tmp_stdout_filename):
+                output = self.read_from_file(tmp_stdout_filename,
+                                             verbose=False)
+                if head_lines is not None or tail_lines is not None:
+                    lines = output.splitlines()
+                    if len(lines) > (head_lines or 0) + (tail_lines or 0):
+                        lines = lines[:head_lines or 0] + \
+                            lines[len(lines) - (tail_lines or 0):]
+                    output = '\n'.join(lines)
+            if os.path.exists(tmp_stderr_filename) and os.path.getsize(tmp_stderr_filename):
+                errors = self.read_from_file(tmp_stderr_filename,
+                                             verbose=False)
         return_level = DEBUG
-        output = None
-        if os.path.exists(tmp_stdout_filename) and os.path.getsize(tmp_stdout_filename):
-            output = self.read_from_file(tmp_stdout_filename,
-                                         verbose=False)
+        if output:
             if not silent:
                 self.log("Output received:", level=log_level)
                 output_lines = output.rstrip().splitlines()
@@ -877,26 +1816,28 @@ class ScriptMixin(object):
                     line = line.decode("utf-8")
                     self.log(' %s' % line, level=log_level)
                 output = '\n'.join(output_lines)
-        if os.path.exists(tmp_stderr_filename) and os.path.getsize(tmp_stderr_filename):
+        else:
+            output = None
+        if errors:
             if not ignore_errors:
                 return_level = ERROR
             self.log("Errors received:", level=return_level)
-            errors = self.read_from_file(tmp_stderr_filename,
-                                         verbose=False)
             for line in errors.rstrip().splitlines():
                 if not line or line.isspace():
                     continue
                 line = line.decode("utf-8")
                 self.log(' %s' % line, level=return_level)
-        elif p.returncode not in success_codes and not ignore_errors:
+        elif returncode not in success_codes and not ignore_errors:
             return_level = ERROR
         # Clean up.
-        if not save_tmpfiles:
+        if use_tmpfiles and not save_tmpfiles:
             self.rmtree(tmp_stderr_filename, log_level=DEBUG)
             self.rmtree(tmp_stdout_filename, log_level=DEBUG)
-        if p.returncode and throw_exception:
-            raise subprocess.CalledProcessError(p.returncode, command)
-        self.log("Return code: %d" % p.returncode, level=return_level)
+        self.record_command_usage(usage)
+        if returncode and throw_exception:
+            raise subprocess.CalledProcessError(returncode, command)
+        self.log("Return code: %d (%s)" % (returncode, usage),
+                 level=return_level)
         if halt_on_failure and return_level == ERROR:
             self.return_code = fatal_exit_code
             self.fatal("Halting on failure while running %s" % command,
@@ -908,6 +1849,96 @@ class ScriptMixin(object):
         else:
             return output
 
+    def iter_output_from_command(self, command, cwd=None,
+                                 halt_on_failure=False, env=None,
+                                 silent=True, log_level=INFO,
+                                 throw_exception=False, fatal_exit_code=2,
+                                 ignore_errors=False, success_codes=None):
+        """Like get_output_from_command(), but a generator that yields each
+        line of stdout, without its line ending, as it arrives.
+
+        stderr is logged as it arrives, at ERROR level, or DEBUG if
+        ignore_errors is set.  The return code is checked once the output
+        has been consumed.  Since we only log stdout if silent is False,
+        this is a good fit for large outputs.
+
+        On Windows this falls back to get_output_from_command().
+        """
+        if not OutputPump.supported():
+            output = self.get_output_from_command(
+                command, cwd=cwd, halt_on_failure=halt_on_failure, env=env,
+                silent=silent, log_level=log_level,
+                throw_exception=throw_exception,
+                fatal_exit_code=fatal_exit_code, ignore_errors=ignore_errors,
+                success_codes=success_codes)
+            for line in (output or '').splitlines():
+                yield line
+            return
+        if cwd:
+            if not os.path.isdir(cwd):
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't run command %s in non-existent directory %s!" %
+                         (command, cwd), level=level)
+                return
+            self.info("Getting output from command: %s in %s" % (command, cwd))
+        else:
+            self.info("Getting output from command: %s" % command)
+        if isinstance(command, list):
+            self.info("Copy/paste: %s" % subprocess.list2cmdline(command))
+        if success_codes is None:
+            success_codes = [0]
+        error_level = ERROR
+        if ignore_errors:
+            error_level = DEBUG
+        return_level = [DEBUG]
+        pending = []
+
+        def add_stderr(lines):
+            for line in lines:
+                if not line or line.isspace():
+                    continue
+                return_level[0] = error_level
+                self.log(' %s' % line.decode("utf-8"), level=error_level)
+
+        p = subprocess.Popen(command, shell=not isinstance(command, list),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=cwd, env=env)
+        pump = OutputPump()
+        job = pump.add_process(p, [(p.stdout, pending.extend),
+                                   (p.stderr, add_stderr)])
+        try:
+            while True:
+                running = pump.step()
+                for line in pending:
+                    if not silent and line and not line.isspace():
+                        self.log(' %s' % line.decode("utf-8"), level=log_level)
+                    yield line
+                del pending[:]
+                if not running:
+                    break
+        finally:
+            if job.end_time is None:
+                # The caller stopped early (break, or an exception); don't
+                # leave the process running, or its pipes open.
+                job.kill()
+                p.stdout.close()
+                p.stderr.close()
+                p.wait()
+        if job.returncode not in success_codes and not ignore_errors:
+            return_level[0] = ERROR
+        usage = CommandUsage.from_job(command, job)
+        self.record_command_usage(usage)
+        if job.returncode and throw_exception:
+            raise subprocess.CalledProcessError(job.returncode, command)
+        self.log("Return code: %d (%s)" % (job.returncode, usage),
+                 level=return_level[0])
+        if halt_on_failure and return_level[0] == ERROR:
+            self.return_code = fatal_exit_code
+            self.fatal("Halting on failure while running %s" % command,
+                       exit_code=fatal_exit_code)
+
     def _touch_file(self, file_name, times=None, error_level=FATAL):
         """touch a file; If times is None, then the file's access and modified
            times are set to the current time
@@ -923,22 +1954,161 @@ class ScriptMixin(object):
                 self.log(msg, error_level=error_level)
         os.utime(file_name, times)
 
-    def unpack(self, filename, extract_to):
+    def unpack(self, filename, extract_to, extract_dirs=None, error_level=FATAL,
+               processes=None):
         '''
         This method allows us to extract a file regardless of its extension
+
+        Zips are extracted by a pool of `processes` processes (default
+        self.config['extract_processes'], or the number of CPUs); tars,
+        .tar.gz and .tar.bz2 files as they're decompressed.
+
+        Args:
+            filename (str): the archive.
+            extract_to (str): directory to extract it to.
+            extract_dirs (list, optional): unzip-style patterns of the
+                members to extract, e.g. ['bin/*', 'mochitest/*'];
+                everything by default.
+            error_level (str, optional): log level if the archive can't be
+                extracted.  Defaults to FATAL.
+            processes (int, optional): see above.
+
+        Returns:
+            int: 0 on success, -1 on failure.
         '''
-        # XXX: Make sure that filename has a extension of one of our supported file formats
-        m = re.search('\.tar\.(bz2|gz)$', filename)
-        if m:
-            command = self.query_exe('tar', return_type='list')
-            tar_cmd = "jxfv"
-            if m.group(1) == "gz":
-                tar_cmd = "zxfv"
-            command.extend([tar_cmd, filename, "-C", extract_to])
-            self.run_command(command, halt_on_failure=True)
+        if processes is None:
+            processes = self.config.get('extract_processes')
+        self.info("Extracting %s to %s" % (filename, extract_to))
+        try:
+            stats = extract_archive(filename, extract_to, extract_dirs,
+                                    processes=processes)
+        except (ExtractError, IOError, OSError), e:
+            self.log("Can't extract %s: %s" % (filename, str(e)),
+                     level=error_level, exit_code=3)
+            return -1
+        self._log_unpack_stats(filename, stats)
+        return 0
+
+    def _log_unpack_stats(self, filename, stats):
+        self.info("Extracted %d files (%d bytes) from %s in %.2fs (%.1f MB/s)" %
+                  (stats['files'], stats['bytes'], filename, stats['seconds'],
+                   stats['bytes'] / 1024.0 ** 2 / max(stats['seconds'], 0.001)))
+
+    def _download_unpack(self, url, extract_to, extract_dirs=None,
+                         file_name=None):
+        """ Helper for download_unpack(): extract the tar at url as it's
+        downloaded, writing a copy to file_name if given.
+        """
+        f = self._urlopen(url, timeout=30)
+        copy = None
+        hashers = new_hashers(['sha512'])
+        try:
+            if file_name:
+                copy = DigestingWriter(open(file_name, 'wb'), hashers)
+            stream = ReadAheadStream(f, copy=copy)
+            try:
+                stats = extract_archive(url, extract_to, extract_dirs,
+                                        fileobj=stream)
+                # Whatever follows the end of the tar, for the copy.
+                stream.drain()
+            finally:
+                stream.close()
+        finally:
+            f.close()
+            if copy:
+                copy.close()
+        length = f.info().get('content-length')
+        if length and int(length) != stream.bytes_read:
+            raise httplib.IncompleteRead('%d of %s bytes' % (stream.bytes_read, length))
+        if file_name:
+            self.record_file_digests(file_name, hexdigests(hashers))
+            if self._download_validators is None:
+                self._download_validators = {}
+            self._download_validators[file_name] = dict(
+                [(name, f.info().get(name)) for name in VALIDATORS
+                 if f.info().get(name)])
+        return stats
+
+    def download_unpack(self, url, extract_to, extract_dirs=None,
+                        file_name=None, parent_dir=None, keep_file=False,
+                        error_level=FATAL, retry_config=None):
+        """ Download the tar, .tar.gz or .tar.bz2 file at url and extract it
+        to extract_to as it arrives, so the download and the decompression
+        overlap.  Other archives are downloaded, then unpack()ed.
+
+        If keep_file is set, or there's a download cache (see
+        download_file()), a copy is written to file_name in parent_dir,
+        named as download_file() would, along the way; it's added to the
+        cache and removed again unless keep_file is set.  Cached files are
+        unpacked from the cache, if the server says they're unchanged.
+
+        Returns:
+            int: 0 on success, -1 on failure.
+        """
+        if archive_type(url, sniff=False) != 'tar':
+            downloaded = self.download_file(url, file_name=file_name,
+                                            parent_dir=parent_dir,
+                                            error_level=error_level,
+                                            retry_config=retry_config)
+            if not downloaded:
+                return -1
+            return self.unpack(downloaded, extract_to,
+                               extract_dirs=extract_dirs,
+                               error_level=error_level)
+        cache = None
+        if not self.config.get('bypass_download_cache'):
+            cache = self.query_download_cache()
+        if keep_file or cache:
+            file_name = file_name or self.get_filename_from_url(url)
+            if parent_dir:
+                self.mkdir_p(parent_dir)
+                file_name = os.path.join(parent_dir, file_name)
         else:
-            # XXX implement
-            pass
+            file_name = None
+        if cache:
+            with cache.lock(url):
+                path = cache.lookup(
+                    url, revalidate=lambda v: self._is_unchanged(url, v))
+                if path:
+                    self.info("Using cached %s" % url)
+                    if keep_file:
+                        cache.fetch(path, file_name)
+                    return self.unpack(path, extract_to,
+                                       extract_dirs=extract_dirs,
+                                       error_level=error_level)
+        self.mkdir_p(extract_to)
+        self.info("Downloading and extracting %s to %s" % (url, extract_to))
+        retry_args = dict(
+            failure_status=None,
+            retry_exceptions=(urllib2.HTTPError, urllib2.URLError,
+                              httplib.HTTPException, socket.timeout,
+                              socket.error, tarfile.TarError, EOFError,
+                              ExtractError),
+            error_message="Can't download and extract %s to %s!" % (url, extract_to),
+            error_level=error_level,
+        )
+        if retry_config:
+            retry_args.update(retry_config)
+        stats = self.retry(self._download_unpack,
+                           args=(url, extract_to, extract_dirs, file_name),
+                           **retry_args)
+        if stats is None:
+            return -1
+        self._log_unpack_stats(url, stats)
+        validators = None
+        if self._download_validators and file_name:
+            validators = self._download_validators.pop(file_name, None)
+        if cache:
+            try:
+                cache.store(url, file_name,
+                            sha512=self.query_recorded_digest(file_name),
+                            verified=True, validators=validators)
+            except (IOError, OSError), e:
+                self.warning("Can't add %s to the download cache: %s" %
+                             (file_name, str(e)))
+            if not keep_file:
+                os.remove(file_name)
+        return 0
 
 
 def PreScriptRun(func):
@@ -1025,6 +2195,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
     def __init__(self, config_options=None, ConfigClass=BaseConfig,
                  default_log_level="info", **kwargs):
         self._return_code = 0
+        self._return_code_lock = threading.RLock()
         super(BaseScript, self).__init__()
 
         # Collect decorated methods. We simply iterate over the attributes of
@@ -1069,7 +2240,10 @@ class BaseScript(ScriptMixin, LogMixin, object):
         self.config = rw_config.get_read_only_config()
         self.actions = tuple(rw_config.actions)
         self.all_actions = tuple(rw_config.all_actions)
+        self.action_dependencies = rw_config.action_dependencies
         self.env = None
+        # Before anything that might run a command, e.g. _pre_config_lock().
+        self._current_action = threading.local()
         self.new_log_obj(default_log_level=default_log_level)
         self.script_obj = self
 
@@ -1086,61 +2260,50 @@ class BaseScript(ScriptMixin, LogMixin, object):
         # alter self.config.
         self._pre_config_lock(rw_config)
         self._config_lock()
+        self._profiles = {}
+        self._register_profiling_listeners()
+        if self.config.get('trace'):
+            self.tracer = Tracer()
 
         self.info("Run as %s" % rw_config.command_line)
         if self.config.get("dump_config_hierarchy"):
             # we only wish to dump and display what self.config is made up of,
             # against the current script + args, without actually running any
             # actions
-            self._dump_config_hierarchy(rw_config.all_cfg_files_and_dicts)
+            self._dump_config_hierarchy(rw_config.all_cfg_files_and_dicts,
+                                        rw_config.config_origins)
         if self.config.get("dump_config"):
             self.dump_config(exit_on_finish=True)
 
-    def _dump_config_hierarchy(self, cfg_files):
+    def _dump_config_hierarchy(self, cfg_files, origins=None):
         """ interpret each config file used.
 
-        This will show which keys/values are being added or overwritten by
-        other config files depending on their hierarchy (when they were added).
+        This will show which keys/values each config file contributes to
+        self.config, going by origins (BaseConfig.config_origins), which
+        maps each key to the config file it was last set by.
         """
-        # go through each config_file. We will start with the lowest and
-        # print its keys/values that are being used in self.config. If any
-        # keys/values are present in a config file with a higher precedence,
-        # ignore those.
         dirs = self.query_abs_dirs()
-        cfg_files_dump_config = {}  # we will dump this to file
-        # keep track of keys that did not come from a config file
-        keys_not_from_file = set(self.config.keys())
         if not cfg_files:
             cfg_files = []
+        if origins is None:
+            origins = {}
+            for target_file, target_dict in cfg_files:
+                origins.update(dict.fromkeys(target_dict, target_file))
+        cfg_files_dump_config = dict(
+            (target_file, {}) for target_file, target_dict in cfg_files
+        )  # we will dump this to file
+        # keep track of keys that did not come from a config file
+        not_from_file_dict = {}
+        for key in self.config:
+            unique_dict = cfg_files_dump_config.get(origins.get(key),
+                                                    not_from_file_dict)
+            unique_dict[key] = self.config[key]
         self.info("Total config files: %d" % (len(cfg_files)))
         if len(cfg_files):
             self.info("cfg files used from lowest precedence to highest:")
         for i, (target_file, target_dict) in enumerate(cfg_files):
-            unique_keys = set(target_dict.keys())
-            unique_dict = {}
-            # iterate through the target_dicts remaining 'higher' cfg_files
-            remaining_cfgs = cfg_files[slice(i + 1, len(cfg_files))]
-            # where higher == more precedent
-            for ii, (higher_file, higher_dict) in enumerate(remaining_cfgs):
-                # now only keep keys/values that are not overwritten by a
-                # higher config
-                unique_keys = unique_keys.difference(set(higher_dict.keys()))
-            # unique_dict we know now has only keys/values that are unique to
-            # this config file.
-            unique_dict = dict(
-                (key, target_dict.get(key)) for key in unique_keys
-            )
-            cfg_files_dump_config[target_file] = unique_dict
             self.action_message("Config File %d: %s" % (i + 1, target_file))
-            self.info(pprint.pformat(unique_dict))
-            # let's also find out which keys/values from self.config are not
-            # from each target config file dict
-            keys_not_from_file = keys_not_from_file.difference(
-                set(target_dict.keys())
-            )
-        not_from_file_dict = dict(
-            (key, self.config.get(key)) for key in keys_not_from_file
-        )
+            self.info(pprint.pformat(cfg_files_dump_config[target_file]))
         cfg_files_dump_config["not_from_cfg_file"] = not_from_file_dict
         self.action_message("Not from any config file (default_config, "
                             "cmd line options, etc)")
@@ -1164,6 +2327,63 @@ class BaseScript(ScriptMixin, LogMixin, object):
         """
         self.config.lock()
 
+    def _register_profiling_listeners(self):
+        """Profile the actions in self.config['profile_actions'] ('all' for
+        every action), or, if it includes 'run', the whole run as one.
+
+        The listeners are only registered when asked for, and go around all
+        the others, so they're profiled too.
+        """
+        targets = self.config.get('profile_actions')
+        if not targets:
+            return
+        if 'run' in targets:
+            # cProfile can only profile one thing per thread at a time.
+            self._listeners['pre_run'].insert(0, '_start_run_profile')
+            self._listeners['post_run'].append('_stop_run_profile')
+        else:
+            self._listeners['pre_action'].insert(
+                0, ('_start_action_profile', None))
+            self._listeners['post_action'].append(
+                ('_stop_action_profile', None))
+
+    def _start_run_profile(self):
+        self._start_profile('run')
+
+    def _stop_run_profile(self):
+        self._stop_profile('run')
+
+    def _start_action_profile(self, action):
+        targets = self.config['profile_actions']
+        if 'all' in targets or action in targets:
+            self._start_profile(action)
+
+    def _stop_action_profile(self, action, success=None):
+        self._stop_profile(action)
+
+    def _start_profile(self, name):
+        profile = Profile()
+        self._profiles[name] = profile
+        profile.start()
+
+    def _stop_profile(self, name):
+        """Stop profiling name, write its pstats and collapsed stacks to the
+        upload dir, and add its hottest functions to the summary.
+        """
+        profile = self._profiles.pop(name, None)
+        if not profile:
+            return
+        profile.stop()
+        upload_dir = self.query_abs_dirs()['abs_upload_dir']
+        self.mkdir_p(upload_dir)
+        paths = profile.dump(os.path.join(upload_dir, 'profile-%s' % name))
+        self.info("Wrote profile of %s to %s" % (name, ', '.join(paths)))
+        self.add_summary("Profile of %s (%.1fs); hottest functions:" %
+                         (name, profile.end_time - profile.start_time))
+        for line in profile.top_functions(
+                self.config.get('profile_top_functions', TOP_FUNCTIONS)):
+            self.add_summary(line)
+
     def _possibly_run_method(self, method_name, error_if_missing=False):
         """This is here for run().
         """
@@ -1172,10 +2392,26 @@ class BaseScript(ScriptMixin, LogMixin, object):
         elif error_if_missing:
             self.error("No such method %s!" % method_name)
 
+    def write_trace(self):
+        """Write the spans recorded with --trace to TRACE_FILE in the log
+        dir, for chrome://tracing and the like.
+        """
+        if not self.tracer:
+            return
+        path = os.path.join(self.query_abs_dirs()['abs_log_dir'], TRACE_FILE)
+        try:
+            self.tracer.write(path)
+            self.info("Wrote %d trace events to %s" %
+                      (len(self.tracer.events), path))
+        except (IOError, OSError), e:
+            self.warning("Can't write trace %s: %s" % (path, str(e)))
+
     def copy_logs_to_upload_dir(self):
         """Copies logs to the upload directory"""
         self.info("Copying logs to upload dir...")
         log_files = ['localconfig.json']
+        if self.tracer:
+            log_files.append(TRACE_FILE)
         for log_name in self.log_obj.log_files.keys():
             log_files.append(self.log_obj.log_files[log_name])
         dirs = self.query_abs_dirs()
@@ -1190,7 +2426,18 @@ class BaseScript(ScriptMixin, LogMixin, object):
         if action not in self.actions:
             self.action_message("Skipping %s step." % action)
             return
+        with self.trace_span(action, 'action'):
+            self._current_action.name = action
+            try:
+                self._run_action(action)
+            finally:
+                self._current_action.name = None
+
+    def query_current_action(self):
+        current_action = getattr(self, '_current_action', None)
+        return getattr(current_action, 'name', None)
 
+    def _run_action(self, action):
         method_name = action.replace("-", "_")
         self.action_message("Running %s step." % action)
 
@@ -1245,9 +2492,35 @@ class BaseScript(ScriptMixin, LogMixin, object):
                     self.error("Exception during post-action for %s: %s" % (
                         action, traceback.format_exc()))
 
+            if self.log_obj:
+                self.log_obj.flush()
             if not post_success:
                 self.fatal("Aborting due to failure in post-action listener.")
 
+    def query_action_dependencies(self):
+        """Return a dict of action -> actions that need to finish first.
+
+        Actions listed in self.action_dependencies only wait for the
+        actions listed there.  Every other action waits for all the actions
+        before it in self.all_actions, as in a sequential run.
+        """
+        dependencies = {}
+        for i, action in enumerate(self.all_actions):
+            if action in self.action_dependencies:
+                dependencies[action] = list(self.action_dependencies[action])
+            else:
+                dependencies[action] = list(self.all_actions[:i])
+        return dependencies
+
+    def run_actions_in_parallel(self, max_workers):
+        """Run self.all_actions via run_action(), starting each action as
+        soon as the actions it depends on have finished.
+        """
+        self.info("Running actions on up to %d threads." % max_workers)
+        run_with_dependencies(self.all_actions,
+                              self.query_action_dependencies(),
+                              self.run_action, max_workers=max_workers)
+
     def run(self):
         """Default run method.
         This is the "do everything" method, based on actions and all_actions.
@@ -1262,6 +2535,10 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
         Postflight is quick testing for success after an action.
 
+        If the script declares action_dependencies and
+        self.config['parallel_actions'] is set, independent actions are run
+        concurrently; see run_actions_in_parallel().  Pre- and post-action
+        listeners are then called from the thread running the action.
         """
         for fn in self._listeners['pre_run']:
             try:
@@ -1284,11 +2561,24 @@ class BaseScript(ScriptMixin, LogMixin, object):
 
         self.dump_config()
         try:
-            for action in self.all_actions:
-                self.run_action(action)
+            max_workers = self.config.get('parallel_actions')
+            if max_workers and max_workers > 1 and self.action_dependencies:
+                self.run_actions_in_parallel(max_workers)
+            else:
+                for action in self.all_actions:
+                    self.run_action(action)
         except Exception:
             self.fatal("Uncaught exception: %s" % traceback.format_exc())
         finally:
+            cache = self.download_cache
+            if cache and (cache.hits or cache.misses):
+                self.info("Download cache: %d hits (%d bytes), %d misses" %
+                          (cache.hits, cache.hit_bytes, cache.misses))
+            try:
+                self.summarize_command_usage()
+            except Exception:
+                self.error("Exception summarizing command usage: %s" %
+                           traceback.format_exc())
             post_success = True
             for fn in self._listeners['post_run']:
                 try:
@@ -1300,6 +2590,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
                     self.error("Exception during post-run listener: %s" %
                                traceback.format_exc())
 
+            self.write_trace()
             if not post_success:
                 self.fatal("Aborting due to failure in post-run listener.")
         if self.config.get("copy_logs_post_run", True):
@@ -1319,7 +2610,8 @@ class BaseScript(ScriptMixin, LogMixin, object):
         Delete the working directory
         """
         dirs = self.query_abs_dirs()
-        self.rmtree(dirs['abs_work_dir'], error_level=FATAL)
+        self.rmtree(dirs['abs_work_dir'], error_level=FATAL,
+                    defer=self.config.get('deferred_delete'))
 
     def query_abs_dirs(self):
         """We want to be able to determine where all the important things
@@ -1374,6 +2666,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
             "log_format": '%(asctime)s %(levelname)8s - %(message)s',
             "log_to_console": True,
             "append_to_log": False,
+            "async_log": False,
         }
         log_type = self.config.get("log_type", "multi")
         for key in log_config.keys():
@@ -1412,13 +2705,39 @@ class BaseScript(ScriptMixin, LogMixin, object):
         # Summaries need a lot more love.
         self.log(message, level=level)
 
+    def summarize_command_usage(self, count=None):
+        """Add the `count` (default self.config['command_usage_top'], or 5)
+        most expensive commands of each action to the summary, by CPU time
+        where that's known, or wall time.
+        """
+        if count is None:
+            count = self.config.get('command_usage_top', 5)
+        by_action = {}
+        for action, usage in self.command_usages or []:
+            by_action.setdefault(action, []).append(usage)
+
+        def cost(usage):
+            if usage.cpu_time() is None:
+                return usage.wall_time
+            return usage.cpu_time()
+
+        actions = [a for a in self.all_actions if a in by_action]
+        actions.extend([a for a in by_action if a not in actions])
+        for action in actions:
+            usages = sorted(by_action[action], key=cost, reverse=True)
+            self.add_summary("Most expensive of %d commands in %s:" %
+                             (len(usages), action or "no action"))
+            for usage in usages[:count]:
+                self.add_summary("  %s: %s" % (describe(usage.command), usage))
+
     def add_failure(self, key, message="%(key)s failed.", level=ERROR,
                     increment_return_code=True):
-        if key not in self.failures:
-            self.failures.append(key)
-            self.add_summary(message % {'key': key}, level=level)
-            if increment_return_code:
-                self.return_code += 1
+        with self._return_code_lock:
+            if key not in self.failures:
+                self.failures.append(key)
+                self.add_summary(message % {'key': key}, level=level)
+                if increment_return_code:
+                    self.return_code += 1
 
     def query_failure(self, key):
         return key in self.failures
@@ -1503,14 +2822,7 @@ class BaseScript(ScriptMixin, LogMixin, object):
             return None
 
     def file_sha512sum(self, file_path):
-        bs = 65536
-        hasher = hashlib.sha512()
-        with open(file_path, 'rb') as fh:
-            buf = fh.read(bs)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = fh.read(bs)
-        return hasher.hexdigest()
+        return self.query_file_digest(file_path, 'sha512')
 
     @property
     def return_code(self):
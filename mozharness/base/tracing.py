@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""A timeline of what a script spent its time on, no mixins here!
+
+A Tracer records spans -- an action, a command, a download -- from any
+thread, and writes them out in the Chrome trace event format, which
+chrome://tracing, Perfetto and speedscope can all show:
+
+    tracer = Tracer()
+    with tracer.span('make -f client.mk', 'command', cwd='/builds/src'):
+        ...
+    tracer.write('logs/trace.json')
+
+ScriptMixin methods decorated with traced() are spans of their own
+whenever the script has a tracer; BaseScript has one with --trace.
+"""
+
+from contextlib import contextmanager
+import functools
+import os
+import thread
+import threading
+import time
+
+try:
+    import simplejson as json
+    assert json
+except ImportError:
+    import json
+
+# What BaseScript calls the trace it writes to the log dir.
+TRACE_FILE = 'trace.json'
+# Longest span name; commands can be very long.
+MAX_NAME_LENGTH = 200
+
+
+def _text(value):
+    """value as unicode, whatever it is; commands from json configs have
+    unicode arguments, and others can have utf-8 encoded ones."""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    try:
+        return unicode(value)
+    except UnicodeError:
+        return unicode(repr(value))
+
+
+def describe(value):
+    """Return a short span name for value, e.g. a command or url."""
+    if isinstance(value, (list, tuple)):
+        value = u' '.join([_text(v) for v in value])
+    value = _text(value)
+    if len(value) > MAX_NAME_LENGTH:
+        value = value[:MAX_NAME_LENGTH - 3] + '...'
+    return value
+
+
+# Tracer {{{1
+class Tracer(object):
+    """Collect spans, as Chrome "complete" trace events."""
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self._thread_names = {}
+
+    def _now(self):
+        # Microseconds, as trace events count them.
+        return time.time() * 1000000
+
+    def add_span(self, name, category, start, end, args=None):
+        """Record a span from start to end, in microseconds since the
+        epoch."""
+        tid = thread.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': end - start,
+            'pid': self.pid,
+            'tid': tid,
+        }
+        if args:
+            event['args'] = args
+        # list.append() is atomic, so any thread can add spans.
+        self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Record the with block as a span.  The block can add to args
+        through the dict it gets."""
+        start = self._now()
+        try:
+            yield args
+        finally:
+            self.add_span(name, category, start, self._now(), args)
+
+    def write(self, path):
+        events = []
+        for tid, name in self._thread_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                           'tid': tid, 'args': {'name': name}})
+        events.extend(sorted(self.events, key=lambda e: e['ts']))
+        fh = open(path, 'w')
+        try:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
+        finally:
+            fh.close()
+
+
+def traced(category):
+    """Decorator making each call of a ScriptMixin method a span of
+    category, named after its first argument (e.g. the command or url).
+
+    An int return value is kept as the span's result.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            tracer = self.query_tracer()
+            if tracer is None:
+                return func(self, *args, **kwargs)
+            if args:
+                name = describe(args[0])
+            elif kwargs.get('command') or kwargs.get('url'):
+                name = describe(kwargs.get('command') or kwargs.get('url'))
+            else:
+                name = func.__name__
+            with tracer.span(name, category, method=func.__name__) as span_args:
+                result = func(self, *args, **kwargs)
+                if isinstance(result, int):
+                    span_args['result'] = result
+                return result
+        return wrapper
+    return decorator
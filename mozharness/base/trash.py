@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""Deferred deletion, no mixins here!
+
+Deleting a big tree can take minutes; renaming it out of the way takes no
+time.  move_to_trash() renames a path into the trash directory of its
+volume (see query_trash_dir()), and start_background_delete() starts a
+low priority process that empties it, which lives on after we exit:
+
+    trash_dir = query_trash_dir(path)
+    move_to_trash(path, trash_dir)
+    start_background_delete(trash_dir)
+
+Anything it doesn't get to is left for the next one, or for
+external_tools/purge_builds.py --trash.  That empties the trash itself when
+it's short of space and nothing else is emptying it, and otherwise counts
+what's still waiting to be deleted in the background as free space.
+
+    python -m mozharness.base.trash TRASH_DIR [TRASH_DIR ...]
+
+empties trash directories in the foreground.
+"""
+
+import errno
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+TRASH_DIR_NAME = '.trash'
+LOCK_NAME = '.lock'
+
+
+def query_trash_dir(path, top=None):
+    """Return the trash directory for path: TRASH_DIR_NAME in the topmost
+    directory we can write to above it on the same volume, but no higher
+    than top (e.g. the work dir), so paths can be moved there with a
+    rename, and trash is shared between the build dirs under top.
+
+    Without top, or if path isn't under it, that's the directory path is
+    in.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    if top is None:
+        return os.path.join(parent, TRASH_DIR_NAME)
+    top = os.path.abspath(top)
+    device = os.stat(parent).st_dev
+    while parent.startswith(top.rstrip(os.sep) + os.sep):
+        up = os.path.dirname(parent)
+        if not os.access(up, os.W_OK):
+            break
+        try:
+            if os.stat(up).st_dev != device:
+                break
+        except OSError:
+            break
+        parent = up
+    return os.path.join(parent, TRASH_DIR_NAME)
+
+
+def move_to_trash(path, trash_dir=None):
+    """Rename path into trash_dir (default query_trash_dir(path)).
+
+    Returns the path it was moved to.  Raises OSError if it can't be
+    renamed there, e.g. because it's on another volume.
+    """
+    if trash_dir is None:
+        trash_dir = query_trash_dir(path)
+    if not os.path.isdir(trash_dir):
+        try:
+            os.makedirs(trash_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    # Each gets its own directory, so any number of the same name can wait.
+    holder = tempfile.mkdtemp(dir=trash_dir,
+                              prefix=os.path.basename(path.rstrip(os.sep)) + '.')
+    target = os.path.join(holder, os.path.basename(path.rstrip(os.sep)))
+    try:
+        os.rename(path, target)
+    except OSError:
+        os.rmdir(holder)
+        raise
+    return target
+
+
+def _entries(trash_dir):
+    try:
+        names = os.listdir(trash_dir)
+    except OSError:
+        return []
+    return [os.path.join(trash_dir, name) for name in sorted(names)
+            if name != LOCK_NAME]
+
+
+def pending_bytes(trash_dir):
+    """Return how much disk space emptying trash_dir will free."""
+    total = 0
+    for entry in _entries(trash_dir):
+        for root, dirs, files in os.walk(entry):
+            for name in dirs + files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:
+                    # Being deleted as we look.
+                    continue
+                total += getattr(st, 'st_blocks', st.st_size / 512) * 512
+    return total
+
+
+def _remove_readonly(func, path, exc_info):
+    """shutil.rmtree() onerror: make path writable and try again; it's
+    fine for it to be gone already (someone else is emptying the trash)."""
+    if isinstance(exc_info[1], OSError) and exc_info[1].errno == errno.ENOENT:
+        return
+    try:
+        os.chmod(os.path.dirname(path), stat.S_IRWXU)
+        os.chmod(path, stat.S_IRWXU)
+        func(path)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _try_lock(fd):
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except IOError:
+        return False
+
+
+def empty_trash(trash_dir):
+    """Delete everything in trash_dir, including anything moved there
+    while we're at it.  Returns False without doing anything if something
+    else is already emptying it.
+    """
+    if not os.path.isdir(trash_dir):
+        return True
+    fd = os.open(os.path.join(trash_dir, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0666)
+    try:
+        if not _try_lock(fd):
+            return False
+        while True:
+            entries = _entries(trash_dir)
+            if not entries:
+                return True
+            for entry in entries:
+                shutil.rmtree(entry, onerror=_remove_readonly)
+    finally:
+        # Closing the file releases the lock.
+        os.close(fd)
+
+
+def start_background_delete(trash_dir):
+    """Start a detached, low CPU and I/O priority process emptying
+    trash_dir, and return its subprocess.Popen object.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in [env.get('PYTHONPATH')] if p])
+    command = [sys.executable, '-m', 'mozharness.base.trash', trash_dir]
+    kwargs = {}
+    if os.name == 'nt':
+        # IDLE_PRIORITY_CLASS | DETACHED_PROCESS
+        kwargs['creationflags'] = 0x40 | 0x8
+    else:
+        for prefix in (['nice', '-n', '19'], ['ionice', '-c', '3']):
+            if any([os.access(os.path.join(d, prefix[0]), os.X_OK)
+                    for d in env.get('PATH', '').split(os.pathsep)]):
+                command = prefix + command
+        # Its own session, so it outlives us and our process group.
+        kwargs['preexec_fn'] = os.setsid
+    devnull = open(os.devnull, 'r+')
+    try:
+        return subprocess.Popen(command, env=env, stdin=devnull, stdout=devnull,
+                                stderr=devnull, close_fds=os.name != 'nt',
+                                **kwargs)
+    finally:
+        devnull.close()
+
+
+if __name__ == '__main__':
+    for trash_dir in sys.argv[1:]:
+        # Wait our turn rather than leave things behind.
+        while not empty_trash(trash_dir):
+            time.sleep(5)
@@ -80,12 +80,14 @@ class VCSMixin(object):
             vcs_config=kwargs,
             script_obj=self,
         )
-        return self.retry(
-            self._get_revision,
-            error_level=error_level,
-            error_message="Automation Error: Can't checkout %s!" % kwargs['repo'],
-            args=(vcs_obj, kwargs['dest']),
-        )
+        with self.trace_span('checkout %s' % kwargs['repo'], 'vcs',
+                             dest=kwargs['dest'], vcs=vcs):
+            return self.retry(
+                self._get_revision,
+                error_level=error_level,
+                error_message="Automation Error: Can't checkout %s!" % kwargs['repo'],
+                args=(vcs_obj, kwargs['dest']),
+            )
 
     def vcs_checkout_repos(self, repo_list, parent_dir=None,
                            tag_override=None, **kwargs):
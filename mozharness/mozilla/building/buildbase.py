@@ -1466,13 +1466,13 @@ or run without that action (ie: --no-{action})"
             self.error("Can't determine filepath with cmd: %s" % (str(cmd),))
             return
 
-        cmd = [
-            self.query_exe('openssl'), 'dgst',
-            '-%s' % (c.get("hash_type", "sha512"),), file_path
-        ]
-        hash_prop = self.get_output_from_command(cmd, dirs['abs_work_dir'])
-        if not hash_prop:
-            self.log("undetermined hash_prop with cmd: %s" % (str(cmd),),
+        file_path = os.path.join(dirs['abs_work_dir'], file_path)
+        hash_type = c.get("hash_type", "sha512")
+        try:
+            # Free if it was recorded or cached since the file last changed.
+            hash_prop = self.query_file_digest(file_path, hash_type)
+        except (IOError, OSError, ValueError), e:
+            self.log("undetermined %s of %s: %s" % (hash_type, file_path, str(e)),
                      level=error_level)
             self.log(error_msg, level=error_level)
             return
@@ -1483,7 +1483,7 @@ or run without that action (ie: --no-{action})"
                                    os.path.getsize(file_path),
                                    write_to_file=True)
         self.set_buildbot_property(prop_type + 'Hash',
-                                   hash_prop.strip().split(' ', 2)[1],
+                                   hash_prop,
                                    write_to_file=True)
 
     def _query_previous_buildid(self):
@@ -252,22 +252,13 @@ class GaiaMixin(object):
         if os.access(xulrunner_bin, os.F_OK):
             return
 
-        filename = self.download_file(xre_url, parent_dir=parent_dir)
-        m = re.search('\.tar\.(bz2|gz)$', filename)
-        if m:
+        if re.search('\.tar\.(bz2|gz)$', xre_url):
             # a xulrunner archive, which has a top-level 'xulrunner-sdk' dir
-            command = self.query_exe('tar', return_type='list')
-            tar_cmd = "jxf"
-            if m.group(1) == "gz":
-                tar_cmd = "zxf"
-            command.extend([tar_cmd, filename])
-            self.run_command(command,
-                             cwd=parent_dir,
-                             error_list=TarErrorList,
-                             halt_on_failure=True,
-                             fatal_exit_code=3)
+            self.download_unpack(xre_url, parent_dir, parent_dir=parent_dir,
+                                 keep_file=True)
         else:
             # a tooltool xre.zip
+            filename = self.download_file(xre_url, parent_dir=parent_dir)
             command = self.query_exe('unzip', return_type='list')
             command.extend(['-q', '-o', filename])
             # Gaia assumes that xpcshell is in a 'xulrunner-sdk' dir, but
@@ -214,14 +214,11 @@ class MultiLocaleBuild(LocalesMixin, MercurialScript):
         if not os.path.isdir(dirs['abs_objdir']):
             self.warning("%s doesn't exist! Skipping..." % dirs['abs_objdir'])
             return
-        rsync = self.query_exe('rsync')
         backup_dir = '%s-bak' % dirs['abs_objdir']
-        self.rmtree(backup_dir)
-        self.mkdir_p(backup_dir)
-        self.run_command([rsync, '-a', '--delete', '--partial',
-                          '%s/' % dirs['abs_objdir'],
-                          '%s/' % backup_dir],
-                         error_list=SSHErrorList)
+        # Copy-on-write clones where the filesystem allows, since the
+        # objdir keeps being written to.
+        self.copytree(dirs['abs_objdir'], backup_dir, overwrite='clobber',
+                      link='reflink', symlinks=True)
 
     def restore_objdir(self):
         dirs = self.query_abs_dirs()
@@ -17,6 +17,7 @@ external_tools_path = os.path.join(
 )
 
 from mozharness.base.log import ERROR
+from mozharness.base.trash import start_background_delete
 
 
 # PurgeMixin {{{1
@@ -58,6 +59,8 @@ class PurgeMixin(object):
 
         if max_age:
             cmd.extend(['--max-age', str(max_age)])
+        if c.get('deferred_delete'):
+            cmd.extend(['--trash', self.query_trash_dir(dirs['base_work_dir'])])
 
         for s in skip:
             cmd.extend(['--not', s])
@@ -105,6 +108,11 @@ class PurgeMixin(object):
         if periodic_clobber:
             cmd.extend(['-t', str(periodic_clobber)])
 
+        trash_dir = None
+        if c.get('deferred_delete'):
+            trash_dir = self.query_trash_dir(dirs['base_work_dir'])
+            cmd.extend(['--trash', trash_dir])
+
         cmd.extend([clobberer_url, branch, buildername, builddir, slave, master])
         error_list = [{
             'substr': 'Error contacting server', 'level': ERROR,
@@ -116,6 +124,12 @@ class PurgeMixin(object):
                          'error_list':error_list})
         if retval != 0:
             self.fatal("failed to clobber build", exit_code=2)
+        if trash_dir and os.path.isdir(trash_dir):
+            self.info("Deleting %s in the background." % trash_dir)
+            try:
+                start_background_delete(trash_dir)
+            except OSError, e:
+                self.warning("Can't start deleting %s: %s" % (trash_dir, str(e)))
 
     def clobber(self, always_clobber_dirs=None):
         """ Mozilla clobberer-type clobber.
@@ -141,7 +155,7 @@ class PurgeMixin(object):
                 if always_clobber_dirs is None:
                     always_clobber_dirs = []
                 for path in always_clobber_dirs:
-                    self.rmtree(path)
+                    self.rmtree(path, defer=c.get('deferred_delete'))
             # run purge_builds / check clobberer
             self.purge_builds()
         else:
@@ -170,10 +170,12 @@ class GaiaTest(TestingMixin, MercurialScript, TransferMixin, GaiaMixin, BlobUplo
             # all. To do this we must pass a special configuraion
             proxxy_conf = {'proxxy': self.config.get('proxxy', {})}
             proxxy = Proxxy(proxxy_conf, self.log_obj)
+            proxxy.download_cache = self.query_download_cache()
             self.proxxy = proxxy
         return self.proxxy
 
-    def _retry_download_file(self, url, file_name, error_level=FATAL, retry_config=None):
+    def _retry_download_file(self, url, file_name, error_level=FATAL, retry_config=None,
+                             **kwargs):
         if self.config.get("bypass_download_cache"):
             n = 0
             # ignore retry_config in this case
@@ -185,7 +187,7 @@ class GaiaTest(TestingMixin, MercurialScript, TransferMixin, GaiaMixin, BlobUplo
                 try:
                     _url = "%s?rand=%s" % (url, time.strftime("%Y%m%d%H%M%S"))
                     self.info("Trying %s..." % _url)
-                    status = self._download_file(_url, file_name)
+                    status = self._download_file(_url, file_name, **kwargs)
                     return status
                 except Exception:
                     if n >= max_attempts:
@@ -197,6 +199,7 @@ class GaiaTest(TestingMixin, MercurialScript, TransferMixin, GaiaMixin, BlobUplo
         else:
             return super(GaiaTest, self)._retry_download_file(
                 url, file_name, error_level, retry_config=retry_config,
+                **kwargs
             )
 
     def run_tests(self):
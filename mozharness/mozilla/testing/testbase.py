@@ -6,16 +6,21 @@
 # ***** END LICENSE BLOCK *****
 
 import copy
+import httplib
 import os
 import platform
 import pprint
 import re
+import socket
 import urllib2
 import json
+import zipfile
 
 from mozharness.base.config import ReadOnlyDict, parse_config_file
 from mozharness.base.errors import BaseErrorList
 from mozharness.base.log import FATAL, WARNING
+from mozharness.base.remotezip import HTTPRangeFile, RangeNotSupported, \
+    extract_zip_members
 from mozharness.base.python import (
     ResourceMonitoringMixin,
     VirtualenvMixin,
@@ -82,6 +87,13 @@ testing_config_options = [
      "choices": ['ondemand', 'true'],
      "help": "Download and extract crash reporter symbols.",
       }],
+    [["--remote-unzip"],
+     {"action": "store_true",
+     "dest": "remote_unzip",
+     "default": False,
+     "help": "When only some directories of a test zip are needed, fetch just "
+             "those members with HTTP Range requests, if the server supports them.",
+      }],
 ] + copy.deepcopy(virtualenv_config_options)
 
 
@@ -111,6 +123,8 @@ class TestingMixin(VirtualenvMixin, BuildbotMixin, ResourceMonitoringMixin, Tool
         """manages the proxxy"""
         if not self.proxxy:
             self.proxxy = Proxxy(self.config, self.log_obj)
+            # proxxy only gets the 'proxxy' part of our config.
+            self.proxxy.download_cache = self.query_download_cache()
         return self.proxxy
 
     def download_proxied_file(self, url, file_name=None, parent_dir=None,
@@ -230,7 +244,10 @@ class TestingMixin(VirtualenvMixin, BuildbotMixin, ResourceMonitoringMixin, Tool
         '''
         # Code based on http://code.activestate.com/recipes/305288-http-basic-authentication
         def _urlopen_basic_auth(url, **kwargs):
-            self.info("We want to download this file %s" % url)
+            uri = url
+            if isinstance(url, urllib2.Request):
+                uri = url.get_full_url()
+            self.info("We want to download this file %s" % uri)
             if not hasattr(self, "https_username"):
                 self.info("NOTICE: Files downloaded from outside of "
                           "Release Engineering network require LDAP "
@@ -240,7 +257,7 @@ class TestingMixin(VirtualenvMixin, BuildbotMixin, ResourceMonitoringMixin, Tool
             # This creates a password manager
             passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
             # Because we have put None at the start it will use this username/password combination from here on
-            passman.add_password(None, url, self.https_username, self.https_password)
+            passman.add_password(None, uri, self.https_username, self.https_password)
             authhandler = urllib2.HTTPBasicAuthHandler(passman)
 
             return urllib2.build_opener(authhandler).open(url, **kwargs)
@@ -405,38 +422,67 @@ You can set this by:
                 self._download_unzip(url, target_dir,
                                      target_unzip_dirs=unzip_dirs)
 
+    def _remote_unzip(self, url, parent_dir, target_unzip_dirs):
+        """Extract the members of the zip at url matching target_unzip_dirs
+        into parent_dir, reading only those (and the zip's central
+        directory) with HTTP Range requests.
+
+        Returns False if no server for url (or its proxxy urls) supports
+        Range requests, or reading the zip failed; the caller should then
+        download the whole zip.
+        """
+        urls = [url]
+        if not self.config.get("developer_mode"):
+            urls = self._query_proxxy().get_proxies_and_urls(urls)
+        for candidate in urls:
+            self.info("Extracting %s from %s" % (' '.join(target_unzip_dirs), candidate))
+            try:
+                f = HTTPRangeFile(candidate, urlopen=self._urlopen)
+                try:
+                    zf = zipfile.ZipFile(f)
+                    members = extract_zip_members(zf, parent_dir,
+                                                  target_unzip_dirs)
+                finally:
+                    f.close()
+            except RangeNotSupported, e:
+                self.info("%s; skipping." % str(e))
+                continue
+            except (zipfile.BadZipfile, urllib2.URLError, httplib.HTTPException,
+                    socket.timeout, socket.error, IOError), e:
+                self.warning("Can't extract from %s: %s" % (candidate, str(e)))
+                continue
+            self.info("Extracted %d of %d files (%d bytes) from %s with %d "
+                      "requests, receiving %d of %d bytes." %
+                      (len(members), len(zf.infolist()),
+                       sum([i.file_size for i in members]), candidate,
+                       f.requests, f.bytes_received, f.size))
+            return True
+        return False
+
     def _download_unzip(self, url, parent_dir, target_unzip_dirs=None):
         """Generic download+unzip.
         This is hardcoded to halt on failure.
-        We should probably change some other methods to call this."""
+        We should probably change some other methods to call this.
+
+        With self.config['remote_unzip'] set, only the target_unzip_dirs
+        are fetched, if the server allows it."""
+        if target_unzip_dirs and self.config.get('remote_unzip'):
+            self.mkdir_p(parent_dir)
+            if self._remote_unzip(url, parent_dir, target_unzip_dirs):
+                return
+            self.info("Falling back to downloading all of %s" % url)
         dirs = self.query_abs_dirs()
         zipfile = self.download_file(url, parent_dir=dirs['abs_work_dir'],
                                              error_level=FATAL)
-        command = self.query_exe('unzip', return_type='list')
-        command.extend(['-q', '-o', zipfile])
-        if target_unzip_dirs:
-            command.extend(target_unzip_dirs)
-        self.run_command(command, cwd=parent_dir, halt_on_failure=True,
-                         success_codes=[0, 11],
-                         fatal_exit_code=3, output_timeout=1760)
+        self.unpack(zipfile, parent_dir, extract_dirs=target_unzip_dirs)
 
     def _extract_test_zip(self, target_unzip_dirs=None):
         dirs = self.query_abs_dirs()
-        unzip = self.query_exe("unzip")
         test_install_dir = dirs.get('abs_test_install_dir',
                                     os.path.join(dirs['abs_work_dir'], 'tests'))
         self.mkdir_p(test_install_dir)
-        # adding overwrite flag otherwise subprocess.Popen hangs on waiting for
-        # input in a hidden pipe whenever this action is run twice without
-        # clobber
-        unzip_cmd = [unzip, '-q', '-o', self.test_zip_path]
-        if target_unzip_dirs:
-            unzip_cmd.extend(target_unzip_dirs)
-        # TODO error_list
-        # unzip return code 11 is 'no matching files were found'
-        self.run_command(unzip_cmd, cwd=test_install_dir,
-                         halt_on_failure=True, success_codes=[0, 11],
-                         fatal_exit_code=3)
+        self.unpack(self.test_zip_path, test_install_dir,
+                    extract_dirs=target_unzip_dirs)
 
     def _read_tree_config(self):
         """Reads an in-tree config file"""
@@ -525,8 +571,7 @@ You can set this by:
                                             error_level=FATAL)
         self.set_buildbot_property("symbols_url", self.symbols_url,
                                    write_to_file=True)
-        self.run_command(['unzip', '-q', source], cwd=self.symbols_path,
-                         halt_on_failure=True, fatal_exit_code=3)
+        self.unpack(source, self.symbols_path)
 
     def download_and_extract(self, target_unzip_dirs=None, suite_categories=None):
         """
@@ -544,6 +589,8 @@ You can set this by:
                 setattr(self, attr, new_url)
 
         if 'test_url' in self.config:
+            dirs = self.query_abs_dirs()
+            extracted = False
             # A user has specified a test_url directly, any test_packages_url will
             # be ignored.
             if self.test_packages_url:
@@ -551,8 +598,15 @@ You can set this by:
                            ' package data at "%s" will be ignored.' %
                            (self.config('test_url'), self.test_packages_url))
 
-            self._download_test_zip()
-            self._extract_test_zip(target_unzip_dirs=target_unzip_dirs)
+            if target_unzip_dirs and self.config.get('remote_unzip'):
+                test_install_dir = dirs.get('abs_test_install_dir',
+                                            os.path.join(dirs['abs_work_dir'], 'tests'))
+                self.mkdir_p(test_install_dir)
+                extracted = self._remote_unzip(self.test_url, test_install_dir,
+                                               target_unzip_dirs)
+            if not extracted:
+                self._download_test_zip()
+                self._extract_test_zip(target_unzip_dirs=target_unzip_dirs)
         else:
             if not self.test_packages_url:
                 # The caller intends to download harness specific packages, but doesn't know
@@ -76,6 +76,9 @@ class TooltoolMixin(object):
 
         cmd.extend(['fetch', '-m', manifest, '-o'])
 
+        if not cache and self.query_download_cache():
+            # tooltool caches files by digest, like the download cache.
+            cache = self.query_download_cache().objects_dir
         if cache:
             cmd.extend(['-c', cache])
 
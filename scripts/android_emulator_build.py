@@ -382,10 +382,9 @@ class EmulatorBuild(BaseScript, PurgeMixin):
 
     def download_ndk(self):
         ndk = "android-ndk-%s-linux-%s.tar.bz2" % (self.config['ndk_version'], self.config['host_arch'])
-        self.download_file("http://dl.google.com/android/ndk/" + ndk,
-                           file_name=ndk, parent_dir=self.workdir)
-        self.run_command(["tar", "-xjf", ndk],
-                         cwd=self.workdir, halt_on_failure=True)
+        self.download_unpack("http://dl.google.com/android/ndk/" + ndk,
+                             self.workdir, file_name=ndk,
+                             parent_dir=self.workdir, keep_file=True)
 
 
     def download_test_binaries(self):
@@ -360,15 +360,13 @@ class B2GBuild(LocalesMixin, PurgeMixin,
 
     def unpack_blobs(self):
         dirs = self.query_abs_dirs()
-        tar = self.query_exe('tar', return_type="list")
         gecko_config = self.load_gecko_config()
         extra_tarballs = self.config.get('additional_source_tarballs', [])
         if 'additional_source_tarballs' in gecko_config:
             extra_tarballs.extend(gecko_config['additional_source_tarballs'])
 
         for tarball in extra_tarballs:
-            self.run_command(tar + ["xf", tarball], cwd=dirs['work_dir'],
-                             halt_on_failure=True, fatal_exit_code=3)
+            self.unpack(os.path.join(dirs['work_dir'], tarball), dirs['work_dir'])
 
     def checkout_gaia_l10n(self):
         if not self.config.get('gaia_languages_file'):
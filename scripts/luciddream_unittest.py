@@ -13,8 +13,8 @@ import sys
 # load modules from parent dir
 sys.path.insert(1, os.path.dirname(sys.path[0]))
 
-from mozharness.base.errors import BaseErrorList, TarErrorList, ZipErrorList
-from mozharness.base.log import ERROR, WARNING, FATAL, INFO
+from mozharness.base.errors import BaseErrorList, ZipErrorList
+from mozharness.base.log import ERROR, WARNING, INFO
 from mozharness.base.script import (
     BaseScript,
     PreScriptAction,
@@ -153,15 +153,10 @@ class LuciddreamTest(TestingMixin, MercurialScript, MozbaseMixin, BaseScript,
     def install_emulator(self):
         dirs = self.query_abs_dirs()
         self.mkdir_p(dirs['abs_emulator_dir'])
-        tarfile = self.download_file(self.emulator_url,
-                                     parent_dir=dirs['abs_work_dir'],
-                                     error_level=FATAL)
-        self.emulator_path = tarfile
-        tar = self.query_exe('tar', return_type='list')
-        self.run_command(tar + ['zxf', self.emulator_path],
-                         cwd=dirs['abs_emulator_dir'],
-                         error_list=TarErrorList,
-                         halt_on_failure=True, fatal_exit_code=3)
+        self.download_unpack(self.emulator_url, dirs['abs_emulator_dir'],
+                             parent_dir=dirs['abs_work_dir'], keep_file=True)
+        self.emulator_path = os.path.join(
+            dirs['abs_work_dir'], self.get_filename_from_url(self.emulator_url))
 
     def install(self, **kwargs):
         super(LuciddreamTest, self).install(**kwargs)
@@ -712,14 +712,29 @@ intree=1
                 self.info("No new mapfiles to combine.")
                 return
             self.move(combined_mapfile_path, "%s.old" % combined_mapfile_path)
-        output = self.get_output_from_command(
-            ['sort', '--unique', '-t', ' ',
-             '--key=2'] + existing_mapfiles,
-            silent=True, halt_on_failure=True,
-            cwd=cwd,
-        )
-        self.write_to_file(combined_mapfile_path, output, verbose=False,
-                           error_level=FATAL)
+        self.info("Writing to file %s" % combined_mapfile_path)
+        # Written next to it and renamed into place, so a failure can't
+        # leave a partial mapfile behind.
+        tmp_mapfile_path = "%s.tmp" % combined_mapfile_path
+        try:
+            fh = open(tmp_mapfile_path, 'w')
+        except IOError:
+            self.fatal("%s can't be opened for writing!" % tmp_mapfile_path)
+        try:
+            # Stream the sorted mapfile straight to disk rather than holding
+            # it all in memory.
+            for line in self.iter_output_from_command(
+                ['sort', '--unique', '-t', ' ',
+                 '--key=2'] + existing_mapfiles,
+                halt_on_failure=True, cwd=cwd,
+            ):
+                fh.write('%s\n' % line)
+            fh.close()
+            os.rename(tmp_mapfile_path, combined_mapfile_path)
+        except:
+            fh.close()
+            self.rmtree(tmp_mapfile_path)
+            raise
         self.run_command(['ln', '-sf', combined_mapfile,
                           '%s-latest' % combined_mapfile],
                          cwd=cwd)
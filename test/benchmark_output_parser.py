@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Compare OutputParser's compiled error_list matcher with the old
+sequential check.
+
+    python test/benchmark_output_parser.py [build.log[.gz] ...]
+
+Replays the given logs (or, without arguments, two million synthesized
+build log lines) through both paths, checks they pick the same error_list
+entry for every line, and prints the time each took.
+"""
+
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mozharness.base.errors import BaseErrorList, HgErrorList, \
+    MakefileErrorList, PythonErrorList
+from mozharness.base.log import ErrorListMatcher
+
+ERROR_LIST = BaseErrorList + MakefileErrorList + HgErrorList + PythonErrorList
+
+SYNTHETIC_LINES = [
+    "make[3]: Entering directory `/builds/slave/m-in-l64/build/obj/dom/base'",
+    "/usr/bin/ccache /tools/gcc-4.7.3-0moz1/bin/g++ -o nsDocument.o -c "
+    "-fvisibility=hidden -DMOZILLA_INTERNAL_API -I../../dom/base",
+    "In file included from ../../dist/include/nsDocument.h:12:0,",
+    "../../dom/base/nsDocument.cpp:123:5: warning: unused variable 'rv'",
+    "12:34:56     INFO -  TEST-PASS | test_foo.js | passed",
+    "make[3]: Leaving directory `/builds/slave/m-in-l64/build/obj/dom/base'",
+]
+
+
+def read_lines(paths):
+    if not paths:
+        count = 2000000
+        return [SYNTHETIC_LINES[i % len(SYNTHETIC_LINES)] for i in xrange(count)]
+    lines = []
+    for path in paths:
+        if path.endswith('.gz'):
+            fh = gzip.open(path)
+        else:
+            fh = open(path)
+        lines.extend(line.rstrip('\r\n') for line in fh)
+        fh.close()
+    return lines
+
+
+def sequential_match(error_list, line):
+    """The per-entry loop OutputParser.parse_single_line used to run."""
+    for error_check in error_list:
+        if 'substr' in error_check:
+            if error_check['substr'] in line:
+                return error_check
+        elif 'regex' in error_check:
+            if error_check['regex'].search(line):
+                return error_check
+
+
+def main(paths):
+    lines = read_lines(paths)
+    print "%d lines, %d error_list entries" % (len(lines), len(ERROR_LIST))
+
+    start = time.time()
+    old = [sequential_match(ERROR_LIST, line) for line in lines]
+    old_time = time.time() - start
+    print "sequential: %.2fs" % old_time
+
+    start = time.time()
+    matcher = ErrorListMatcher(ERROR_LIST)
+    new = [matcher.match(line) for line in lines]
+    new_time = time.time() - start
+    print "compiled:   %.2fs (%d of %d entries unfiltered)" % (
+        new_time, len(matcher.unfiltered), len(matcher.entries))
+
+    mismatches = [i for i in xrange(len(lines)) if old[i] is not new[i]]
+    if mismatches:
+        print "MISMATCH on %d lines, first: %r" % (len(mismatches),
+                                                   lines[mismatches[0]])
+        return 1
+    print "results identical, %.1fx faster" % (old_time / max(new_time, 1e-6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import shutil
+import time
+import unittest
+
+import mock
+
+from mozharness.base.cache import DigestCache, DownloadCache
+
+cache_dir = 'test_cache_dir'
+work_dir = 'test_dir'
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+        self.cache = DownloadCache(cache_dir)
+
+    def tearDown(self):
+        for d in (cache_dir, work_dir):
+            if os.path.exists(d):
+                shutil.rmtree(d)
+
+    def _write(self, name, contents):
+        path = os.path.join(work_dir, name)
+        fh = open(path, 'wb')
+        fh.write(contents)
+        fh.close()
+        return path
+
+    def _read(self, path):
+        fh = open(path, 'rb')
+        contents = fh.read()
+        fh.close()
+        return contents
+
+    def test_store_lookup(self):
+        path = self._write('a.zip', 'aaaa')
+        self.assertEqual(self.cache.lookup('http://a/a.zip'), None)
+        digest = self.cache.store('http://a/a.zip', path)
+        self.assertEqual(digest, hashlib.sha512('aaaa').hexdigest())
+        cached = self.cache.lookup('http://a/a.zip')
+        self.assertEqual(self._read(cached), 'aaaa')
+        self.assertEqual(self.cache.lookup('http://a/b.zip'), None)
+        # any url will do with the right sha512
+        self.assertEqual(self.cache.lookup('http://a/b.zip', sha512=digest), cached)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_revalidate(self):
+        path = self._write('a.zip', 'aaaa')
+        digest = self.cache.store('http://a/a.zip', path,
+                                  validators={'ETag': '"a"'})
+        seen = []
+
+        def revalidate(validators):
+            seen.append(validators)
+            return False
+        self.assertEqual(self.cache.lookup('http://a/a.zip',
+                                           revalidate=revalidate), None)
+        self.assertEqual(seen, [{'ETag': '"a"'}])
+        # Not asked when the sha512 is known.
+        self.assertTrue(self.cache.lookup('http://a/a.zip', sha512=digest,
+                                          revalidate=revalidate))
+        self.assertEqual(len(seen), 1)
+        self.assertTrue(self.cache.lookup('http://a/a.zip',
+                                          revalidate=lambda v: True))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_store_bad_sha512(self):
+        path = self._write('a.zip', 'aaaa')
+        self.assertEqual(self.cache.store('http://a/a.zip', path, sha512='0'), None)
+        self.assertEqual(self.cache.lookup('http://a/a.zip'), None)
+
+    def test_fetch(self):
+        self.cache.store('http://a/a.zip', self._write('a.zip', 'aaaa'))
+        dest = os.path.join(work_dir, 'b.zip')
+        how = self.cache.fetch(self.cache.lookup('http://a/a.zip'), dest)
+        self.assertTrue(how in ('hardlink', 'copy'))
+        self.assertEqual(self._read(dest), 'aaaa')
+
+    def test_modified_object(self):
+        self.cache.store('http://a/a.zip', self._write('a.zip', 'aaaa'))
+        cached = self.cache.lookup('http://a/a.zip')
+        time.sleep(0.01)
+        fh = open(cached, 'wb')
+        fh.write('bbbb')
+        fh.close()
+        self.assertEqual(self.cache.lookup('http://a/a.zip'), None)
+        self.assertFalse(os.path.exists(cached))
+
+    def test_evict(self):
+        self.cache.max_size = 10
+        self.cache.store('http://a/a', self._write('a', 'a' * 4))
+        self.cache.store('http://a/b', self._write('b', 'b' * 4))
+        # make b the least recently used
+        path = self.cache.lookup('http://a/b')
+        os.utime(path, (time.time() - 100, os.stat(path).st_mtime))
+        self.cache.lookup('http://a/a')
+        self.cache.store('http://a/c', self._write('c', 'c' * 4))
+        self.assertEqual(self.cache.lookup('http://a/b'), None)
+        self.assertNotEqual(self.cache.lookup('http://a/a'), None)
+        self.assertNotEqual(self.cache.lookup('http://a/c'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestDigestCache(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+        self.path = os.path.join(work_dir, 'a.mar')
+        fh = open(self.path, 'wb')
+        fh.write('mar' * 1000)
+        fh.close()
+        # Old enough to be worth remembering.
+        os.utime(self.path, (time.time() - 60, time.time() - 60))
+        self.cache_file = os.path.join(cache_dir, 'digests.json')
+
+    def tearDown(self):
+        for d in (cache_dir, work_dir):
+            if os.path.exists(d):
+                shutil.rmtree(d)
+
+    def test_query(self):
+        cache = DigestCache(self.cache_file)
+        digests = cache.query(self.path, ['sha512', 'sha1'])
+        self.assertEqual(digests['sha1'], hashlib.sha1('mar' * 1000).hexdigest())
+        self.assertEqual(cache.misses, 2)
+        # Another process reads the file once, for what's missing.
+        other = DigestCache(self.cache_file)
+        with mock.patch('mozharness.base.cache.file_digests') as file_digests:
+            file_digests.return_value = {'md5': 'x'}
+            self.assertEqual(other.query(self.path, ['sha1', 'md5']),
+                             {'sha1': digests['sha1'], 'md5': 'x'})
+            file_digests.assert_called_once_with(self.path, ['md5'])
+        self.assertEqual(other.hits, 1)
+        self.assertEqual(DigestCache(self.cache_file).lookup(self.path, ['md5']),
+                         {'md5': 'x'})
+
+    def test_changed(self):
+        cache = DigestCache(self.cache_file)
+        cache.query(self.path)
+        fh = open(self.path, 'ab')
+        fh.write('more')
+        fh.close()
+        self.assertEqual(cache.lookup(self.path), {})
+        # Just changed, so it could change again unnoticed.
+        self.assertEqual(cache.query(self.path)['sha512'],
+                         hashlib.sha512('mar' * 1000 + 'more').hexdigest())
+        self.assertEqual(DigestCache(self.cache_file).lookup(self.path), {})
+
+    def test_max_entries(self):
+        cache = DigestCache(self.cache_file, max_entries=2)
+        for i in range(3):
+            path = os.path.join(work_dir, str(i))
+            open(path, 'w').close()
+            os.utime(path, (time.time() - 60, time.time() - 60))
+            cache.query(path)
+        cache = DigestCache(self.cache_file, max_entries=2)
+        self.assertEqual(cache.lookup(os.path.join(work_dir, '0')), {})
+        self.assertTrue(cache.lookup(os.path.join(work_dir, '2')))
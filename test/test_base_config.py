@@ -1,5 +1,10 @@
 import os
+import shutil
 import unittest
+import urllib2
+from StringIO import StringIO
+
+import mock
 
 JSON_TYPE = None
 try:
@@ -12,6 +17,7 @@ else:
     JSON_TYPE = 'simplejson'
 
 import mozharness.base.config as config
+from mozharness.base.cache import DownloadCache
 from copy import deepcopy
 
 MH_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -247,6 +253,136 @@ class TestReadOnlyDict(unittest.TestCase):
         c['e'] = 'hey'
         self.assertEqual(c['e'], 'hey', "can't set var in ROD after deepcopy")
 
+    def test_locked_items_frozen(self):
+        r = self.get_locked_ROD()
+        for value in r.values() + [v for k, v in r.items()]:
+            self.assertFalse(isinstance(value, (list, dict)) and
+                             not isinstance(value, config.ReadOnlyDict))
+        self.assertTrue(isinstance(r.get('e'), config.LockedTuple))
+
+    def test_lock_is_lazy(self):
+        r = self.get_locked_ROD()
+        # Below the top level, nothing is made immutable until it's read,
+        # and only once.
+        d = dict.__getitem__(r, 'd')
+        self.assertFalse(isinstance(dict.__getitem__(d, 'turtles'),
+                                    config.LockedTuple))
+        self.assertTrue(r['d']['turtles'] is r['d']['turtles'])
+        self.assertTrue(isinstance(dict.__getitem__(d, 'turtles'),
+                                   config.LockedTuple))
+        c = deepcopy(r)
+        c['d']['turtles'].append('turtle2')
+        self.assertEqual(self.control_dict['d']['turtles'], ['turtle1'])
+
+    def test_lock_isolates(self):
+        source = {'env': {'X': '1'}, 'list': ['a']}
+        r = config.ReadOnlyDict(source)
+        r.lock()
+        source['env']['Y'] = '2'
+        source['list'].append('b')
+        self.assertEqual(dict(r), {'env': {'X': '1'}, 'list': ('a', )})
+        self.assertRaises(AssertionError, dict(r)['env'].__setitem__, 'X', '3')
+        self.assertEqual(r['env'], {'X': '1'})
+
+
+class TestConfigOrigins(unittest.TestCase):
+    def test_config_origins(self):
+        c = config.BaseConfig(config={'work_dir': 'script', 'a': 1},
+                              option_args=['foo', '--work-dir', 'cmd'])
+        self.assertEqual(c.config_origins['a'], config.SCRIPT_CONFIG)
+        self.assertEqual(c.config_origins['work_dir'], config.COMMAND_LINE)
+        self.assertTrue('actions' not in c.config_origins)
+
+
+class TestDownloadConfigFile(unittest.TestCase):
+    url = 'http://example.com/configs/remote.json'
+
+    def setUp(self):
+        self.tearDown()
+        os.mkdir('test_dir')
+        self.file_name = os.path.join('test_dir', 'remote.json')
+        self.cache = DownloadCache(os.path.join('test_dir', 'cache'))
+
+    def tearDown(self):
+        if os.path.exists('test_dir'):
+            shutil.rmtree('test_dir')
+
+    def _response(self, contents, headers=()):
+        response = urllib2.addinfourl(StringIO(contents), {}, self.url)
+        response.info = lambda: mock.Mock(getheader=dict(headers).get)
+        return response
+
+    def _download(self, **kwargs):
+        config.download_config_file(self.url, self.file_name,
+                                    cache=self.cache, **kwargs)
+        return open(self.file_name).read()
+
+    def test_revalidate(self):
+        with mock.patch('urllib2.urlopen', return_value=self._response(
+                '{"a": 1}', [('ETag', '"v1"')])):
+            self._download()
+        not_modified = urllib2.HTTPError(self.url, 304, 'Not Modified',
+                                         {}, None)
+        with mock.patch('urllib2.urlopen', side_effect=not_modified) as urlopen:
+            self.assertEqual(self._download(), '{"a": 1}')
+        request = urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('If-none-match'), '"v1"')
+
+    def test_unreachable(self):
+        with mock.patch('urllib2.urlopen', return_value=self._response('{}')):
+            self._download()
+        with mock.patch('urllib2.urlopen',
+                        side_effect=urllib2.URLError('refused')):
+            with mock.patch('time.sleep') as sleep:
+                self.assertEqual(self._download(), '{}')
+        self.assertFalse(sleep.called)
+
+    def test_backoff(self):
+        with mock.patch('urllib2.urlopen',
+                        side_effect=urllib2.URLError('refused')):
+            with mock.patch('time.sleep') as sleep:
+                self.assertRaises(SystemError, self._download, attempts=4,
+                                  sleeptime=1, max_sleeptime=3)
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [1, 2, 3])
+
+    def test_download_config_files(self):
+        c = config.BaseConfig(initial_config_file='test/test.json')
+        urls = ['http://example.com/a.json', 'http://example.com/b.json']
+
+        def download(url, file_path, **kwargs):
+            if url.endswith('b.json'):
+                raise SystemError(-1)
+        with mock.patch.object(config, 'download_config_file',
+                               side_effect=download) as download_config_file:
+            downloads = c.download_config_files(urls, mock.Mock(
+                remote_config_cache_dir=None, remote_config_retries=1,
+                remote_config_retry_sleep=0, remote_config_max_retry_sleep=0))
+        self.assertEqual(download_config_file.call_count, 2)
+        self.assertEqual(downloads[urls[0]],
+                         (os.path.join(os.getcwd(), 'a.json'), None))
+        self.assertTrue(isinstance(downloads[urls[1]][1], SystemError))
+
+    def test_same_basename(self):
+        c = config.BaseConfig(initial_config_file='test/test.json')
+        urls = ['http://example.com/a/remote.json',
+                'http://example.com/b/remote.json']
+
+        def urlopen(request, timeout=None):
+            url = request.get_full_url()
+            return self._response('{"dir": "%s"}' % url.split('/')[-2])
+        cwd = os.getcwd()
+        os.chdir('test_dir')
+        try:
+            with mock.patch('urllib2.urlopen', side_effect=urlopen):
+                cfgs = c.get_cfgs_from_files(urls, mock.Mock(
+                    opt_config_files=[], remote_config_cache_dir=None,
+                    remote_config_retries=1, remote_config_retry_sleep=0,
+                    remote_config_max_retry_sleep=0))
+        finally:
+            os.chdir(cwd)
+        self.assertEqual([cfg['dir'] for path, cfg in cfgs], ['a', 'b'])
+        self.assertNotEqual(cfgs[0][0], cfgs[1][0])
+
 
 class TestActions(unittest.TestCase):
     all_actions = ['a', 'b', 'c', 'd', 'e']
@@ -0,0 +1,103 @@
+import os
+import shutil
+import time
+import unittest
+
+import mock
+
+from mozharness.base.configcache import ConfigCache, main
+from mozharness.base.config import parse_config_file
+
+work_dir = os.path.abspath('test_dir')
+cache_dir = os.path.join(work_dir, 'cache')
+
+
+class TestConfigCache(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+        self.config_file = self._write('build.py', """
+import os
+execfile(os.path.join(%r, 'common.py'))
+config = {
+    'work_dir': os.path.join(os.getcwd(), 'build'),
+    'branch': BRANCH,
+    'platforms': ('linux', 'win32'),
+}
+""" % work_dir)
+        self.common_file = self._write('common.py', "BRANCH = 'central'\n")
+        self.cache = ConfigCache(cache_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def _write(self, name, contents, age=60):
+        path = os.path.join(work_dir, name)
+        fh = open(path, 'w')
+        fh.write(contents)
+        fh.close()
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_load(self):
+        config = self.cache.load(self.config_file)
+        self.assertEqual(config['branch'], 'central')
+        self.assertEqual(self.cache.load(self.config_file), config)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # Files it read are checked too.
+        self._write('common.py', "BRANCH = 'inbound'\n")
+        self.assertEqual(self.cache.load(self.config_file)['branch'], 'inbound')
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_touched(self):
+        config = self.cache.load(self.config_file)
+        # Same contents, as after a fresh checkout.
+        os.utime(self.common_file, None)
+        with mock.patch('mozharness.base.configcache.run_config_file') as run:
+            self.assertEqual(self.cache.load(self.config_file), config)
+            self.assertFalse(run.called)
+
+    def test_context(self):
+        self.cache.load(self.config_file)
+        with mock.patch('os.getcwd', return_value='/elsewhere'):
+            config = self.cache.load(self.config_file)
+        self.assertEqual(config['work_dir'], '/elsewhere/build')
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_uncacheable(self):
+        path = self._write('env.py', "import os\nconfig = {'home': os.environ.get('HOME')}\n")
+        self.cache.load(path)
+        self.cache.load(path)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertFalse(self.cache.warm(path))
+
+    def test_uncacheable_execfile(self):
+        self._write('common.py', "import os\nBRANCH = os.environ['BRANCH']\n")
+        with mock.patch.dict(os.environ, {'BRANCH': 'central'}):
+            self.assertEqual(self.cache.load(self.config_file)['branch'],
+                             'central')
+        with mock.patch.dict(os.environ, {'BRANCH': 'inbound'}):
+            self.assertEqual(self.cache.load(self.config_file)['branch'],
+                             'inbound')
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_execfile_context(self):
+        self._write('common.py', "import socket\nBRANCH = socket.gethostname()\n")
+        with mock.patch('socket.gethostname', return_value='a'):
+            self.assertEqual(self.cache.load(self.config_file)['branch'], 'a')
+        with mock.patch('socket.gethostname', return_value='b'):
+            self.assertEqual(self.cache.load(self.config_file)['branch'], 'b')
+
+    def test_parse_config_file(self):
+        with mock.patch.dict(os.environ, {'MOZHARNESS_CONFIG_CACHE': cache_dir}):
+            config = parse_config_file(self.config_file)
+            self.assertEqual(parse_config_file(self.config_file), config)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_cli(self):
+        main(['--cache-dir', cache_dir, '-C', work_dir, 'warm', work_dir])
+        # common.py has no config dict.
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        main(['--cache-dir', cache_dir, 'clear'])
+        self.assertEqual(os.listdir(cache_dir), [])
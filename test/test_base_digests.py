@@ -0,0 +1,66 @@
+import hashlib
+import mock
+import os
+import shutil
+import unittest
+
+from mozharness.base.digests import DigestingWriter, file_digests, \
+    file_signature, hash_file, hexdigests, new_hashers
+
+work_dir = 'test_dir'
+contents = ''.join([chr(i % 251) for i in range(10000)])
+
+
+class TestDigests(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+        self.path = os.path.join(work_dir, 'file')
+        fh = open(self.path, 'wb')
+        fh.write(contents)
+        fh.close()
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def test_file_digests(self):
+        self.assertEqual(file_digests(self.path, ['sha512', 'md5']),
+                         {'sha512': hashlib.sha512(contents).hexdigest(),
+                          'md5': hashlib.md5(contents).hexdigest()})
+
+    def test_hash_file_length(self):
+        hashers = hash_file(self.path, new_hashers(['sha1']), length=2500,
+                            block_size=1000)
+        self.assertEqual(hexdigests(hashers)['sha1'],
+                         hashlib.sha1(contents[:2500]).hexdigest())
+
+    def test_hash_file_unmapped(self):
+        # Empty files can't be mapped; neither can files on some filesystems.
+        open(self.path, 'wb').close()
+        self.assertEqual(file_digests(self.path, ['sha1']),
+                         {'sha1': hashlib.sha1('').hexdigest()})
+        fh = open(self.path, 'wb')
+        fh.write(contents)
+        fh.close()
+        with mock.patch('mmap.mmap', side_effect=EnvironmentError):
+            self.assertEqual(file_digests(self.path, ['sha1']),
+                             {'sha1': hashlib.sha1(contents).hexdigest()})
+
+    def test_digesting_writer(self):
+        hashers = new_hashers(['sha1'])
+        out = DigestingWriter(open(self.path, 'wb'), hashers)
+        out.write('abc')
+        out.write('def')
+        out.close()
+        self.assertEqual(hexdigests(hashers)['sha1'],
+                         hashlib.sha1('abcdef').hexdigest())
+        self.assertEqual(file_digests(self.path, ['sha1']),
+                         hexdigests(hashers))
+
+    def test_file_signature(self):
+        signature = file_signature(self.path)
+        fh = open(self.path, 'ab')
+        fh.write('more')
+        fh.close()
+        self.assertNotEqual(file_signature(self.path), signature)
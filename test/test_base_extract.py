@@ -0,0 +1,123 @@
+import os
+import shutil
+import stat
+import tarfile
+import unittest
+import zipfile
+
+from mozharness.base.extract import ExtractError, ReadAheadStream, \
+    archive_type, extract_archive, extract_tar, extract_zip, is_safe_name
+
+work_dir = 'test_dir'
+dest = os.path.join(work_dir, 'dest')
+
+FILES = {
+    'bin/run.sh': '#!/bin/sh\n',
+    'bin/sub/data': 'x' * 10000,
+    'mochitest/test.html': '<html/>',
+    'reftest/reftest.list': '== a.html b.html\n',
+}
+
+
+class TestExtract(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def _make_zip(self):
+        path = os.path.join(work_dir, 'tests.zip')
+        zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        for name, contents in sorted(FILES.items()):
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (0755 if name.endswith('.sh') else 0644) << 16
+            zf.writestr(info, contents)
+        zf.writestr('../evil', 'nope')
+        zf.close()
+        return path
+
+    def _make_tar(self, suffix):
+        src = os.path.join(work_dir, 'src')
+        for name, contents in FILES.items():
+            path = os.path.join(src, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fh = open(path, 'wb')
+            fh.write(contents)
+            fh.close()
+        path = os.path.join(work_dir, 'tests.tar' + suffix)
+        tar = tarfile.open(path, 'w:' + suffix.lstrip('.'))
+        for name in sorted(os.listdir(src)):
+            tar.add(os.path.join(src, name), name)
+        tar.close()
+        return path
+
+    def _check(self, names):
+        for name in names:
+            fh = open(os.path.join(dest, name), 'rb')
+            self.assertEqual(fh.read(), FILES[name])
+            fh.close()
+
+    def test_zip(self):
+        members = extract_zip(self._make_zip(), dest, processes=1)
+        self.assertEqual(len(members), len(FILES))
+        self._check(FILES)
+        mode = os.stat(os.path.join(dest, 'bin', 'run.sh')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0755)
+        self.assertFalse(os.path.exists(os.path.join(work_dir, 'evil')))
+
+    def test_zip_parallel(self):
+        path = self._make_zip()
+        extract_zip(path, dest, ['bin/*', 'mochitest/*'], processes=2,
+                    parallel_min_size=0, batch_size=1)
+        self._check(['bin/run.sh', 'bin/sub/data', 'mochitest/test.html'])
+        self.assertFalse(os.path.exists(os.path.join(dest, 'reftest')))
+        # Overwrite read-only files, like unzip -o.
+        os.chmod(os.path.join(dest, 'mochitest', 'test.html'), 0444)
+        extract_zip(path, dest, ['mochitest/*'], processes=2,
+                    parallel_min_size=0, batch_size=1)
+        self._check(['mochitest/test.html'])
+
+    def test_tar_gz(self):
+        members = extract_tar(self._make_tar('.gz'), dest, ['bin/*'])
+        self._check(['bin/run.sh', 'bin/sub/data'])
+        self.assertEqual(sorted(os.listdir(dest)), ['bin'])
+        # bin/sub, bin/sub/data and bin/run.sh; bin itself doesn't match.
+        self.assertEqual(len(members), 3)
+
+    def test_extract_archive(self):
+        stats = extract_archive(self._make_tar('.bz2'), dest)
+        self._check(FILES)
+        self.assertEqual(stats['bytes'], sum(map(len, FILES.values())))
+
+    def test_stream(self):
+        path = self._make_tar('.gz')
+        copy_path = os.path.join(work_dir, 'copy.tar.gz')
+        copy = open(copy_path, 'wb')
+        stream = ReadAheadStream(open(path, 'rb'), copy=copy, block_size=100,
+                                 max_blocks=2)
+        stats = extract_archive('http://example.com/tests.tar.gz', dest,
+                                fileobj=stream)
+        stream.drain()
+        stream.close()
+        copy.close()
+        self._check(FILES)
+        self.assertEqual(stats['files'], 8)
+        self.assertEqual(open(copy_path, 'rb').read(), open(path, 'rb').read())
+        self.assertRaises(ExtractError, extract_archive, 'tests.zip', dest,
+                          fileobj=open(path, 'rb'))
+
+    def test_unknown_archive(self):
+        path = os.path.join(work_dir, 'file.txt')
+        open(path, 'w').close()
+        self.assertEqual(archive_type(path), None)
+        self.assertRaises(ExtractError, extract_archive, path, dest)
+
+    def test_is_safe_name(self):
+        self.assertTrue(is_safe_name('bin/..foo'))
+        self.assertFalse(is_safe_name('bin/../../foo'))
+        self.assertFalse(is_safe_name('/etc/passwd'))
+        self.assertFalse(is_safe_name('c:\\foo'))
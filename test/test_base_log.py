@@ -1,8 +1,11 @@
 import os
+import re
 import shutil
 import subprocess
 import unittest
 
+import mock
+
 import mozharness.base.log as log
 
 tmp_dir = "test_log_dir"
@@ -38,5 +41,162 @@ class TestLog(unittest.TestCase):
         self.assertTrue(os.path.exists(get_log_file_path()))
         del(l)
 
+    def test_async_log(self):
+        messages = ['line %d' % i for i in range(100)] + [u'caf\xe9']
+        levels = [log.DEBUG, log.INFO, log.WARNING, log.ERROR, log.CRITICAL]
+        contents = []
+        for async_log in (False, True):
+            clean_log_dir()
+            l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                    log_to_console=False, async_log=async_log,
+                                    log_level=log.DEBUG,
+                                    log_format='%(levelname)8s - %(message)s')
+            for i, message in enumerate(messages):
+                l.log_message(message, level=levels[i % len(levels)])
+            l.flush()
+            files = {}
+            for level in levels:
+                fh = open(get_log_file_path(level))
+                files[level] = fh.read()
+                fh.close()
+            contents.append(files)
+            del(l)
+        self.assertEqual(contents[0], contents[1])
+        self.assertTrue('line 99' in contents[1][log.DEBUG])
+
+    def test_log_writer_close(self):
+        os.mkdir(tmp_dir)
+        writer = log.LogWriter(interval=60)
+        handler = log.BatchedFileHandler(get_log_file_path(), writer)
+        handler.emit(log.logging.makeLogRecord({'msg': 'last'}))
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
+        handler.close()
+        self.assertEqual(open(get_log_file_path()).read(), 'last\n')
+
+
+class TestErrorListMatcher(unittest.TestCase):
+    error_list = [
+        {'substr': 'FATAL ERROR', 'level': log.FATAL},
+        {'regex': re.compile(r'^error: (\d+)'), 'level': log.ERROR},
+        {'substr': 'error', 'level': log.WARNING},
+        {'regex': re.compile(r'warning', re.I), 'level': log.WARNING},
+        {'substr': 'a.b', 'level': log.INFO},
+    ]
+
+    def test_first_match_wins(self):
+        matcher = log.ErrorListMatcher(self.error_list)
+        self.assertEqual(matcher.match('FATAL ERROR: error: 1'),
+                         self.error_list[0])
+        self.assertEqual(matcher.match('error: 12 things'), self.error_list[1])
+        self.assertEqual(matcher.match('an error: 12'), self.error_list[2])
+        self.assertEqual(matcher.match('WARNING'), self.error_list[3])
+        self.assertEqual(matcher.match('a.b'), self.error_list[4])
+        # substrs are matched literally
+        self.assertEqual(matcher.match('axb'), None)
+        self.assertEqual(matcher.match('nothing to see'), None)
+
+    def test_required_literal(self):
+        self.assertEqual(log._required_literal(re.compile(r'^abort:')), 'abort:')
+        self.assertEqual(log._required_literal(re.compile(r'make\[\d+\]: \*\*\* \[')),
+                         ']: *** [')
+        self.assertEqual(log._required_literal(re.compile(r'a|bc')), None)
+        self.assertEqual(log._required_literal(re.compile(r'abc', re.I)), None)
+        self.assertEqual(log._required_literal(re.compile(r'(?i)abc')), None)
+
+    def test_unfiltered_entries(self):
+        matcher = log.ErrorListMatcher(self.error_list)
+        self.assertEqual(matcher.unfiltered, [(self.error_list[3], 'regex')])
+        self.assertEqual(matcher.match('no WaRnInGs here'), self.error_list[3])
+
+    def test_bad_entry_warns(self):
+        error_list = [{'substr': 'foo'}, {'level': log.ERROR},
+                      {'substr': 'bar'}]
+        warned = []
+        matcher = log.ErrorListMatcher(error_list)
+        self.assertEqual(matcher.match('foo', warn=warned.append), error_list[0])
+        self.assertEqual(warned, [])
+        self.assertEqual(matcher.match('bar', warn=warned.append), error_list[2])
+        self.assertEqual(warned, [error_list[1]])
+
+    def test_duplicate_entries(self):
+        error_list = self.error_list + self.error_list
+        matcher = log.ErrorListMatcher(error_list)
+        self.assertEqual(len(matcher.entries), len(self.error_list))
+        self.assertEqual(matcher.match('a.b'), self.error_list[4])
+
+    def test_matcher_cache(self):
+        error_list = self.error_list + [{'substr': 'other'}]
+        matcher = log.get_error_list_matcher(error_list)
+        self.assertTrue(log.get_error_list_matcher(list(error_list)) is matcher)
+        self.assertFalse(log.get_error_list_matcher(self.error_list) is matcher)
+
+    def test_output_parser(self):
+        parser = log.OutputParser(error_list=self.error_list, log_output=False)
+        parser.add_lines(['ok', 'error: 3', 'an error', 'warning', 'FATAL ERROR'])
+        self.assertEqual(parser.num_errors, 2)
+        self.assertEqual(parser.num_warnings, 2)
+        self.assertEqual(parser.worst_log_level, log.FATAL)
+        # error_list changed after the first line
+        parser.error_list = [{'substr': 'ok', 'level': log.ERROR}]
+        parser.add_lines('ok')
+        self.assertEqual(parser.num_errors, 3)
+
+    def test_output_parser_shared_matcher(self):
+        log.OutputParser(error_list=self.error_list + [],
+                         log_output=False).add_lines('ok')
+        # A second parser's own copy of the list gets the cached matcher,
+        # looked up once rather than on every line.
+        parser = log.OutputParser(error_list=self.error_list + [],
+                                  log_output=False)
+        with mock.patch('mozharness.base.log.get_error_list_matcher',
+                        wraps=log.get_error_list_matcher) as get_matcher:
+            parser.add_lines(['ok', 'error: 3', 'an error'])
+        self.assertEqual(get_matcher.call_count, 1)
+        self.assertEqual((parser.num_errors, parser.num_warnings), (1, 1))
+
+
+class RecordingOutputParser(log.OutputParser):
+    def __init__(self, *args, **kwargs):
+        super(RecordingOutputParser, self).__init__(*args, **kwargs)
+        self.logged = []
+
+    def log(self, message, level=log.INFO, exit_code=-1):
+        self.logged.append((level, message.strip()))
+
+
+class TestOutputParserContext(unittest.TestCase):
+    def test_parse_context_lines(self):
+        self.assertEqual(log.parse_context_lines('5:5'), (5, 5))
+        self.assertEqual(log.parse_context_lines('20:'), (20, 0))
+        self.assertEqual(log.parse_context_lines(':3'), (0, 3))
+        self.assertEqual(log.parse_context_lines((1, 2)), (1, 2))
+
+    def test_context_lines(self):
+        error_list = [{'substr': 'boom', 'level': log.ERROR,
+                       'context_lines': '2:1'}]
+        parser = RecordingOutputParser(error_list=error_list)
+        parser.add_lines(['%d' % i for i in range(5)] + ['boom'] +
+                         ['%d' % i for i in range(5, 8)])
+        # the last lines are held back for pre-context
+        self.assertEqual(len(parser.logged), 7)
+        parser.finish()
+        self.assertEqual(parser.logged, [
+            (log.INFO, '0'), (log.INFO, '1'), (log.INFO, '2'),
+            (log.ERROR, '3'), (log.ERROR, '4'), (log.ERROR, 'boom'),
+            (log.ERROR, '5'), (log.INFO, '6'), (log.INFO, '7'),
+        ])
+        self.assertEqual(parser.num_errors, 1)
+        self.assertEqual(len(parser.context_buffer), 0)
+
+    def test_no_context_lines(self):
+        parser = RecordingOutputParser(error_list=[{'substr': 'boom',
+                                                    'level': log.ERROR}])
+        parser.add_lines(['a', 'boom', 'b'])
+        self.assertEqual(parser.logged, [(log.INFO, 'a'), (log.ERROR, 'boom'),
+                                         (log.INFO, 'b')])
+        self.assertEqual(parser.context_buffer.maxlen, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import threading
+import time
+import unittest
+
+import mock
+
+from mozharness.base.metrics import (
+    FileSink,
+    HTTPSink,
+    MetricsEmitter,
+    MetricsSinkError,
+    MetricsSpool,
+)
+
+work_dir = 'test_dir'
+spool_file = os.path.join(work_dir, 'spool', 'influx-spool.json')
+metrics_file = os.path.join(work_dir, 'metrics.json')
+
+
+def series(n):
+    return {'name': 'mozharness', 'columns': ['action', 'runtime'],
+            'points': [['action%d' % n, n]]}
+
+
+def read_batches(path):
+    fh = open(path)
+    try:
+        return [json.loads(line) for line in fh]
+    finally:
+        fh.close()
+
+
+class FailingSink(object):
+    def __init__(self, failures):
+        self.failures = failures
+        self.batches = []
+
+    def send(self, series):
+        if self.failures:
+            self.failures -= 1
+            raise MetricsSinkError("down")
+        self.batches.append(series)
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+
+class TestMetricsSpool(MetricsTestCase):
+    def test_read_drop(self):
+        spool = MetricsSpool(spool_file)
+        spool.append([series(1), series(2)])
+        spool.append([series(3)])
+        self.assertEqual(len(spool), 3)
+        found, size = spool.read(2)
+        self.assertEqual(found, [series(1), series(2)])
+        spool.drop(size)
+        self.assertEqual(spool.read(10)[0], [series(3)])
+
+    def test_partial_and_bad_lines(self):
+        spool = MetricsSpool(spool_file)
+        fh = open(spool_file, 'w')
+        fh.write('not json\n%s\n{"half": ' % json.dumps(series(1)))
+        fh.close()
+        found, size = spool.read(10)
+        # The mangled line is skipped but dropped with the rest; the line
+        # still being written is left alone.
+        self.assertEqual(found, [series(1)])
+        spool.drop(size)
+        self.assertEqual(open(spool_file).read(), '{"half": ')
+
+
+class TestMetricsEmitter(MetricsTestCase):
+    def test_flush_batches(self):
+        emitter = MetricsEmitter(spool_file, FileSink(metrics_file),
+                                 batch_size=2)
+        emitter.record([series(1), series(2), series(3)])
+        self.assertTrue(emitter.flush())
+        self.assertEqual(read_batches(metrics_file),
+                         [[series(1), series(2)], [series(3)]])
+        self.assertEqual(emitter.sent, 3)
+        self.assertEqual(len(emitter.spool), 0)
+
+    def test_failure_keeps_spool(self):
+        sink = FailingSink(1)
+        emitter = MetricsEmitter(spool_file, sink)
+        emitter.record([series(1)])
+        self.assertFalse(emitter.flush())
+        self.assertEqual(emitter.failures, 1)
+        self.assertEqual(len(emitter.spool), 1)
+        self.assertTrue(emitter.flush())
+        self.assertEqual(sink.batches, [[series(1)]])
+
+    def test_leftovers_sent_at_start(self):
+        earlier = MetricsEmitter(spool_file, FailingSink(100))
+        earlier.start()
+        earlier.record([series(1)])
+        self.assertFalse(earlier.close(timeout=1))
+
+        emitter = MetricsEmitter(spool_file, FileSink(metrics_file),
+                                 flush_interval=60)
+        emitter.start()
+        emitter.record([series(2)])
+        self.assertTrue(emitter.close())
+        self.assertEqual(sum(read_batches(metrics_file), []),
+                         [series(1), series(2)])
+
+    def test_close_timeout(self):
+        class SlowSink(FileSink):
+            def send(self, series):
+                time.sleep(0.2)
+                FileSink.send(self, series)
+        # Plenty left over from an earlier job.
+        MetricsEmitter(spool_file, None).record(
+            [series(n) for n in range(100)])
+        emitter = MetricsEmitter(spool_file, SlowSink(metrics_file),
+                                 batch_size=1)
+        emitter.start()
+        start = time.time()
+        self.assertFalse(emitter.close(timeout=1))
+        self.assertTrue(time.time() - start < 1.5)
+        # The send under way when time ran out finishes after close().
+        for thread in threading.enumerate():
+            if thread.name == 'MetricsEmitter':
+                thread.join()
+        self.assertTrue(0 < emitter.sent < 100)
+        self.assertEqual(len(emitter.spool), 100 - emitter.sent)
+
+    def test_one_sender(self):
+        emitter = MetricsEmitter(spool_file, FileSink(metrics_file))
+        emitter.record([series(1)])
+        # Another process's spool object, on the same file.
+        other = MetricsSpool(spool_file)
+        self.assertTrue(other.lock_sending())
+        try:
+            self.assertFalse(emitter.flush())
+            self.assertFalse(os.path.exists(metrics_file))
+        finally:
+            other.unlock_sending()
+        self.assertTrue(emitter.flush())
+        self.assertEqual(read_batches(metrics_file), [[series(1)]])
+
+    def test_backoff(self):
+        emitter = MetricsEmitter(spool_file, FailingSink(100), backoff=1,
+                                 max_backoff=4)
+        emitter.record([series(1)])
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 5:
+                emitter._closing = True
+        with mock.patch.object(emitter._wakeup, 'wait', wait):
+            emitter._flush_loop()
+        self.assertEqual(waits, [1, 2, 4, 4, 4])
+
+
+class TestHTTPSink(unittest.TestCase):
+    def test_post(self):
+        post = mock.Mock(return_value=mock.Mock(status_code=200))
+        HTTPSink('http://influx/series', post=post).send([series(1)])
+        post.assert_called_once_with('http://influx/series',
+                                     data=json.dumps([series(1)]), timeout=5)
+
+    def test_error(self):
+        post = mock.Mock(return_value=mock.Mock(status_code=500))
+        sink = HTTPSink('http://influx/series', post=post)
+        self.assertRaises(MetricsSinkError, sink.send, [series(1)])
@@ -1,6 +1,7 @@
+import threading
 import unittest
 
-from mozharness.base.parallel import ChunkingMixin
+from mozharness.base.parallel import ChunkingMixin, run_with_dependencies
 
 
 class TestChunkingMixin(unittest.TestCase):
@@ -24,3 +25,68 @@ class TestChunkingMixin(unittest.TestCase):
         self.assertEquals(self.c.query_chunked_list(thing, 1, 3), [1, 3, 6])
         self.assertEquals(self.c.query_chunked_list(thing, 2, 3), [4, 3])
         self.assertEquals(self.c.query_chunked_list(thing, 3, 3), [2, 6])
+
+
+class TestRunWithDependencies(unittest.TestCase):
+    def test_dependencies_respected(self):
+        finished = []
+
+        def func(item):
+            finished.append(item)
+
+        run_with_dependencies(['a', 'b', 'c'], {'b': ['a'], 'c': ['b']},
+                              func, max_workers=3)
+        self.assertEquals(finished, ['a', 'b', 'c'])
+
+    def test_independent_items_overlap(self):
+        started = threading.Event()
+
+        def func(item):
+            if item == 'a':
+                # Only returns if 'b' runs while 'a' is still running.
+                self.assertTrue(started.wait(10))
+            else:
+                started.set()
+
+        run_with_dependencies(['a', 'b'], {}, func, max_workers=2)
+
+    def test_dependents_overlap(self):
+        started = threading.Event()
+
+        def func(item):
+            if item == 'b':
+                self.assertTrue(started.wait(10))
+            elif item == 'c':
+                started.set()
+
+        # Only 'a' is ready at first; 'b' and 'c' still get a thread each.
+        run_with_dependencies(['a', 'b', 'c'], {'b': ['a'], 'c': ['a']},
+                              func, max_workers=2)
+
+    def test_many_items(self):
+        threads = set()
+
+        def func(item):
+            threads.add(threading.current_thread())
+
+        items = range(5000)
+        dependencies = dict((i, [i - 100]) for i in items[100:])
+        run_with_dependencies(items, dependencies, func, max_workers=3)
+        # The same few threads run everything.
+        self.assertTrue(len(threads) <= 3)
+
+    def test_exception_stops_scheduling(self):
+        called = []
+
+        def func(item):
+            called.append(item)
+            if item == 'a':
+                raise SystemExit(2)
+
+        self.assertRaises(SystemExit, run_with_dependencies,
+                          ['a', 'b'], {'b': ['a']}, func)
+        self.assertEquals(called, ['a'])
+
+    def test_unsatisfiable_dependencies(self):
+        self.assertRaises(ValueError, run_with_dependencies,
+                          ['a'], {'a': ['z']}, lambda item: None)
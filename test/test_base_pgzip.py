@@ -0,0 +1,64 @@
+import gzip
+import os
+import random
+import shutil
+import unittest
+import zlib
+from StringIO import StringIO
+
+from mozharness.base.pgzip import ParallelGzipWriter, gzip_file
+
+work_dir = 'test_dir'
+
+
+def make_contents(size):
+    rand = random.Random(0)
+    words = ['mochitest', 'PASS', 'TEST-UNEXPECTED-FAIL', '\n', ' ', '0x%x']
+    return ''.join([rand.choice(words) for i in range(size)])
+
+
+class TestParallelGzip(unittest.TestCase):
+    contents = make_contents(200000)
+
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def _gunzip(self, data):
+        return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+    def test_writer(self):
+        for threads in (1, 3):
+            buf = StringIO()
+            out = ParallelGzipWriter(buf, threads=threads, block_size=10000)
+            # Writes that don't line up with blocks.
+            for start in range(0, len(self.contents), 7777):
+                out.write(self.contents[start:start + 7777])
+            out.close()
+            self.assertEqual(self._gunzip(buf.getvalue()), self.contents)
+            # One gzip member, which zlib reads to the end.
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.assertEqual(d.decompress(buf.getvalue()), self.contents)
+            self.assertEqual(d.unused_data, '')
+
+    def test_empty(self):
+        buf = StringIO()
+        ParallelGzipWriter(buf, threads=2).close()
+        self.assertEqual(self._gunzip(buf.getvalue()), '')
+
+    def test_gzip_file(self):
+        src = os.path.join(work_dir, 'log.txt')
+        fh = open(src, 'wb')
+        fh.write(self.contents)
+        fh.close()
+        dest = src + '.gz'
+        gzip_file(src, dest, level=6, threads=2)
+        data = open(dest, 'rb').read()
+        self.assertEqual(self._gunzip(data), self.contents)
+        # The name, as gzip stores it.
+        self.assertEqual(data[10:18], 'log.txt\0')
+        self.assertTrue(len(data) < len(self.contents) / 2)
@@ -0,0 +1,72 @@
+import subprocess
+import unittest
+
+from mozharness.base.process import OutputPump, new_process_group, \
+    OUTPUT_TIMEOUT, TIMEOUT
+
+
+def _popen(command, **kwargs):
+    return subprocess.Popen(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, **kwargs)
+
+
+class TestOutputPump(unittest.TestCase):
+    def setUp(self):
+        self.lines = []
+        self.pump = OutputPump(chunk_size=7)
+
+    def test_lines(self):
+        p = _popen(['printf', 'foo\nbar\n\nbaz'])
+        job = self.pump.add_process(p, [(p.stdout, self.lines.extend)])
+        self.pump.run()
+        self.assertEqual(self.lines, ['foo', 'bar', '', 'baz'])
+        self.assertEqual(job.returncode, 0)
+        self.assertEqual(job.timed_out, None)
+
+    def test_separate_streams(self):
+        errors = []
+        p = subprocess.Popen(['bash', '-c', 'echo out; echo err >&2; exit 3'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        job = self.pump.add_process(p, [(p.stdout, self.lines.extend),
+                                        (p.stderr, errors.extend)])
+        self.pump.run()
+        self.assertEqual(self.lines, ['out'])
+        self.assertEqual(errors, ['err'])
+        self.assertEqual(job.returncode, 3)
+
+    def test_output_timeout(self):
+        p = _popen(['bash', '-c', 'echo start; sleep 30'],
+                   preexec_fn=new_process_group)
+        job = self.pump.add_process(p, [(p.stdout, self.lines.extend)],
+                                    output_timeout=1, kill_process_group=True)
+        self.pump.run()
+        self.assertEqual(self.lines, ['start'])
+        self.assertEqual(job.timed_out, OUTPUT_TIMEOUT)
+        self.assertNotEqual(job.returncode, 0)
+        self.assertTrue(job.end_time - job.start_time < 10)
+
+    def test_timeout(self):
+        p = _popen(['bash', '-c', 'while true; do echo tick; sleep 0.1; done'],
+                   preexec_fn=new_process_group)
+        job = self.pump.add_process(p, [(p.stdout, self.lines.extend)],
+                                    output_timeout=5, timeout=1,
+                                    kill_process_group=True)
+        self.pump.run()
+        self.assertEqual(job.timed_out, TIMEOUT)
+        self.assertTrue(self.lines)
+
+    def test_on_exit_adds_process(self):
+        def on_exit(job):
+            if len(self.pump.jobs) < 3:
+                p = _popen(['echo', str(len(self.pump.jobs))])
+                self.pump.add_process(p, [(p.stdout, self.lines.extend)],
+                                      on_exit=on_exit)
+        p = _popen(['echo', '0'])
+        self.pump.add_process(p, [(p.stdout, self.lines.extend)],
+                              on_exit=on_exit)
+        self.pump.run()
+        self.assertEqual(self.lines, ['0', '1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import unittest
+
+import mock
+
+from mozharness.base.procstats import FIELDS, ProcResourceSampler, RingBuffer
+
+work_dir = 'test_dir'
+proc_dir = os.path.join(work_dir, 'proc')
+
+DISKSTATS = """\
+   8       0 sda %(reads)d 0 %(sectors_read)d 30 %(writes)d 0 %(sectors_written)d 40 0 0 0
+   8       1 sda1 %(reads)d 0 %(sectors_read)d 30 %(writes)d 0 %(sectors_written)d 40 0 0 0
+   7       0 loop0 9 0 9 9 9 0 9 9 0 0 0
+"""
+NET_DEV = """\
+Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: 999 1 0 0 0 0 0 0 999 1 0 0 0 0 0 0
+  eth0: %(rx)d 1 0 0 0 0 0 0 %(tx)d 1 0 0 0 0 0 0
+"""
+
+
+def write_proc(busy, idle, available, reads, rx):
+    files = {
+        'stat': "cpu  %d 0 0 %d 0 0 0 0 0 0\ncpu0 0 0 0 0\n" % (busy, idle),
+        'meminfo': "MemTotal: 1000 kB\nMemFree: 10 kB\n"
+                   "MemAvailable: %d kB\n" % available,
+        'diskstats': DISKSTATS % dict(reads=reads, sectors_read=reads * 8,
+                                      writes=1, sectors_written=2),
+        os.path.join('net', 'dev'): NET_DEV % dict(rx=rx, tx=5),
+    }
+    for name, contents in files.items():
+        fh = open(os.path.join(proc_dir, name), 'w')
+        fh.write(contents)
+        fh.close()
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wrap(self):
+        ring = RingBuffer(2, 3)
+        for i in range(5):
+            ring.append((i, i * 10))
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(list(ring), [(2, 20), (3, 30), (4, 40)])
+
+
+class TestProcResourceSampler(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.makedirs(os.path.join(proc_dir, 'net'))
+        os.makedirs(os.path.join(work_dir, 'block', 'sda'))
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def test_phases(self):
+        sampler = ProcResourceSampler(
+            interval=60, proc_dir=proc_dir,
+            sys_block=os.path.join(work_dir, 'block'))
+        sampler._ticks = 1.0
+        write_proc(busy=0, idle=0, available=900, reads=0, rx=0)
+        with mock.patch('time.time', return_value=100):
+            sampler.start()
+        write_proc(busy=10, idle=10, available=900, reads=1, rx=100)
+        with mock.patch('time.time', return_value=101):
+            sampler.begin_phase('build')
+        write_proc(busy=40, idle=20, available=400, reads=3, rx=300)
+        with mock.patch('time.time', return_value=102):
+            sampler.sample()
+        write_proc(busy=40, idle=20, available=800, reads=3, rx=300)
+        with mock.patch('time.time', return_value=103):
+            sampler.finish_phase('build')
+            sampler.stop()
+
+        self.assertEqual(sampler.phases, {'build': (101, 103)})
+        self.assertEqual(sampler.aggregate_cpu_percent(phase='build'), 75.0)
+        self.assertEqual(sampler.aggregate_cpu_times().user, 40)
+        # Only whole disks count.
+        io = sampler.aggregate_io(phase='build')
+        self.assertEqual((io.read_count, io.read_bytes), (2, 2 * 8 * 512))
+        self.assertEqual(sampler.aggregate_network().rx_bytes, 300)
+        self.assertEqual(sampler.peak_memory_used(phase='build'), 600 * 1024)
+
+        path = os.path.join(work_dir, 'samples.csv')
+        sampler.write_csv(path)
+        lines = open(path).read().splitlines()
+        self.assertEqual(lines[0].split(','), list(FIELDS))
+        # A header and five samples.
+        self.assertEqual(len(lines), 6)
@@ -0,0 +1,50 @@
+import os
+import pstats
+import shutil
+import unittest
+
+from mozharness.base.profiling import Profile, StackSampler
+
+work_dir = 'test_dir'
+
+
+def busy_loop(n):
+    total = 0
+    for i in xrange(n):
+        total += i * i
+    return total
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def test_sample(self):
+        sampler = StackSampler()
+        sampler.thread_id = __import__('thread').get_ident()
+        sampler.sample()
+        self.assertEqual(sampler.samples, 1)
+        stack = sampler.stacks.keys()[0]
+        self.assertTrue(stack.split(';')[-1].startswith('sample ('))
+        self.assertTrue('test_sample (test_base_profiling.py:' in stack)
+
+    def test_profile(self):
+        profile = Profile(interval=0.001)
+        profile.start()
+        busy_loop(300000)
+        profile.stop()
+        pstats_path, folded_path = profile.dump(os.path.join(work_dir, 'p'))
+        functions = [f[2] for f in pstats.Stats(pstats_path).stats]
+        self.assertTrue('busy_loop' in functions)
+        for line in open(folded_path):
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+        self.assertTrue('busy_loop' in open(folded_path).read())
+        top = profile.top_functions(1)
+        self.assertEqual(len(top), 1)
+        self.assertTrue('(busy_loop)' in top[0])
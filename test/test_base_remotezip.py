@@ -0,0 +1,121 @@
+import BaseHTTPServer
+import os
+import random
+import re
+import shutil
+import stat
+import threading
+import unittest
+import zipfile
+from StringIO import StringIO
+
+from mozharness.base.remotezip import HTTPRangeFile, RangeNotSupported, \
+    extract_zip_members, match_members
+
+work_dir = 'test_dir'
+
+
+def make_zip():
+    buf = StringIO()
+    zf = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
+    info = zipfile.ZipInfo('bin/run.sh')
+    info.external_attr = 0755 << 16
+    zf.writestr(info, '#!/bin/sh\n')
+    rand = random.Random(0)
+    for d in ('bin', 'mochitest', 'reftest'):
+        for i in range(20):
+            # Incompressible, so the members are much bigger than the tail.
+            data = ''.join([chr(rand.randint(0, 255)) for j in range(5000)])
+            zf.writestr('%s/file%d' % (d, i), data)
+    zf.close()
+    return buf.getvalue()
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        byte_range = self.headers.get('Range')
+        server.requests.append(byte_range)
+        contents = server.contents
+        start, end = 0, len(contents) - 1
+        m = re.match(r'bytes=(\d*)-(\d*)', byte_range or '')
+        if m and not server.ignore_range:
+            if not m.group(1):
+                start = max(len(contents) - int(m.group(2)), 0)
+            else:
+                start = int(m.group(1))
+                if m.group(2):
+                    end = int(m.group(2))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(contents)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', '"test"')
+        self.end_headers()
+        self.wfile.write(contents[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRemoteZip(unittest.TestCase):
+    contents = make_zip()
+
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.contents = self.contents
+        self.server.requests = []
+        self.server.ignore_range = False
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/tests.zip' % self.server.server_port
+
+    def tearDown(self):
+        if hasattr(self, 'server'):
+            self.server.shutdown()
+            self.server.server_close()
+            del self.server
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def test_match_members(self):
+        names = ['bin/a', 'bin/sub/b', 'mochitest/c']
+        self.assertEqual(match_members(names, ['bin/*']), names[:2])
+        self.assertEqual(match_members(names), names)
+
+    def test_read(self):
+        f = HTTPRangeFile(self.url, tail_size=1000, skip_limit=1000)
+        self.assertEqual(f.size, len(self.contents))
+        f.seek(100)
+        self.assertEqual(f.read(2000), self.contents[100:2100])
+        f.seek(-1500, os.SEEK_END)
+        self.assertEqual(f.read(), self.contents[-1500:])
+        f.close()
+        self.assertEqual(self.server.requests,
+                         ['bytes=-1000', 'bytes=100-%d' % (len(self.contents) - 1001),
+                          'bytes=%d-%d' % (len(self.contents) - 1500,
+                                           len(self.contents) - 1001)])
+
+    def test_extract(self):
+        f = HTTPRangeFile(self.url, tail_size=1000)
+        zf = zipfile.ZipFile(f)
+        members = extract_zip_members(zf, work_dir, ['bin/*'])
+        f.close()
+        self.assertEqual(len(members), 21)
+        self.assertEqual(sorted(os.listdir(work_dir)), ['bin'])
+        self.assertEqual(open(os.path.join(work_dir, 'bin', 'file3'), 'rb').read(),
+                         zipfile.ZipFile(StringIO(self.contents)).read('bin/file3'))
+        mode = os.stat(os.path.join(work_dir, 'bin', 'run.sh')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0755)
+        # The tail, the central directory, then the bin/ members in one go.
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertTrue(f.bytes_received < len(self.contents) / 2)
+
+    def test_range_not_supported(self):
+        self.server.ignore_range = True
+        self.assertRaises(RangeNotSupported, HTTPRangeFile, self.url)
@@ -1,9 +1,19 @@
+import BaseHTTPServer
 import gc
+import hashlib
+import json
 import mock
 import os
 import re
+import subprocess
+import tarfile
+import threading
+import time
 import types
 import unittest
+import zipfile
+from StringIO import StringIO
+
 PYWIN32 = False
 if os.name == 'nt':
     try:
@@ -17,6 +27,7 @@ import mozharness.base.errors as errors
 import mozharness.base.log as log
 from mozharness.base.log import DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL, IGNORE
 import mozharness.base.script as script
+from mozharness.base.cache import DigestCache, DownloadCache
 from mozharness.base.config import parse_config_file
 
 test_string = '''foo
@@ -285,6 +296,52 @@ class TestHelperFunctions(unittest.TestCase):
         self.assertEqual(test_string, contents,
                          msg="get_output_from_command('cat file') differs from fh.write")
 
+    def test_get_output_from_command_tmpfiles(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        contents = self.s.get_output_from_command(
+            ["bash", "-c", "cat %s" % self.temp_file], save_tmpfiles=True)
+        self.assertEqual(test_string, contents)
+        self.assertTrue(os.path.exists('tmpfile_stdout'))
+
+    def test_get_output_from_command_head_tail(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        contents = self.s.get_output_from_command(["seq", "10"],
+                                                  head_lines=2, tail_lines=3)
+        self.assertEqual(contents, "1\n2\n8\n9\n10")
+        contents = self.s.get_output_from_command(["seq", "10"], tail_lines=1)
+        self.assertEqual(contents, "10")
+
+    def test_iter_output_from_command(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        lines = list(self.s.iter_output_from_command(["seq", "3"]))
+        self.assertEqual(lines, ["1", "2", "3"])
+
+    def test_iter_output_from_command_halt_on_failure(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        output = self.s.iter_output_from_command("echo foo; false",
+                                                 halt_on_failure=True)
+        self.assertEqual(output.next(), "foo")
+        self.assertRaises(SystemExit, list, output)
+
+    def test_iter_output_from_command_stopped_early(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        procs = []
+        popen = subprocess.Popen
+
+        def record_popen(*args, **kwargs):
+            procs.append(popen(*args, **kwargs))
+            return procs[-1]
+        with mock.patch('subprocess.Popen', side_effect=record_popen):
+            start = time.time()
+            for line in self.s.iter_output_from_command(
+                    ["bash", "-c", "echo foo; sleep 30"]):
+                break
+        # The generator's been collected; the process was killed and reaped.
+        self.assertTrue(time.time() - start < 10)
+        self.assertNotEqual(procs[0].returncode, None)
+        self.assertTrue(procs[0].stdout.closed)
+
     def test_run_command(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -293,6 +350,63 @@ class TestHelperFunctions(unittest.TestCase):
                                             cwd="test_dir"), 0,
                          msg="run_command('cat file') did not exit 0")
 
+    def test_run_command_output_timeout(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        status = self.s.run_command(["bash", "-c", "echo foo; sleep 30"],
+                                    output_timeout=1)
+        self.assertNotEqual(status, 0)
+
+    def test_run_command_timeout(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        status = self.s.run_command(["bash", "-c", "sleep 30"], timeout=1)
+        self.assertNotEqual(status, 0)
+
+    def test_run_commands(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        results = self.s.run_commands([
+            {'command': ['bash', '-c', 'sleep 0.5; echo one'], 'name': 'one'},
+            {'command': 'echo ERROR two; exit 3', 'success_codes': [3],
+             'error_list': [{'substr': 'ERROR', 'level': ERROR}]},
+            {'command': 'true', 'cwd': '/this_dir_should_not_exist'},
+        ], max_workers=2)
+        self.assertEqual([r['name'] for r in results], ['one', '1', '2'])
+        self.assertEqual([r['returncode'] for r in results], [0, 3, -1])
+        self.assertEqual([r['num_errors'] for r in results], [0, 1, 0])
+        self.assertEqual([r['worst_log_level'] for r in results],
+                         [INFO, ERROR, ERROR])
+        self.assertTrue(results[0]['wall_time'] >= 0.5)
+
+    def test_command_usage(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.s.run_command(['python', '-c', 'x = " " * 50000000'])
+        self.s.get_output_from_command(['echo', 'hi'])
+        self.s.get_output_from_command(['echo', 'hi'], save_tmpfiles=True)
+        self.s.run_commands([{'command': 'true'}])
+        usages = [usage for action, usage in self.s.command_usages]
+        self.assertEqual(len(usages), 4)
+        self.assertTrue(usages[0].max_rss > 50000000)
+        self.assertTrue(usages[0].cpu_time() > 0)
+        self.assertEqual(usages[2].command, ['echo', 'hi'])
+        self.s.summarize_command_usage(count=1)
+        self.assertEqual(len(self.s.summary_list), 2)
+        self.assertEqual(self.s.summary_list[0]['message'],
+                         "Most expensive of 4 commands in no action:")
+        self.assertTrue(self.s.summary_list[1]['message'].startswith(
+            "  python -c "))
+
+    def test_command_usage_pre_config_lock(self):
+        class PreLockScript(script.BaseScript):
+            def _pre_config_lock(self, rw_config):
+                self.get_output_from_command(['echo', 'hi'])
+        self.s = PreLockScript(initial_config_file='test/test.json')
+        self.assertEqual(self.s.command_usages[0][0], None)
+
+    def test_run_commands_halt_on_failure(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.assertRaises(SystemExit, self.s.run_commands,
+                          [{'command': 'true'}, {'command': 'false'}],
+                          halt_on_failure=True)
+
     def test_move1(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -319,6 +433,100 @@ class TestHelperFunctions(unittest.TestCase):
                          msg="%s and %s are different sizes after copyfile()" %
                              (self.temp_file, temp_file2))
 
+    def _make_tree(self, root, files):
+        for name, contents in files.items():
+            path = os.path.join(root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fh = open(path, 'w')
+            fh.write(contents)
+            fh.close()
+
+    def _read_tree(self, root):
+        tree = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                tree[os.path.relpath(path, root)] = open(path).read()
+        return tree
+
+    def test_copytree(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        src_files = {'a': 'src a', 'sub/b': 'src b', 'sub/deep/c': 'src c',
+                     'new/d': 'src d'}
+        dest_files = {'a': 'dest a', 'sub/b': 'dest b', 'sub/x': 'dest x',
+                      'y': 'dest y'}
+        self._make_tree('test_dir/src', src_files)
+        for overwrite, expected in (
+            ('no_overwrite', {'a': 'dest a', 'sub/b': 'dest b',
+                              'sub/deep/c': 'src c', 'sub/x': 'dest x',
+                              'new/d': 'src d', 'y': 'dest y'}),
+            # sub is replaced as a whole.
+            ('overwrite_if_exists', dict(src_files, y='dest y')),
+            ('clobber', src_files),
+        ):
+            self.s.rmtree('test_dir/dest')
+            self._make_tree('test_dir/dest', dest_files)
+            self.assertEqual(self.s.copytree('test_dir/src', 'test_dir/dest',
+                                             overwrite=overwrite, workers=2),
+                             None)
+            self.assertEqual(self._read_tree('test_dir/dest'), expected,
+                             msg=overwrite)
+
+    def test_copytree_workers(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self._make_tree('test_dir/src', dict([('d%d/f%d' % (i % 10, i), 'x')
+                                              for i in range(150)]))
+        for workers, min_files, threads in ((1, 100, None), (4, 200, None),
+                                            (4, 100, 4)):
+            self.s.rmtree('test_dir/dest')
+            with mock.patch('mozharness.base.script.COPYTREE_MIN_PARALLEL_FILES',
+                            min_files):
+                with mock.patch('mozharness.base.script.run_with_dependencies',
+                                wraps=script.run_with_dependencies) as run:
+                    self.s.copytree('test_dir/src', 'test_dir/dest',
+                                    workers=workers)
+            if threads:
+                self.assertEqual(run.call_args[1], {'max_workers': threads})
+            else:
+                # Small trees, and single workers, don't need threads.
+                self.assertFalse(run.called)
+            self.assertEqual(self._read_tree('test_dir/dest'),
+                             self._read_tree('test_dir/src'))
+
+    def test_copytree_links(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self._make_tree('test_dir/src', {'a': 'a', 'sub/b': 'b'})
+        os.symlink('a', 'test_dir/src/link')
+        self.s.copytree('test_dir/src', 'test_dir/hardlinked', link='hardlink',
+                        symlinks=True)
+        self.assertTrue(os.path.samefile('test_dir/src/sub/b',
+                                         'test_dir/hardlinked/sub/b'))
+        self.assertEqual(os.readlink('test_dir/hardlinked/link'), 'a')
+        # reflinks fall back to copies where they aren't supported.
+        self.s.copytree('test_dir/src', 'test_dir/reflinked', link='reflink')
+        self.assertFalse(os.path.samefile('test_dir/src/sub/b',
+                                          'test_dir/reflinked/sub/b'))
+        self.assertFalse(os.path.islink('test_dir/reflinked/link'))
+        self.assertEqual(self._read_tree('test_dir/reflinked'),
+                         {'a': 'a', 'sub/b': 'b', 'link': 'a'})
+
+    def test_unpack(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        zip_path = 'test_dir/test.zip'
+        zf = zipfile.ZipFile(zip_path, 'w')
+        zf.write(self.temp_file, 'bin/mozilla')
+        zf.write(self.temp_file, 'other/mozilla')
+        zf.close()
+        self.assertEqual(self.s.unpack(zip_path, 'test_dir/out',
+                                       extract_dirs=['bin/*']), 0)
+        self.assertEqual(os.listdir('test_dir/out'), ['bin'])
+        self.assertEqual(self.s.read_from_file('test_dir/out/bin/mozilla'),
+                         test_string)
+        self.assertEqual(self.s.unpack(self.temp_file, 'test_dir/out',
+                                       error_level=ERROR), -1)
+
     def test_existing_rmtree(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -357,6 +565,18 @@ class TestHelperFunctions(unittest.TestCase):
         self.assertFalse(os.path.exists('test_dir'),
                          msg="rmtree unsuccessful")
 
+    def test_deferred_rmtree(self):
+        self._create_temp_file()
+        os.mkdir('test_dir/trash')
+        os.mkdir('test_dir/build')
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.s.query_trash_dir = lambda path: os.path.abspath('test_dir/trash')
+        with mock.patch.object(script, 'start_background_delete') as start:
+            self.assertEqual(self.s.rmtree('test_dir/build', defer=True), None)
+        self.assertFalse(os.path.exists('test_dir/build'))
+        start.assert_called_once_with(os.path.abspath('test_dir/trash'))
+        self.assertEqual(len(os.listdir('test_dir/trash')), 1)
+
     @unittest.skipIf(os.name == "nt", "Not for Windows")
     def test_chmod(self):
         self._create_temp_file()
@@ -808,6 +1028,299 @@ class TestScriptDecorators(unittest.TestCase):
         self.assertEqual(len(self.s.post_run_1_args), 1)
         self.assertEqual(len(self.s.post_run_2_args), 1)
 
+    def test_parallel_actions(self):
+        self.s = BaseScriptWithDecorators(
+            initial_config_file='test/test.json',
+            all_actions=['clobber', 'download', 'build'],
+            action_dependencies={'build': []},
+            config={'parallel_actions': 2},
+        )
+        self.s.download = lambda: None
+        self.s.run()
+
+        self.assertEqual(len(self.s.pre_action_1_args), 3)
+        self.assertEqual(len(self.s.post_action_1_args), 3)
+        for args, kwargs in self.s.post_action_1_args:
+            self.assertEqual(kwargs, dict(success=True))
+        self.assertEqual(self.s.query_action_dependencies(), {
+            'clobber': [],
+            'download': ['clobber'],
+            'build': [],
+        })
+
+    def test_parallel_actions_exception(self):
+        self.s = BaseScriptWithDecorators(
+            initial_config_file='test/test.json',
+            all_actions=['clobber', 'build'],
+            action_dependencies={'build': []},
+            config={'parallel_actions': 2},
+        )
+        self.s.raise_during_build = 'Testing parallel post always fired.'
+
+        with self.assertRaises(SystemExit):
+            self.s.run()
+
+        self.assertEqual(len(self.s.post_action_1_args), 2)
+        self.assertEqual(len(self.s.post_run_1_args), 1)
+
+    def test_profile_actions(self):
+        self.s = BaseScriptWithDecorators(initial_config_file='test/test.json',
+                                          config={'profile_actions': ['build']})
+        self.s.run()
+        upload_dir = self.s.query_abs_dirs()['abs_upload_dir']
+        profiles = [f for f in os.listdir(upload_dir)
+                    if f.startswith('profile-')]
+        self.assertEqual(sorted(profiles),
+                         ['profile-build.folded', 'profile-build.pstats'])
+        self.assertTrue(self.s.summary_list[0]['message'].startswith(
+            'Profile of build'))
+
+    def test_profile_run(self):
+        self.s = BaseScriptWithDecorators(initial_config_file='test/test.json',
+                                          config={'profile_actions': ['run']})
+        self.assertEqual(self.s._listeners['pre_run'][0], '_start_run_profile')
+        self.s.run()
+        upload_dir = self.s.query_abs_dirs()['abs_upload_dir']
+        self.assertTrue('profile-run.pstats' in os.listdir(upload_dir))
+
+    def test_trace(self):
+        self.s = BaseScriptWithDecorators(initial_config_file='test/test.json',
+                                          config={'trace': True})
+        self.s.build = lambda: self.s.run_command(['true'])
+        self.s.run()
+        trace_file = os.path.join(self.s.query_abs_dirs()['abs_log_dir'],
+                                  'trace.json')
+        events = json.load(open(trace_file))['traceEvents']
+        spans = [(e['cat'], e['name']) for e in events if e['ph'] == 'X']
+        self.assertEqual(spans, [('action', 'clobber'), ('action', 'build'),
+                                 ('command', 'true')])
+        self.assertEqual(self.s.command_usages[0][0], 'build')
+        self.assertEqual(self.s.summary_list[0]['message'],
+                         "Most expensive of 1 commands in build:")
+
+    def test_bad_action_dependencies(self):
+        with self.assertRaises(SystemExit):
+            BaseScriptWithDecorators(
+                initial_config_file='test/test.json',
+                action_dependencies={'clobber': ['build']},
+            )
+
+
+# TestDownloadFile {{{1
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves server.contents, honoring Range headers (and If-Range) unless
+    server.ignore_range is set; server.fail_after, if set, is the number of
+    bytes to send before dropping the first connection, after which
+    server.contents becomes server.changed_contents, if that's set.
+    """
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        contents = server.contents
+        etag = '"test-%d"' % len(contents)
+        start, end = 0, len(contents) - 1
+        m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        if m and not server.ignore_range and if_range in (None, etag):
+            start = int(m.group(1))
+            if m.group(2):
+                end = int(m.group(2))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(contents)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        body = contents[start:end + 1]
+        if server.fail_after:
+            body = body[:server.fail_after]
+            server.fail_after = None
+            if server.changed_contents:
+                server.contents = server.changed_contents
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadFile(unittest.TestCase):
+    contents = ''.join([chr(i % 251) for i in range(100000)])
+
+    def setUp(self):
+        cleanup()
+        os.mkdir('test_dir')
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                RangeRequestHandler)
+        self.server.contents = self.contents
+        self.server.requests = []
+        self.server.ignore_range = False
+        self.server.fail_after = None
+        self.server.changed_contents = None
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/file.zip' % self.server.server_port
+        self.file_name = os.path.join('test_dir', 'file.zip')
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        del(self.s)
+        cleanup()
+
+    def _download(self, **kwargs):
+        status = self.s.download_file(self.url, file_name=self.file_name,
+                                      retry_config={'sleeptime': 0},
+                                      **kwargs)
+        self.assertEqual(status, self.file_name)
+        fh = open(self.file_name, 'rb')
+        self.assertEqual(fh.read(), self.contents)
+        fh.close()
+
+    def test_download_file(self):
+        self._download()
+        self.assertEqual(self.server.requests, [None])
+
+    def test_resume(self):
+        self.server.fail_after = 30000
+        self._download()
+        self.assertEqual(self.server.requests, [None, 'bytes=30000-99999'])
+
+    def test_resume_range_ignored(self):
+        self.server.fail_after = 30000
+        self.server.ignore_range = True
+        self._download()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_resume_changed(self):
+        self.server.fail_after = 30000
+        self.contents = self.server.changed_contents = self.contents * 2
+        self._download()
+        self.assertEqual(self.server.requests, [None, 'bytes=30000-99999'])
+
+    @mock.patch('mozharness.base.script.DOWNLOAD_RANGE_MIN_SIZE', 10000)
+    def test_connections(self):
+        self._download(connections=4)
+        self.assertEqual(sorted(self.server.requests),
+                         ['bytes=0-', 'bytes=25000-49999',
+                          'bytes=50000-74999', 'bytes=75000-99999'])
+
+    def test_download_cache(self):
+        self.s.download_cache = DownloadCache('test_dir/cache')
+        self._download()
+        self._download()
+        # The second time only to check the cached copy is current.
+        self.assertEqual(self.server.requests, [None, None])
+        cache = self.s.query_download_cache()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_download_cache_changed(self):
+        self.s.download_cache = DownloadCache('test_dir/cache')
+        self._download()
+        self.contents = self.server.contents = self.contents[::-1] + 'more'
+        self._download()
+        cache = self.s.query_download_cache()
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        # And the new copy is cached in turn.
+        self._download()
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_digests(self):
+        self.server.fail_after = 30000
+        self._download(digests=['sha1'])
+        self.assertEqual(self.s.query_recorded_digests(self.file_name),
+                         {'sha512': hashlib.sha512(self.contents).hexdigest(),
+                          'sha1': hashlib.sha1(self.contents).hexdigest()})
+
+    def test_sha512_mismatch(self):
+        status = self.s.download_file(self.url, file_name=self.file_name,
+                                      retry_config={'sleeptime': 0,
+                                                    'attempts': 2},
+                                      sha512='0' * 128)
+        self.assertEqual(status, None)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertFalse(os.path.exists(self.file_name))
+
+    def test_copyfile_digests(self):
+        self._download()
+        sha512 = self.s.query_recorded_digest(self.file_name)
+        copy = os.path.join('test_dir', 'copy.zip')
+        with mock.patch('mozharness.base.script.file_digests') as file_digests:
+            self.s.copyfile(self.file_name, copy)
+            self.assertEqual(self.s.query_file_digest(copy), sha512)
+            self.assertFalse(file_digests.called)
+        self.s.copyfile(self.file_name, copy + '.gz', compress=True,
+                        digests=['sha1'])
+        fh = open(copy + '.gz', 'rb')
+        self.assertEqual(self.s.query_recorded_digest(copy + '.gz', 'sha1'),
+                         hashlib.sha1(fh.read()).hexdigest())
+        fh.close()
+
+    @mock.patch('mozharness.base.script.DOWNLOAD_RANGE_MIN_SIZE', 10000)
+    def test_connections_digests(self):
+        sha512 = hashlib.sha512(self.contents).hexdigest()
+        self._download(connections=4, sha512=sha512)
+        self.assertEqual(self.s.query_recorded_digest(self.file_name), sha512)
+
+    def test_digest_cache(self):
+        self._download()
+        os.utime(self.file_name, (time.time() - 60, time.time() - 60))
+        self.s.digest_cache = DigestCache('test_dir/digests.json')
+        digests = self.s.query_file_digests(self.file_name, ['sha512', 'md5'])
+        self.assertEqual(digests['md5'], hashlib.md5(self.contents).hexdigest())
+        # A later run finds them without reading the file.
+        other = script.BaseScript(initial_config_file='test/test.json')
+        other.digest_cache = DigestCache('test_dir/digests.json')
+        with mock.patch('mozharness.base.cache.file_digests') as file_digests:
+            self.assertEqual(other.query_file_digest(self.file_name, 'md5'),
+                             digests['md5'])
+            self.assertFalse(file_digests.called)
+
+    def test_download_unpack(self):
+        buf = StringIO()
+        tar = tarfile.open(fileobj=buf, mode='w:bz2')
+        info = tarfile.TarInfo('sdk/bin/run')
+        info.size = len(test_string)
+        tar.addfile(info, StringIO(test_string))
+        tar.close()
+        self.server.contents = buf.getvalue()
+        self.s.download_cache = DownloadCache('test_dir/cache')
+        url = self.url.replace('file.zip', 'sdk.tar.bz2')
+        for i in range(2):
+            self.assertEqual(self.s.download_unpack(url, 'test_dir/out'), 0)
+            self.assertEqual(self.s.read_from_file('test_dir/out/sdk/bin/run'),
+                             test_string)
+        # The second time comes from the cache, once the server says it's
+        # unchanged.
+        self.assertEqual(self.server.requests, [None, None])
+        self.assertEqual(self.s.download_cache.hits, 1)
+        self.assertEqual(os.listdir('test_dir'), ['cache', 'out'])
+
+    def test_script_mixin_only(self):
+        # e.g. Proxxy and the VCS helpers, which aren't BaseScripts.
+        obj = CleanupObj()
+        status = obj.download_file(self.url, file_name=self.file_name,
+                                   retry_config={'sleeptime': 0})
+        self.assertEqual(status, self.file_name)
+        sha512 = hashlib.sha512(self.contents).hexdigest()
+        self.assertEqual(obj.query_file_digest(self.file_name), sha512)
+        copy = os.path.join('test_dir', 'copy.zip')
+        obj.copyfile(self.file_name, copy)
+        self.assertEqual(obj.query_recorded_digest(copy), sha512)
+
+    @mock.patch('mozharness.base.script.DOWNLOAD_RANGE_MIN_SIZE', 10000)
+    def test_connections_range_ignored(self):
+        self.server.ignore_range = True
+        self._download(connections=4)
+        self.assertEqual(self.server.requests, ['bytes=0-'])
+
 
 # main {{{1
 if __name__ == '__main__':
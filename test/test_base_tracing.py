@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import threading
+import unittest
+
+from mozharness.base.tracing import Tracer, describe, traced
+
+work_dir = 'test_dir'
+
+
+class Traced(object):
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def query_tracer(self):
+        return self.tracer
+
+    @traced('command')
+    def run_command(self, command, fail=False):
+        if fail:
+            raise ValueError(command)
+        return 0
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def test_describe(self):
+        self.assertEqual(describe(['make', '-j4']), 'make -j4')
+        self.assertEqual(len(describe('x' * 1000)), 200)
+        # Arguments from json configs are unicode.
+        self.assertEqual(describe(['echo', u'caf\xe9', 'caf\xc3\xa9']),
+                         u'echo caf\xe9 caf\xe9')
+
+    def test_write_unicode(self):
+        tracer = Tracer()
+        obj = Traced(tracer)
+        obj.run_command([u'echo', u'\u2603'])
+        path = os.path.join(work_dir, 'trace.json')
+        tracer.write(path)
+        names = [e['name'] for e in json.load(open(path))['traceEvents']
+                 if e['ph'] == 'X']
+        self.assertEqual(names, [u'echo \u2603'])
+
+    def test_spans(self):
+        tracer = Tracer()
+        with tracer.span('build', 'action') as args:
+            args['extra'] = 1
+            thread = threading.Thread(target=tracer.add_span, name='worker',
+                                      args=('sleep', 'retry', 10, 20))
+            thread.start()
+            thread.join()
+        path = os.path.join(work_dir, 'trace.json')
+        tracer.write(path)
+        events = json.load(open(path))['traceEvents']
+        names = [e['args']['name'] for e in events if e['ph'] == 'M']
+        self.assertEqual(sorted(names), ['MainThread', 'worker'])
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in spans], ['sleep', 'build'])
+        self.assertEqual(spans[0]['dur'], 10)
+        self.assertEqual(spans[1]['args'], {'extra': 1})
+
+    def test_traced(self):
+        obj = Traced(Tracer())
+        self.assertEqual(obj.run_command(['hg', 'pull']), 0)
+        self.assertRaises(ValueError, obj.run_command, ['false'], fail=True)
+        self.assertEqual([(e['name'], e['args']) for e in obj.tracer.events], [
+            ('hg pull', {'method': 'run_command', 'result': 0}),
+            ('false', {'method': 'run_command'}),
+        ])
+        obj.tracer = None
+        self.assertEqual(obj.run_command(['true']), 0)
@@ -0,0 +1,93 @@
+import imp
+import os
+import shutil
+import unittest
+
+import mock
+
+from mozharness.base.trash import LOCK_NAME, empty_trash, move_to_trash, \
+    pending_bytes, query_trash_dir, start_background_delete, _try_lock
+
+work_dir = os.path.abspath('test_dir')
+trash_dir = os.path.join(work_dir, 'trash')
+
+
+class TestTrash(unittest.TestCase):
+    def setUp(self):
+        self.tearDown()
+        os.mkdir(work_dir)
+
+    def tearDown(self):
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+    def _make_tree(self, name):
+        path = os.path.join(work_dir, name)
+        os.makedirs(os.path.join(path, 'sub'))
+        fh = open(os.path.join(path, 'sub', 'data'), 'wb')
+        fh.write('x' * 100000)
+        fh.close()
+        # Read-only, like some checkouts leave behind.
+        os.chmod(os.path.join(path, 'sub'), 0555)
+        return path
+
+    def test_query_trash_dir(self):
+        trash = query_trash_dir(self._make_tree('build'))
+        self.assertEqual(os.path.basename(trash), '.trash')
+        self.assertEqual(os.stat(os.path.dirname(trash)).st_dev,
+                         os.stat(work_dir).st_dev)
+
+    def test_query_trash_dir_top(self):
+        build = self._make_tree(os.path.join('slave', 'builder', 'build'))
+        top = os.path.join(work_dir, 'slave')
+        self.assertEqual(query_trash_dir(build, top=top),
+                         os.path.join(top, '.trash'))
+        self.assertEqual(query_trash_dir(build),
+                         os.path.join(top, 'builder', '.trash'))
+        # Not under top: no climbing.
+        self.assertEqual(query_trash_dir(top, top=top),
+                         os.path.join(work_dir, '.trash'))
+
+    def test_purge_builds(self):
+        purge_builds = imp.load_source(
+            'purge_builds', os.path.join(os.path.dirname(__file__), '..',
+                                         'external_tools', 'purge_builds.py'))
+        move_to_trash(self._make_tree('build'), trash_dir)
+        # As if start_background_delete()'s process were at it.
+        fd = os.open(os.path.join(trash_dir, LOCK_NAME), os.O_RDWR | os.O_CREAT)
+        try:
+            self.assertTrue(_try_lock(fd))
+            self.assertEqual(purge_builds.empty_trash([trash_dir]), [trash_dir])
+            self.assertEqual(len(os.listdir(trash_dir)), 2)
+            pending = purge_builds.pending_bytes([trash_dir])
+            self.assertTrue(pending >= 100000)
+            with mock.patch.object(purge_builds, 'freespace', return_value=10):
+                self.assertEqual(
+                    purge_builds.available_space(work_dir, [trash_dir]),
+                    10 + pending)
+        finally:
+            os.close(fd)
+        self.assertEqual(purge_builds.empty_trash([trash_dir]), [])
+        self.assertEqual(os.listdir(trash_dir), [LOCK_NAME])
+
+    def test_move_and_empty(self):
+        first = move_to_trash(self._make_tree('build'), trash_dir)
+        second = move_to_trash(self._make_tree('build'), trash_dir)
+        self.assertNotEqual(first, second)
+        self.assertFalse(os.path.exists(os.path.join(work_dir, 'build')))
+        self.assertTrue(os.path.isfile(os.path.join(first, 'sub', 'data')))
+        self.assertTrue(pending_bytes(trash_dir) >= 200000)
+        self.assertTrue(empty_trash(trash_dir))
+        self.assertEqual(os.listdir(trash_dir), [LOCK_NAME])
+        self.assertEqual(pending_bytes(trash_dir), 0)
+
+    def test_move_missing(self):
+        self.assertRaises(OSError, move_to_trash,
+                          os.path.join(work_dir, 'nope'), trash_dir)
+        self.assertEqual(os.listdir(trash_dir), [])
+
+    def test_background_delete(self):
+        move_to_trash(self._make_tree('build'), trash_dir)
+        proc = start_background_delete(trash_dir)
+        self.assertEqual(proc.wait(), 0)
+        self.assertEqual(os.listdir(trash_dir), [LOCK_NAME])